@@ -0,0 +1,265 @@
+import contextlib
+import io
+import json
+import logging.config
+import os
+import platform
+import sys
+import tempfile
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from objects.grid import Grid
+import draw_image as di
+import eval
+import export
+import instrumentation
+import math_functions as mf
+import process
+
+logger = logging.getLogger('main')
+
+# The file with the baseline, written in the mode 'record' and compared in the mode 'compare'
+BASELINE_JSON: str = 'benchmarks/baseline.json'
+# The file with the results of the last run
+RESULTS_JSON: str = 'benchmarks/results.json'
+# 'record' saves the results as new baseline, 'compare' compares them with the baseline. The first argument of the
+# command line overrides it
+MODE: str = 'compare'
+# A stage is a regression if it takes more than (1 + THRESHOLD) times the time of the baseline
+THRESHOLD: float = 0.2
+# Stages faster than this (in seconds) in the baseline are not compared, their times are mostly noise
+MIN_SECONDS: float = 0.01
+# Every configuration runs this often, the fastest time of every stage is kept
+REPEATS: int = 3
+# The synthetic datasets, see make_dataset
+DATASETS: list = ['blobs', 'atom']
+# The configuration every scaling sweep starts from
+BASE: dict = {'N': 5000, 'D': 20, 'ROWS': 32, 'spread': 0.5}
+# Every value is tested with the other values of BASE
+SCALING: dict = {'N': [2000, 20000],
+                 'D': [5, 100],
+                 'ROWS': [22, 62]}
+# If False, the topogram and the evaluation are not timed, they are the slowest stages
+DRAW_AND_EVALUATE: bool = True
+
+
+def make_dataset(dataset, number_of_points, dimension, spread, seed=0):
+    """
+    Generates a synthetic dataset
+    :param dataset: 'blobs' for five gaussian clusters with centers in [0, 4)^dimension, or 'atom' for a dense core
+    in a sphere with radius 1 (like the Atom dataset of the FCPS)
+    :param number_of_points: the number of points
+    :param dimension: the number of dimensions
+    :param spread: the standard deviation of the clusters, or of the core and the thickness of the sphere
+    :param seed: the seed of the random numbers
+    :return: a matrix (points x dimensions)
+    """
+    rng = np.random.default_rng(seed)
+    if dataset == 'blobs':
+        centers = rng.uniform(0, 4, (5, dimension))
+        return centers[rng.integers(0, 5, number_of_points)] + rng.normal(0, spread, (number_of_points, dimension))
+    if dataset == 'atom':
+        core = rng.normal(0, spread * 0.2, (number_of_points // 2, dimension))
+        directions = rng.normal(size=(number_of_points - len(core), dimension))
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        shell = directions * (1 + rng.normal(0, spread * 0.2, len(directions)))[:, None]
+        return np.concatenate((core, shell))
+    raise ValueError("Unknown dataset '%s'" % dataset)
+
+
+def write_input(path, data):
+    """
+    Writes a dataset as input csv. The x and y coordinates are the first two principal components, scaled to the
+    inner cells of the grid.
+    :param path: the path of the csv
+    :param data: the matrix (points x dimensions)
+    """
+    centered = data - data.mean(axis=0)
+    _, vectors = np.linalg.eigh(centered.T @ centered)
+    reduction = centered @ vectors[:, ::-1][:, :2]
+    if reduction.shape[1] < 2:
+        reduction = np.concatenate((reduction, np.zeros((len(data), 1))), axis=1)
+    spans = np.ptp(reduction, axis=0)
+    reduction = 0.01 + 0.98 * (reduction - reduction.min(axis=0)) / np.where(spans > 0, spans, 1)
+
+    table = pd.DataFrame(np.concatenate((reduction, data), axis=1), index=np.arange(1, len(data) + 1))
+    table.to_csv(path, header=False)
+
+
+def calc_configurations(datasets, base, scaling):
+    """
+    Calculates the configurations of the scaling sweeps, every value of scaling changes one value of base
+    :param datasets: the names of the datasets
+    :param base: the configuration every sweep starts from
+    :param scaling: a dictionary with a list of values for the keys of base
+    :return: a list of configurations, without duplicates
+    """
+    configurations = []
+    for dataset in datasets:
+        for name, values in [(None, [None])] + list(scaling.items()):
+            for value in values:
+                configuration = dict(base, dataset=dataset)
+                if name is not None:
+                    configuration[name] = value
+                if configuration not in configurations:
+                    configurations.append(configuration)
+    return configurations
+
+
+@contextlib.contextmanager
+def _stage(name, failed):
+    """
+    Times one stage with the instrumentation, a failed stage is logged and added to failed
+    :param name: the name of the stage
+    :param failed: the list of failed stages
+    """
+    try:
+        with instrumentation.phase(name):
+            yield
+    except Exception as error:
+        logger.warning("Stage '%s' failed: '%s'", name, error)
+        failed.append(name)
+
+
+def run_configuration(configuration, directory, draw_and_evaluate=True):
+    """
+    Runs every stage of the pipeline once for a configuration
+    :param configuration: a dictionary with dataset, N, D, ROWS and spread
+    :param directory: the directory for the input and output files
+    :param draw_and_evaluate: if False the topogram and the evaluation are skipped
+    :return: the wall and cpu time of every stage, the counters and the failed stages
+    """
+    input_csv = os.path.join(directory, 'input.csv')
+    output_csv = os.path.join(directory, 'result.csv')
+    write_input(input_csv, make_dataset(configuration['dataset'], configuration['N'], configuration['D'],
+                                        configuration['spread']))
+
+    failed = []
+    instrumentation.enable()
+    try:
+        with _stage('read_csv', failed):
+            input_dataset = pd.read_csv(input_csv, index_col=0, header=None)
+        grid = Grid.autogenerated(rows=configuration['ROWS'], dimension=configuration['D'])
+        with _stage('init_points_to_right_cell', failed):
+            grid.init_points_to_right_cell(input_dataset)
+        with _stage('calc_representative', failed):
+            for cell in grid.list_of_cells:
+                cell.calc_representative()
+            for cell in grid.list_of_cells:
+                cell.calc_representative(cells_with_points=False, empty_cells=True)
+
+        cell_ids = np.arange(len(grid.list_of_cells))
+        with _stage('calc_localerror', failed):
+            grid.localerrors[:] = mf.calc_localerrors(grid, cell_ids)
+        with _stage('calc_mountain_height', failed):
+            grid.heights[:] = mf.calc_mountain_heights(grid, cell_ids)
+        with _stage('calc_neighbourhood', failed):
+            grid.calc_neighbourhoods(process.MAX_DISTANCE * (1 / grid.rows), cell_ids=cell_ids)
+        with _stage('shift_points', failed):
+            for cell in grid.sort_and_cut(percent=process.CUT_LIST_AT, searchparameter=lambda cell: cell.ICV):
+                cell.shift_points()
+        with _stage('manipulate_representative', failed):
+            grid.representatives[:] = mf.calc_manipulated_representatives(grid, cell_ids)
+        with _stage('export', failed):
+            export.write_result_csv(grid, output_csv)
+
+        if draw_and_evaluate:
+            with _stage('draw_topogram', failed):
+                di.draw_topogram(grid, filename=os.path.join(directory, 'topogram.png'))
+            plt.close('all')
+            # the evaluation prints its results, they are not part of the benchmark
+            with contextlib.redirect_stdout(io.StringIO()):
+                with _stage('eval_grid_distances', failed):
+                    distances = eval.calc_grid_distances(grid, only_occupied=True)
+                with _stage('eval_disttodist', failed):
+                    eval.disttodist(distances, grid, input_csv, output_csv)
+                with _stage('eval_neighborhood_preservation', failed):
+                    eval.calc_neighborhood_preservation(distances, grid, input_csv, output_csv)
+
+        record = instrumentation.emit()
+    finally:
+        instrumentation.disable()
+
+    stages = {name: {'wall': timer['wall'], 'cpu': timer['cpu']} for name, timer in record['phases'].items()
+              if name not in failed}
+    return {'stages': stages, 'counters': record['counters'], 'failed': failed}
+
+
+def run_benchmark(configurations, repeats=1, draw_and_evaluate=True):
+    """
+    Runs every configuration repeats times
+    :param configurations: the configurations, see calc_configurations
+    :param repeats: the number of runs of every configuration, the fastest time of every stage is kept
+    :param draw_and_evaluate: if False the topogram and the evaluation are skipped
+    :return: the results, with the environment and one entry for every configuration
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for configuration in configurations:
+            runs = [run_configuration(configuration, directory, draw_and_evaluate) for _ in range(repeats)]
+            stages = {}
+            for run in runs:
+                for name, timer in run['stages'].items():
+                    if name not in stages or timer['wall'] < stages[name]['wall']:
+                        stages[name] = timer
+            results.append(dict(configuration, stages=stages, counters=runs[0]['counters'],
+                                failed=sorted({name for run in runs for name in run['failed']})))
+            logger.info("Benchmark of '%s' finished", configuration)
+
+    environment = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                   'processor': platform.processor(), 'cpus': os.cpu_count()}
+    return {'environment': environment, 'results': results}
+
+
+def compare(baseline, current, threshold=0.2, min_seconds=0.01):
+    """
+    Compares the times of every stage with the baseline
+    :param baseline: the results of run_benchmark used as baseline
+    :param current: the results of run_benchmark to check
+    :param threshold: a stage is a regression if it takes more than (1 + threshold) times the time of the baseline
+    :param min_seconds: stages faster than this in the baseline are not compared
+    :return: a table with one row for every compared stage, the column regression marks the regressions
+    """
+    def key(result):
+        return result['dataset'], result['N'], result['D'], result['ROWS'], result['spread']
+
+    baselines = {key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        if key(result) not in baselines:
+            continue
+        for name, timer in result['stages'].items():
+            before = baselines[key(result)]['stages'].get(name)
+            if before is None or before['wall'] < min_seconds:
+                continue
+            ratio = timer['wall'] / before['wall']
+            rows.append({'dataset': result['dataset'], 'N': result['N'], 'D': result['D'], 'ROWS': result['ROWS'],
+                         'spread': result['spread'], 'stage': name, 'baseline': before['wall'],
+                         'current': timer['wall'], 'ratio': ratio, 'regression': ratio > 1 + threshold})
+    return pd.DataFrame(rows, columns=['dataset', 'N', 'D', 'ROWS', 'spread', 'stage', 'baseline', 'current',
+                                       'ratio', 'regression'])
+
+
+if __name__ == '__main__':
+
+    logging.config.fileConfig(fname='logger_config.ini', disable_existing_loggers=False)
+    mode = sys.argv[1] if len(sys.argv) > 1 else MODE
+
+    current = run_benchmark(calc_configurations(DATASETS, BASE, SCALING), REPEATS, DRAW_AND_EVALUATE)
+    os.makedirs(os.path.dirname(RESULTS_JSON), exist_ok=True)
+    with open(RESULTS_JSON, 'w') as file:
+        json.dump(current, file, indent=1)
+
+    if mode == 'record':
+        with open(BASELINE_JSON, 'w') as file:
+            json.dump(current, file, indent=1)
+        print("Baseline saved to '%s'" % BASELINE_JSON)
+    else:
+        with open(BASELINE_JSON) as file:
+            table = compare(json.load(file), current, THRESHOLD, MIN_SECONDS)
+        print(table.to_string(index=False))
+        regressions = table[table['regression']]
+        if len(regressions):
+            print("'%i' stages are more than '%i%%' slower than the baseline" % (len(regressions), THRESHOLD * 100))
+            sys.exit(1)
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
+from objects.grid import Grid
+from objects.pointstore import PointStore
+
+logger = logging.getLogger('main')
+
+# the file with the description of the current state in a checkpoint directory
+MANIFEST = 'manifest.json'
+# the version of the format, a checkpoint with another version can not be read
+VERSION = 2
+
+
+def has_checkpoint(path):
+    """
+    Checks if a directory contains a checkpoint
+    :param path: the checkpoint directory
+    :return: True if a checkpoint can be read from the directory
+    """
+    return path is not None and os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _save(directory, name, array):
+    """
+    Saves one array as .npy and makes sure it is on the disk
+    :param directory: the directory of the state
+    :param name: the name of the array
+    :param array: the array
+    :return: the shape and dtype of the array for the manifest
+    """
+    array = np.asarray(array)
+    with open(os.path.join(directory, name + '.npy'), 'wb') as file:
+        np.save(file, array, allow_pickle=False)
+        file.flush()
+        os.fsync(file.fileno())
+    return {'shape': list(array.shape), 'dtype': array.dtype.str}
+
+
+def write_checkpoint(grid, path, iteration, cell_ids=None, info=None):
+    """
+    This method writes the state of the grid and its points to a checkpoint directory. Every array is saved as its
+    own .npy file in a new state directory. After all files are written, the manifest is replaced by one atomic
+    rename, so the checkpoint is always the old or the new state, even if the process is killed while writing.
+    The old state directories are removed after that.
+    :param grid: the grid
+    :param path: the checkpoint directory
+    :param iteration: the number of finished iterations
+    :param cell_ids: the ids of the cells for the next iteration, if None all cells are used
+    :param info: a dictionary with more information for the resume, it must be json serializable
+    :return: the path of the new state directory
+    """
+    os.makedirs(path, exist_ok=True)
+    state = tempfile.mkdtemp(prefix='state-', dir=path)
+
+    arrays = {}
+    for name in Grid.ARRAYS:
+        arrays['grid.' + name] = _save(state, 'grid.' + name, getattr(grid, name))
+    if cell_ids is not None:
+        arrays['cell_ids'] = _save(state, 'cell_ids', np.asarray(cell_ids, dtype=np.int64))
+
+    if grid.points is not None:
+        for name in PointStore.ARRAYS:
+            arrays['points.' + name] = _save(state, 'points.' + name, getattr(grid.points, name))
+        # the points of every cell in their order, as one array and the offset of every cell in this array
+        counts = np.array([len(indices) for indices in grid.cell_points], dtype=np.int64)
+        arrays['cell_point_offsets'] = _save(state, 'cell_point_offsets', np.concatenate(([0], np.cumsum(counts))))
+        arrays['cell_point_indices'] = _save(state, 'cell_point_indices',
+                                             np.concatenate(grid.cell_points).astype(np.int64))
+
+    manifest = {'version': VERSION,
+                'state': os.path.basename(state),
+                'iteration': iteration,
+                'rows': grid.rows,
+                'columns': grid.columns,
+                'dimension': grid.dimension,
+                'arrays': arrays,
+                'info': info or {}}
+
+    tmp = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp, 'w') as file:
+        json.dump(manifest, file, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+    for name in os.listdir(path):
+        if name.startswith('state-') and name != manifest['state']:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    logger.info("Checkpoint after iteration '%i' written to '%s'", iteration, state)
+    return state
+
+
+def read_checkpoint(path, mmap_mode='c'):
+    """
+    This method reads the grid and its points from a checkpoint directory. The arrays are memory mapped, so
+    nothing is parsed or copied up front. With the default mmap_mode 'c' changes of the arrays stay in memory and
+    never change the checkpoint.
+    :param path: the checkpoint directory
+    :param mmap_mode: see numpy.load, None reads all arrays into memory
+    :return: the grid and a dictionary with the number of finished iterations ('iteration'), the ids of the cells
+    for the next iteration ('cell_ids', None for all cells) and the info of write_checkpoint
+    """
+    with open(os.path.join(path, MANIFEST)) as file:
+        manifest = json.load(file)
+    if manifest['version'] != VERSION:
+        raise ValueError("The checkpoint '%s' has version '%s', expected '%s'" % (path, manifest['version'], VERSION))
+
+    state = os.path.join(path, manifest['state'])
+
+    def load(name):
+        return np.load(os.path.join(state, name + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+
+    grid = Grid.from_arrays(manifest['rows'], manifest['dimension'],
+                            {name: load('grid.' + name) for name in Grid.ARRAYS}, columns=manifest['columns'])
+
+    if 'points.data' in manifest['arrays']:
+        grid.points = PointStore.from_arrays({name: load('points.' + name) for name in PointStore.ARRAYS})
+        grid.points.grid = grid
+        offsets = np.load(os.path.join(state, 'cell_point_offsets.npy'))
+        grid.cell_points = np.split(load('cell_point_indices'), offsets[1:-1])
+
+    resume = dict(manifest['info'])
+    resume['iteration'] = manifest['iteration']
+    resume['cell_ids'] = np.load(os.path.join(state, 'cell_ids.npy')) if 'cell_ids' in manifest['arrays'] else None
+
+    logger.info("Checkpoint after iteration '%i' read from '%s'", manifest['iteration'], state)
+    return grid, resume
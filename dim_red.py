@@ -1,74 +1,464 @@
+import hashlib
+import inspect
+import json
+import logging.config
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+import numpy as np
 import pandas as pd
-from sklearn import preprocessing, manifold, datasets, decomposition
+import sklearn
+from sklearn import preprocessing, manifold, datasets, decomposition, random_projection
+from sklearn.metrics.pairwise import euclidean_distances
+
+logger = logging.getLogger('main')
+
 
-from enum import Enum
 class Method(Enum):
     PCA = 1
     ISOMAP = 2
     TSNE = 3
     MDS = 4
+    # the following methods read the input in chunks of CHUNKSIZE rows and never hold all of it in memory
+    INCREMENTAL_PCA = 5
+    RANDOM_PROJECTION = 6
+    SPARSE_RANDOM_PROJECTION = 7
+    # embed a sample of LANDMARKS rows and project the other rows onto it
+    LANDMARK_ISOMAP = 8
+    LANDMARK_MDS = 9
+    # t-SNE on the first TSNE_COMPONENTS principal components, with the neighbours searched on all cores
+    FAST_TSNE = 10
+
 
 class Dataset(Enum):
     IRIS = 1
     CALIFORNIA_HOUSING = 2
     BREAS_CANCER_WISCONSIN = 3
 
+
 # PARAMETER
-OUTPUT_CSV : str = 'atom_pca.csv'
-DR_METHOD : enumerate = Method.PCA
-DATASET : enumerate or str = "example/atom.csv"
-
-
-
-
-# load dataset
-# IRIS
-if DATASET == Dataset.IRIS:
-    iris = datasets.load_iris()
-    data_scaled = pd.DataFrame(iris.data, columns=iris.feature_names)
-    #data_scaled = pd.DataFrame(preprocessing.scale(data_scaled), columns=data_scaled.columns)
-
-# CALIFORNIA HOUSING
-elif DATASET == Dataset.CALIFORNIA_HOUSING:
-    data = datasets.fetch_california_housing()
-    data_scaled = pd.DataFrame(data=data.data, columns=data.feature_names)
-    #data_scaled = pd.DataFrame(preprocessing.scale(data_scaled), columns=data_scaled.columns)
-
-# BREAST CANCER WISCONSIN
-elif DATASET == Dataset.BREAS_CANCER_WISCONSIN:
-    data = datasets.load_breast_cancer()
-    data_scaled = pd.DataFrame(data=data.data, columns=data.feature_names)
-    #data_scaled = pd.DataFrame(preprocessing.scale(data_scaled), columns=data_scaled.columns)
-
-
-else:
-    data_scaled = pd.read_csv(DATASET)
-    
-    # UCI Isolet
-    #data_scaled = pd.read_csv('example/isolet.csv')
-
-# Approaches
-
-if DR_METHOD is Method.PCA:
-    X_r = decomposition.PCA(n_components=2).fit_transform(data_scaled)
-elif DR_METHOD is Method.ISOMAP:
-    X_r = manifold.Isomap().fit_transform(data_scaled)
-elif DR_METHOD is Method.TSNE:
-    X_r = manifold.TSNE(n_components=2, random_state=1).fit_transform(data_scaled)
-elif DR_METHOD is Method.MDS:
-    X_r = manifold.MDS().fit_transform(data_scaled)
-else:
-    print("IOERROR")
-    raise IOError
-    pass
-# Normalizing with MinMax
-#X_r = preprocessing.MinMaxScaler().fit_transform(X_r)
-
-# Simple Scale
-X_r = (X_r-X_r.min())/(X_r.max()-X_r.min())
-
-tmp = pd.DataFrame(X_r, columns=['dred1', 'dred2'])
-new_csv = pd.concat([tmp, data_scaled], axis=1)
-print(new_csv)
-pd.DataFrame.to_csv(new_csv, OUTPUT_CSV, index=int, header=None)
+OUTPUT_CSV: str = 'atom_pca.csv'
+DR_METHOD: enumerate = Method.PCA
+DATASET: enumerate or str = "example/atom.csv"
+# Number of rows read, reduced and written at once
+CHUNKSIZE: int = 10000
+# Number of rows embedded by LANDMARK_ISOMAP and LANDMARK_MDS, all other rows are projected onto them
+LANDMARKS: int = 2000
+# Seed of the random numbers (t-SNE, MDS, random projections and the choice of the landmarks)
+RANDOM_STATE: int = 1
+# Number of principal components FAST_TSNE reduces to before t-SNE
+TSNE_COMPONENTS: int = 50
+# The gradient of FAST_TSNE: 'barnes_hut' (O(N log N)) or 'exact' (O(N^2), only for small datasets)
+TSNE_METHOD: str = 'barnes_hut'
+# Number of cores for the neighbour search of FAST_TSNE, -1 for all cores
+N_JOBS: int = -1
+# Directory of the cache of the reductions, if None nothing is cached
+CACHE_DIR: str or None = '.dim_red_cache'
+# The least recently used reductions are removed if the cache is larger (in bytes)
+CACHE_MAX_BYTES: int = 2 ** 30
+# If set, these methods are compared: every method is run in a worker process and written to its own csv, the name
+# of the method is appended to OUTPUT_CSV (e.g. atom_pca_tsne.csv)
+COMPARE_METHODS: list or None = None
+# Number of worker processes for COMPARE_METHODS, if None the number of cpus
+WORKERS: int or None = None
+
+# the parameters of reduce that change the result of a method, they are part of the key of the cache
+RESULT_PARAMETERS = {Method.PCA: ('random_state',),
+                     Method.ISOMAP: (),
+                     Method.TSNE: ('random_state',),
+                     Method.MDS: ('random_state',),
+                     Method.INCREMENTAL_PCA: ('chunksize',),
+                     Method.RANDOM_PROJECTION: ('random_state',),
+                     Method.SPARSE_RANDOM_PROJECTION: ('random_state',),
+                     Method.LANDMARK_ISOMAP: ('landmarks', 'random_state'),
+                     Method.LANDMARK_MDS: ('landmarks', 'random_state'),
+                     Method.FAST_TSNE: ('random_state', 'tsne_components', 'tsne_method')}
+
+
+def load_dataset(dataset):
+    """
+    Loads a whole dataset
+    :param dataset: a Dataset or the path of a csv with header
+    :return: the dataset as DataFrame
+    """
+    # IRIS
+    if dataset == Dataset.IRIS:
+        iris = datasets.load_iris()
+        data_scaled = pd.DataFrame(iris.data, columns=iris.feature_names)
+        #data_scaled = pd.DataFrame(preprocessing.scale(data_scaled), columns=data_scaled.columns)
+
+    # CALIFORNIA HOUSING
+    elif dataset == Dataset.CALIFORNIA_HOUSING:
+        data = datasets.fetch_california_housing()
+        data_scaled = pd.DataFrame(data=data.data, columns=data.feature_names)
+        #data_scaled = pd.DataFrame(preprocessing.scale(data_scaled), columns=data_scaled.columns)
+
+    # BREAST CANCER WISCONSIN
+    elif dataset == Dataset.BREAS_CANCER_WISCONSIN:
+        data = datasets.load_breast_cancer()
+        data_scaled = pd.DataFrame(data=data.data, columns=data.feature_names)
+        #data_scaled = pd.DataFrame(preprocessing.scale(data_scaled), columns=data_scaled.columns)
+
+    else:
+        data_scaled = pd.read_csv(dataset)
+
+        # UCI Isolet
+        #data_scaled = pd.read_csv('example/isolet.csv')
+
+    return data_scaled
+
+
+def read_chunks(dataset, chunksize):
+    """
+    Reads a dataset in chunks of rows, a csv is never read as a whole
+    :param dataset: a Dataset or the path of a csv with header
+    :param chunksize: the number of rows of a chunk
+    :return: a generator of DataFrames, the index continues over the chunks
+    """
+    if isinstance(dataset, Dataset):
+        data_scaled = load_dataset(dataset)
+        for start in range(0, len(data_scaled), chunksize):
+            yield data_scaled.iloc[start:start + chunksize]
+    else:
+        yield from pd.read_csv(dataset, chunksize=chunksize)
+
+
+def sample_rows(dataset, size, chunksize, random_state=None):
+    """
+    Draws rows of a dataset with the same probability for every row, without holding more than size + chunksize
+    rows in memory. Every row gets a random key, the rows with the smallest keys are the sample.
+    :param dataset: a Dataset or the path of a csv with header
+    :param size: the number of rows to draw, all rows if the dataset is smaller
+    :param chunksize: the number of rows read at once
+    :param random_state: the seed of the random numbers
+    :return: the sample as matrix (rows x dimensions)
+    """
+    random = np.random.RandomState(random_state)
+    sample = None
+    keys = None
+    for chunk in read_chunks(dataset, chunksize):
+        values = chunk.values
+        chunk_keys = random.random_sample(len(values))
+        if sample is None:
+            sample, keys = values, chunk_keys
+        else:
+            sample, keys = np.concatenate((sample, values)), np.concatenate((keys, chunk_keys))
+        if len(keys) > size:
+            keep = np.argpartition(keys, size - 1)[:size]
+            sample, keys = sample[keep], keys[keep]
+    return sample
+
+
+def calc_landmark_mds(landmarks):
+    """
+    Classical MDS of the landmarks (Landmark MDS, de Silva and Tenenbaum). The other rows are placed by
+    project_landmark_mds with their distances to the landmarks.
+    :param landmarks: the landmarks as matrix (landmarks x dimensions)
+    :return: the coordinates of the landmarks (landmarks x 2), the projection matrix (landmarks x 2) and the mean
+    of the squared distances to every landmark
+    """
+    squared_distances = euclidean_distances(landmarks, squared=True)
+    mean_squared_distances = squared_distances.mean(axis=0)
+    centered = squared_distances - mean_squared_distances - squared_distances.mean(axis=1)[:, None] \
+        + mean_squared_distances.mean()
+    eigenvalues, eigenvectors = np.linalg.eigh(-0.5 * centered)
+    eigenvalues, eigenvectors = eigenvalues[::-1][:2], eigenvectors[:, ::-1][:, :2]
+    eigenvalues = np.maximum(eigenvalues, 1e-12)
+    return eigenvectors * np.sqrt(eigenvalues), eigenvectors / np.sqrt(eigenvalues), mean_squared_distances
+
+
+def project_landmark_mds(values, landmarks, projection, mean_squared_distances):
+    """
+    Places rows with their distances to the landmarks, see calc_landmark_mds
+    :param values: the rows as matrix (rows x dimensions)
+    :param landmarks: the landmarks as matrix (landmarks x dimensions)
+    :param projection: the projection matrix of calc_landmark_mds
+    :param mean_squared_distances: the mean of the squared distances of calc_landmark_mds
+    :return: the coordinates of the rows (rows x 2)
+    """
+    squared_distances = euclidean_distances(values, landmarks, squared=True)
+    return -0.5 * (squared_distances - mean_squared_distances) @ projection
+
+
+def reduce(method, dataset, chunksize=CHUNKSIZE, landmarks=LANDMARKS, random_state=RANDOM_STATE,
+           tsne_components=TSNE_COMPONENTS, tsne_method=TSNE_METHOD, n_jobs=N_JOBS):
+    """
+    Reduces a dataset to two dimensions. PCA, ISOMAP, TSNE and MDS load the whole dataset, the other methods read
+    it in chunks (twice: once to fit and once to transform) and only hold the result in memory.
+    :param method: the Method
+    :param dataset: a Dataset or the path of a csv with header
+    :param chunksize: the number of rows read at once
+    :param landmarks: the number of landmarks of LANDMARK_ISOMAP and LANDMARK_MDS
+    :param random_state: the seed of the random numbers
+    :param tsne_components: the number of principal components of FAST_TSNE
+    :param tsne_method: the gradient of FAST_TSNE, 'barnes_hut' or 'exact'
+    :param n_jobs: the number of cores for the neighbour search of FAST_TSNE, -1 for all cores
+    :return: the reduction as matrix (rows x 2), not scaled
+    """
+    # Approaches
+    if method is Method.PCA:
+        # large inputs are reduced with the randomized solver
+        return decomposition.PCA(n_components=2, random_state=random_state).fit_transform(load_dataset(dataset))
+    elif method is Method.ISOMAP:
+        return manifold.Isomap().fit_transform(load_dataset(dataset))
+    elif method is Method.TSNE:
+        return manifold.TSNE(n_components=2, random_state=random_state).fit_transform(load_dataset(dataset))
+    elif method is Method.MDS:
+        return manifold.MDS(random_state=random_state).fit_transform(load_dataset(dataset))
+    elif method is Method.FAST_TSNE:
+        values = load_dataset(dataset).values
+        # the neighbour search of t-SNE is much faster in less dimensions, the first principal components keep
+        # most of the distances
+        if tsne_components < min(values.shape):
+            values = decomposition.PCA(n_components=tsne_components, svd_solver='randomized',
+                                       random_state=random_state).fit_transform(values)
+        return manifold.TSNE(n_components=2, method=tsne_method, n_jobs=n_jobs,
+                             random_state=random_state).fit_transform(values)
+
+    elif method is Method.INCREMENTAL_PCA:
+        model = decomposition.IncrementalPCA(n_components=2)
+        # every partial fit needs at least two rows, so the last chunk is fitted together with the one before
+        previous = None
+        for chunk in read_chunks(dataset, chunksize):
+            if previous is not None and len(chunk) >= 2:
+                model.partial_fit(previous)
+                previous = chunk.values
+            else:
+                previous = chunk.values if previous is None else np.concatenate((previous, chunk.values))
+        model.partial_fit(previous)
+        transform = model.transform
+
+    elif method in (Method.RANDOM_PROJECTION, Method.SPARSE_RANDOM_PROJECTION):
+        if method is Method.RANDOM_PROJECTION:
+            model = random_projection.GaussianRandomProjection(n_components=2, random_state=random_state)
+        else:
+            model = random_projection.SparseRandomProjection(n_components=2, dense_output=True,
+                                                             random_state=random_state)
+        # the projection only depends on the number of dimensions
+        model.fit(next(read_chunks(dataset, 2)).values)
+        transform = model.transform
+
+    elif method is Method.LANDMARK_ISOMAP:
+        model = manifold.Isomap().fit(sample_rows(dataset, landmarks, chunksize, random_state))
+        transform = model.transform
+
+    elif method is Method.LANDMARK_MDS:
+        sample = sample_rows(dataset, landmarks, chunksize, random_state)
+        _, projection, mean_squared_distances = calc_landmark_mds(sample)
+
+        def transform(values):
+            return project_landmark_mds(values, sample, projection, mean_squared_distances)
+
+    else:
+        print("IOERROR")
+        raise IOError
+
+    return np.concatenate([transform(chunk.values) for chunk in read_chunks(dataset, chunksize)])
+
+
+def calc_digest(dataset):
+    """
+    Hashes the content of a dataset
+    :param dataset: a Dataset or the path of a csv with header
+    :return: the sha256 of the csv as hex string, the name of a Dataset
+    """
+    if isinstance(dataset, Dataset):
+        return dataset.name
+    digest = hashlib.sha256()
+    with open(dataset, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def calc_cache_key(digest, method, parameters):
+    """
+    Calculates the key of a reduction in the cache
+    :param digest: the hash of the dataset, see calc_digest
+    :param method: the Method
+    :param parameters: the parameters of reduce, only the ones in RESULT_PARAMETERS are part of the key
+    :return: the key as hex string
+    """
+    description = {'dataset': digest, 'method': method.name, 'sklearn': sklearn.__version__,
+                   'parameters': {name: parameters[name] for name in RESULT_PARAMETERS[method]}}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def read_cache(cache_dir, key):
+    """
+    Reads a reduction from the cache and marks it as recently used
+    :param cache_dir: the directory of the cache
+    :param key: the key, see calc_cache_key
+    :return: the reduction, None if it is not in the cache
+    """
+    path = os.path.join(cache_dir, key + '.npy')
+    try:
+        reduction = np.load(path)
+        os.utime(path)
+    except (FileNotFoundError, ValueError):
+        # missing, removed by another process or not completely written
+        return None
+    return reduction
+
+
+def write_cache(cache_dir, key, reduction, max_bytes):
+    """
+    Saves a reduction in the cache and removes the least recently used reductions until the cache is not larger
+    than max_bytes, the new reduction is never removed. A reduction larger than max_bytes is not saved. The file is
+    renamed to its final name after it is written, so other processes never read a half written reduction.
+    :param cache_dir: the directory of the cache
+    :param key: the key, see calc_cache_key
+    :param reduction: the reduction
+    :param max_bytes: the maximal size of the cache
+    """
+    if reduction.nbytes > max_bytes:
+        logger.info("Reduction with '%i' bytes is larger than the cache '%s'", reduction.nbytes, cache_dir)
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npy')
+    file, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    with os.fdopen(file, 'wb') as file:
+        np.save(file, reduction)
+    # the header of the file counts, too
+    if os.path.getsize(tmp) > max_bytes:
+        logger.info("Reduction with '%i' bytes is larger than the cache '%s'", os.path.getsize(tmp), cache_dir)
+        os.remove(tmp)
+        return
+    os.replace(tmp, path)
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npy'):
+            try:
+                status = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime, status.st_size, entry.path))
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, entry_path in sorted(entries):
+        if size <= max_bytes:
+            break
+        if entry_path == path:
+            continue
+        try:
+            os.remove(entry_path)
+            logger.info("'%s' removed from the cache", entry_path)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+
+
+def reduce_cached(method, dataset, cache_dir=None, max_bytes=2 ** 30, digest=None, **parameters):
+    """
+    Like reduce, but a reduction of the same content with the same method and parameters is read from the cache
+    :param method: the Method
+    :param dataset: a Dataset or the path of a csv with header
+    :param cache_dir: the directory of the cache, if None nothing is cached
+    :param max_bytes: the maximal size of the cache
+    :param digest: the hash of the dataset, see calc_digest. If None it is calculated
+    :param parameters: the parameters of reduce
+    :return: the reduction as matrix (rows x 2), not scaled
+    """
+    if cache_dir is None:
+        return reduce(method, dataset, **parameters)
+    # the parameters with the defaults of reduce
+    arguments = inspect.signature(reduce).bind(method, dataset, **parameters)
+    arguments.apply_defaults()
+    parameters = {name: value for name, value in arguments.arguments.items() if name not in ('method', 'dataset')}
+    key = calc_cache_key(digest or calc_digest(dataset), method, parameters)
+    reduction = read_cache(cache_dir, key)
+    if reduction is not None:
+        logger.info("Reduction with '%s' read from the cache '%s'", method.name, cache_dir)
+        return reduction
+    reduction = reduce(method, dataset, **parameters)
+    write_cache(cache_dir, key, reduction, max_bytes)
+    return reduction
+
+
+def _reduce_cached(task):
+    """
+    Runs reduce_cached in a worker process
+    :param task: the arguments of reduce_cached, the parameters as dictionary
+    :return: the reduction
+    """
+    method, dataset, cache_dir, max_bytes, digest, parameters = task
+    return reduce_cached(method, dataset, cache_dir, max_bytes, digest, **parameters)
+
+
+def reduce_methods(methods, dataset, workers=None, cache_dir=None, max_bytes=2 ** 30, **parameters):
+    """
+    Reduces a dataset with several methods at the same time, every method runs in a worker process and uses the
+    cache like reduce_cached
+    :param methods: the list of methods
+    :param dataset: a Dataset or the path of a csv with header
+    :param workers: the number of worker processes, the default is the number of cpus
+    :param cache_dir: the directory of the cache, if None nothing is cached
+    :param max_bytes: the maximal size of the cache
+    :param parameters: the parameters of reduce
+    :return: a dictionary with the reduction of every method
+    """
+    digest = calc_digest(dataset) if cache_dir is not None else None
+    tasks = [(method, dataset, cache_dir, max_bytes, digest, parameters) for method in methods]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(methods, pool.map(_reduce_cached, tasks)))
+
+
+def calc_output_csv(output_csv, method):
+    """
+    Appends the name of a method to the name of the output file
+    :param output_csv: the path of the csv
+    :param method: the Method
+    :return: the new path
+    """
+    root, extension = os.path.splitext(output_csv)
+    return '%s_%s%s' % (root, method.name.lower(), extension)
+
+
+def scale(reduction):
+    """
+    Scales a reduction to [0, 1], both dimensions with the same factor
+    :param reduction: the reduction as matrix (rows x 2)
+    :return: the scaled reduction
+    """
+    # Normalizing with MinMax
+    #X_r = preprocessing.MinMaxScaler().fit_transform(X_r)
+
+    # Simple Scale
+    return (reduction - reduction.min()) / (reduction.max() - reduction.min())
+
+
+def write_output(dataset, reduction, output_csv, chunksize=10000):
+    """
+    Writes the input file of process.py: a csv with index and without header, the first two columns are the
+    reduction (dred1 and dred2), followed by the columns of the dataset. The dataset is read again in chunks.
+    :param dataset: a Dataset or the path of a csv with header
+    :param reduction: the scaled reduction as matrix (rows x 2)
+    :param output_csv: the path of the csv
+    :param chunksize: the number of rows written at once
+    """
+    start = 0
+    with open(output_csv, 'w', newline='') as file:
+        for chunk in read_chunks(dataset, chunksize):
+            tmp = pd.DataFrame(reduction[start:start + len(chunk)], columns=['dred1', 'dred2'], index=chunk.index)
+            pd.concat([tmp, chunk], axis=1).to_csv(file, header=False)
+            start += len(chunk)
+    if start != len(reduction):
+        raise ValueError("'%i' rows reduced, but '%i' rows written" % (len(reduction), start))
+
+
+if __name__ == '__main__':
+
+    logging.config.fileConfig(fname='logger_config.ini', disable_existing_loggers=False)
+
+    parameters = {'chunksize': CHUNKSIZE, 'landmarks': LANDMARKS, 'random_state': RANDOM_STATE,
+                  'tsne_components': TSNE_COMPONENTS, 'tsne_method': TSNE_METHOD, 'n_jobs': N_JOBS}
+    if COMPARE_METHODS:
+        reductions = reduce_methods(COMPARE_METHODS, DATASET, WORKERS, CACHE_DIR, CACHE_MAX_BYTES, **parameters)
+    else:
+        reductions = {DR_METHOD: reduce_cached(DR_METHOD, DATASET, CACHE_DIR, CACHE_MAX_BYTES, **parameters)}
 
+    for method, X_r in reductions.items():
+        output_csv = calc_output_csv(OUTPUT_CSV, method) if COMPARE_METHODS else OUTPUT_CSV
+        write_output(DATASET, scale(X_r), output_csv, CHUNKSIZE)
+        logger.info("'%i' rows reduced with '%s' and written to '%s'", len(X_r), method.name, output_csv)
@@ -1,59 +1,137 @@
+import hashlib
 import logging
+import os
+from collections import OrderedDict
 import matplotlib.pyplot as plt
+import matplotlib.tri as tri
+import pandas as pd
 import scipy.ndimage as sp
 import numpy as np
+import export
+import math_functions as mf
 
 logger = logging.getLogger(__name__)
 
+# Number of triangulations of input files kept for the next topograms
+TRIANGULATION_CACHE_SIZE: int = 4
 
-def draw_topogram(grid, inputfile=None, drawcenters=False, drawpoints=None, levelcount=7, colormap='gist_earth',):
+# the triangulations of the points of the last input files, by the hash of their coordinates
+_triangulations = OrderedDict()
+
+
+def calc_lattice_heights(grid, grid_x_axis, grid_y_axis):
+    """
+    Resamples the heights of the cells at the points of a regular mesh. The cells lie on a regular lattice, so the
+    heights are interpolated bilinear between the four cells around every point of the mesh.
+    :param grid: the grid
+    :param grid_x_axis: the x coordinates of the mesh
+    :param grid_y_axis: the y coordinates of the mesh
+    :return: the heights as matrix (y x x)
+    """
+    # the first row of the lattice is the upper one
+    lattice = grid.heights.reshape(grid.columns, grid.rows)
+    width_x = (grid.posx.max() - grid.posx.min()) / max(grid.rows - 1, 1)
+    width_y = (grid.posy.max() - grid.posy.min()) / max(grid.columns - 1, 1)
+    mesh_x, mesh_y = np.meshgrid(grid_x_axis, grid_y_axis)
+    return mf.calc_bilinear(lattice, (grid.posy.max() - mesh_y) / width_y, (mesh_x - grid.posx.min()) / width_x)
+
+
+def get_triangulation(x_coordinates, y_coordinates):
+    """
+    Returns the Delaunay triangulation of points. The last TRIANGULATION_CACHE_SIZE triangulations are cached, so
+    topograms of the same points with other heights do not triangulate again.
+    :param x_coordinates: the x coordinates of the points
+    :param y_coordinates: the y coordinates of the points
+    :return: the triangulation
+    """
+    x_coordinates = np.ascontiguousarray(x_coordinates, dtype=float)
+    y_coordinates = np.ascontiguousarray(y_coordinates, dtype=float)
+    key = hashlib.sha1(x_coordinates.tobytes() + y_coordinates.tobytes()).hexdigest()
+    if key in _triangulations:
+        _triangulations.move_to_end(key)
+        return _triangulations[key]
+
+    triangulation = tri.Triangulation(x_coordinates, y_coordinates)
+    _triangulations[key] = triangulation
+    while len(_triangulations) > TRIANGULATION_CACHE_SIZE:
+        _triangulations.popitem(last=False)
+    return triangulation
+
+
+def calc_point_heights(x_coordinates, y_coordinates, z_coordinates, grid_x_axis, grid_y_axis):
+    """
+    Interpolates the heights of scattered points linear at the points of a regular mesh
+    :param x_coordinates: the x coordinates of the points
+    :param y_coordinates: the y coordinates of the points
+    :param z_coordinates: the heights of the points
+    :param grid_x_axis: the x coordinates of the mesh
+    :param grid_y_axis: the y coordinates of the mesh
+    :return: the heights as masked matrix (y x x), points of the mesh outside of the points are masked
     """
-    This method draws a topogram of a grid.
+    interpolator = tri.LinearTriInterpolator(get_triangulation(x_coordinates, y_coordinates), z_coordinates)
+    mesh_x, mesh_y = np.meshgrid(grid_x_axis, grid_y_axis)
+    return interpolator(mesh_x, mesh_y)
+
+
+def calc_point_coordinates(points):
+    """
+    Returns the coordinates of points
+    :param points: a list of Datapoints or a matrix (points x 2) with the x and y coordinates
+    :return: the x coordinates and the y coordinates
+    """
+    if isinstance(points, np.ndarray):
+        return points[:, 0], points[:, 1]
+    return np.array([x.x_axis for x in points]), np.array([x.y_axis for x in points])
+
+
+def draw_topogram(grid, inputfile=None, drawcenters=False, drawpoints=None, levelcount=7, colormap='gist_earth',
+                  filename='images/topogram.png'):
+    """
+    This method draws a topogram of a grid and saves it, the figure is closed afterwards. The heights of the cells
+    are resampled directly from the lattice of the grid, the points of an input file are triangulated (see
+    get_triangulation).
     :param grid: the grid to visualize
-    :param inputfile: if a file is given, we use the points in this csv instead of the grid.
+    :param inputfile: if a file is given, we use the points in this csv (or binary result of
+    export.write_result_columns) instead of the grid.
     :param drawcenters: if True, the topogram shows the centerpoints of the cells
-    :param drawpoints: the topogram shows the given data points
+    :param drawpoints: the topogram shows the given data points, Datapoints or a matrix (points x 2)
     :param levelcount: the levelcount is uses to set how many layers the contour plot will have. The default is 7
     :param colormap: the colormap to use. The default is gist_earth
+    :param filename: the path of the image, the format is given by the extension
     :return: It draws the topogram
     """
 
-
-    points = []
-    if inputfile:
-        for line in open(inputfile):
-            list = line.split(",")
-            points.append([list[1], list[2], list[3]])
-    else:
-        for cell in grid.list_of_cells:
-            points.append([cell.posx, cell.posy, cell.height])
-
-    from matplotlib.mlab import griddata  # interpolation of my data for better mountains
-
-    # matplotlib.griddata needs numPy arrays, so we change the data type to numpy array.
-    array_with_x_coordinates = np.array([x[0] for x in points])
-    array_with_y_coordinates = np.array([x[1] for x in points])
-    array_with_z_coordinates = np.array([x[2] for x in points])
-
     # define grid
     grid_x_axis = np.linspace(0, 1, 80)
     grid_y_axis = np.linspace(0, 1, 80)
 
+    if inputfile:
+        if os.path.isdir(inputfile):
+            # binary result of export.write_result_columns, only x, y and the heights are read
+            columns = export.read_result_columns(inputfile, ('dred1', 'dred2', 'heights'))
+            points = np.stack([columns['dred1'], columns['dred2'], columns['heights']], axis=1)
+        else:
+            points = pd.read_csv(inputfile, header=None, usecols=[1, 2, 3]).values
+        points = np.asarray(points, dtype=float)
+        array_with_x_coordinates = points[:, 0]
+        array_with_y_coordinates = points[:, 1]
+        zi = calc_point_heights(array_with_x_coordinates, array_with_y_coordinates, points[:, 2], grid_x_axis,
+                                grid_y_axis)
+    else:
+        array_with_x_coordinates = grid.posx
+        array_with_y_coordinates = grid.posy
+        zi = calc_lattice_heights(grid, grid_x_axis, grid_y_axis)
+
     fig = plt.figure()
     ax = fig.gca()
     # ax.set_xticks(grid_x_axis)
     # ax.set_yticks(grid_y_axis)
-    plt.title('griddata')
-
-    # grid the data.
-    # noinspection PyTypeChecker
-    zi = griddata(array_with_x_coordinates, array_with_y_coordinates, array_with_z_coordinates, grid_x_axis,
-                  grid_y_axis, interp='linear')
+    plt.title('topogram')
 
     # contour the gridded data, plotting dots at the nonuniform data points.
     plt.contour(grid_x_axis, grid_y_axis, zi, levelcount, linewidths=0.2, colors='k')
     plt.contourf(grid_x_axis, grid_y_axis, zi, levelcount, vmax=abs(zi).max(), vmin=-abs(zi).max(),
-                 cmap=plt.cm.get_cmap(colormap))
+                 cmap=colormap)
 
     # draw colorbar
     plt.colorbar()
@@ -62,79 +140,65 @@ def draw_topogram(grid, inputfile=None, drawcenters=False, drawpoints=None, leve
     if drawcenters:
         plt.scatter(array_with_x_coordinates, array_with_y_coordinates, marker='o', s=5, zorder=10)
 
-    if drawpoints:
-        ax.scatter([x.x_axis for x in drawpoints], [x.y_axis for x in drawpoints], marker='o', s=1, zorder=10,
-                   color='#fb2943')
+    if drawpoints is not None and len(drawpoints):
+        x_points, y_points = calc_point_coordinates(drawpoints)
+        ax.scatter(x_points, y_points, marker='o', s=1, zorder=10, color='#fb2943')
 
     # plt.grid()
-    plt.savefig('images/topogram.png', papertype='a4', dpi=300)
-    plt.show()
+    plt.savefig(filename, dpi=300)
+    plt.close(fig)
 
-def draw_heatmap(grid, heights=False, gaussian=False, cm='gist_earth'):
+def draw_heatmap(grid, heights=False, gaussian=False, cm='gist_earth', filename='images/localheatmap.png'):
     """
-    This method draws a heatmap. The default is to visualize the localerrors for every cell.
+    This method draws a heatmap and saves it, the figure is closed afterwards. The default is to visualize the
+    localerrors for every cell.
     :param grid: the grid to visualize
     :param heights: If heights is true, the heights will be used instead of the localerror.
     :param gaussian: If gaussian is true, the visualizing will be blured.
     :param cm: the colormap to use. The default is gist earth
-    :return: it shows the map
+    :param filename: the path of the image, the format is given by the extension
+    :return: it saves the map
     """
 
-    tmp = []
-    counter = 0
-    array = []
-
-    for neuron in grid.list_of_cells:
-        counter += 1
-        if not heights:
-            if not len(neuron.list_of_points):
-                tmp.append(0)
-            else:
-                tmp.append(neuron.localerror)
-        else:
-            tmp.append(neuron.height)
-        if counter == grid.rows:
-            array.append(tmp)
-            tmp = []
-            counter = 0
-
-    error_map = np.array(array)
-    if gaussian:
-        error_map = sp.filters.gaussian_filter(error_map, sigma=2, order=0)
-
+    # one row of the map for every row of the lattice, cells without points have no localerror
     if not heights:
-        fig = plt.imshow(error_map, cmap=cm, interpolation='nearest', vmin=0)
-        cb = plt.colorbar()
-        cb.set_label('localerror')
+        error_map = np.where(grid.point_counts > 0, grid.localerrors, 0)
     else:
-        fig = plt.imshow(error_map, cmap=plt.cm.get_cmap(cm), interpolation='nearest', vmin=0)
-        cb = plt.colorbar()
-        cb.set_label('height')
+        error_map = np.array(grid.heights)
+    error_map = error_map.reshape(grid.columns, grid.rows)
+    if gaussian:
+        error_map = sp.gaussian_filter(error_map, sigma=2, order=0)
+
+    figure = plt.figure()
+    fig = plt.imshow(error_map, cmap=cm, interpolation='nearest', vmin=0)
+    cb = plt.colorbar()
+    cb.set_label('height' if heights else 'localerror')
 
     fig.axes.get_xaxis().set_visible(False)
     fig.axes.get_yaxis().set_visible(False)
 
-    plt.savefig('images/localheatmap.png', papertype='a4', dpi=300)
-    plt.show()
+    plt.savefig(filename, dpi=300)
+    plt.close(figure)
 
 
-def draw_isochrone(grid, cell, max_distance, colormap='binary'):
+def draw_isochrone(grid, cell, max_distance, colormap='binary', filename='images/isochrone_1.png'):
     """
-    Draws an isochrone for the given cell
+    Draws an isochrone for the given cell and saves it, the figure is closed afterwards
     :param grid: the grid to work on
     :param cell:  the cell to work on
     :param max_distance: the maximal distance
     :param colormap: the colormap to use. The default is black and white
+    :param filename: the path of the image, the format is given by the extension
     :return: a heatmap visualizing the distances from one cell to his neighbours
     """
 
-    data = grid.calc_neighbourhood(max_distance=max_distance, neuron=cell)
+    data = grid.calc_neighbourhood(max_distance=max_distance, cell=cell)
 
     tmp = []
     counter = 0
     array = []
 
-    for cell in grid.list_of_neurons:
+    for cell in grid.list_of_cells:
         counter += 1
         is_element = False
         for distance in data:
@@ -150,21 +214,24 @@ def draw_isochrone(grid, cell, max_distance, colormap='binary'):
 
     error_map = np.array(array)
 
+    figure = plt.figure()
     fig = plt.imshow(error_map, cmap=colormap, interpolation='nearest', vmin=0)
     cb = plt.colorbar()
     cb.set_label('path costs')
     fig.axes.get_xaxis().set_visible(False)
     fig.axes.get_yaxis().set_visible(False)
-    plt.savefig('images/isochrone_1.png', papertype='a4', dpi=300)
-    plt.show()
+    plt.savefig(filename, dpi=300)
+    plt.close(figure)
 
 
-def draw_scatterplot(points):
-    """Draws a scatterplot with the given points.
+def draw_scatterplot(points, filename='images/scatterplot.png'):
+    """Draws a scatterplot with the given points and saves it, the figure is closed afterwards.
     Retrieves a list of triples (x,y,z) or tuples (x,y) and returns a scatterplot.
 
     Args:
-        :param points: a list of 2D-Coordinates given as triples or tuples (third dimension is ignored)
+        :param points: a list of 2D-Coordinates given as triples or tuples (third dimension is ignored), or a
+        matrix (points x 2)
+        :param filename: the path of the image, the format is given by the extension
     Returns:
         :return An image in form of an matplotlib.pyplot
 
@@ -174,12 +241,14 @@ def draw_scatterplot(points):
     Needs:
         matplotlib.pyplot
     """
-    if not isinstance(points, list):
+    if isinstance(points, pd.DataFrame):
         points = points.values
 
+    x_points, y_points = calc_point_coordinates(points)
     fig = plt.figure()
     ax = fig.gca()
-    ax.scatter([x.x_axis for x in points], [x.y_axis for x in points], marker='o', s=1)
+    ax.scatter(x_points, y_points, marker='o', s=1)
     plt.grid()
-    plt.show()
+    plt.savefig(filename, dpi=300)
+    plt.close(fig)
 
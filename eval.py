@@ -1,43 +1,139 @@
+import math
+import os
+import tempfile
+import weakref
+import numpy as np
 import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import ConvexHull
+from sklearn.neighbors import NearestNeighbors
+import export
 
-import math_functions
-from objects.datapoint import Datapoint
+
+class GridDistances:
+    """
+    This class holds the shortest path distances between the cells of a grid. Only the rows of the source cells are
+    stored, as float32 and memory mapped if they are large. distances[cell_id_1][cell_id_2] works like for the old
+    distance matrix, as long as cell_id_1 is a source.
+
+    Attributes:
+        values (ndarray): a matrix (sources x cells) with the distances, inf if a cell is not reachable
+        sources (ndarray): the ids of the source cells
+        rows_of_cells (ndarray): the row in values for every cell, -1 if the cell is no source
+    """
+
+    def __init__(self, values, sources, number_of_cells):
+        self.values = values
+        self.sources = sources
+        self.rows_of_cells = np.full(number_of_cells, -1, dtype=np.int64)
+        self.rows_of_cells[sources] = np.arange(len(sources))
+
+    def __len__(self):
+        return len(self.rows_of_cells)
+
+    def __getitem__(self, cell_id):
+        row = self.rows_of_cells[cell_id]
+        if row < 0:
+            raise KeyError(cell_id)
+        return self.values[row]
+
+    def lookup(self, from_ids, to_ids):
+        """
+        Returns the distances for many pairs of cells at once
+        :param from_ids: the ids of the first cells, they have to be sources
+        :param to_ids: the ids of the second cells
+        :return: an array with the distances
+        """
+        rows = self.rows_of_cells[from_ids]
+        if (rows < 0).any():
+            raise KeyError(np.asarray(from_ids)[rows < 0][0])
+        return self.values[rows, to_ids]
+
+
+def calc_grid_graph(grid):
+    """
+    Builds the grid as sparse graph. Every cell is connected with his direct neighbours, the weights are
+    calc_distance_2D.
+    :param grid: the grid
+    :return: a sparse matrix (cells x cells)
+    """
+    cell_ids = np.repeat(np.arange(len(grid.heights)), grid.direct_neighbour_ids.shape[1])
+    neighbour_ids = grid.direct_neighbour_ids.ravel()
+    exists = neighbour_ids >= 0
+    cell_ids = cell_ids[exists]
+    neighbour_ids = neighbour_ids[exists]
+    weights = grid.cellwidth + (grid.heights[cell_ids] - grid.heights[neighbour_ids]) ** 2
+    return csr_matrix((weights, (cell_ids, neighbour_ids)), shape=(len(grid.heights), len(grid.heights)))
+
+
+def calc_grid_distances(grid, sources=None, only_occupied=False, memmap_path=None, memmap_threshold=2 ** 28,
+                        chunk_size=None):
+    """
+    Calculates the shortest distances on the grid between the source cells and every cell. The grid is a sparse
+    graph of direct neighbours, the distances of every source are calculated with Dijkstra.
+    :param grid: the grid
+    :param sources: the ids of the source cells, if None every cell is a source
+    :param only_occupied: if True only the cells with points are sources
+    :param memmap_path: if given, the distances are written to this .npy file as memory map
+    :param memmap_threshold: results with more bytes are always memory mapped, in a temporary file if no
+    memmap_path is given. The temporary file is removed when the distances are not used any more
+    :param chunk_size: the number of sources to calculate at once, the default keeps every chunk below 64 MB
+    :return: the GridDistances
+    """
+    number_of_cells = len(grid.heights)
+    if sources is None:
+        sources = np.flatnonzero(grid.point_counts > 0) if only_occupied else np.arange(number_of_cells)
+    sources = np.asarray(sources, dtype=np.int64)
+
+    shape = (len(sources), number_of_cells)
+    temporary = memmap_path is None and shape[0] * shape[1] * 4 > memmap_threshold
+    if temporary:
+        handle, memmap_path = tempfile.mkstemp(prefix='griddistances', suffix='.npy')
+        os.close(handle)
+    if memmap_path is not None:
+        try:
+            values = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=shape)
+        except BaseException:
+            if temporary:
+                _remove_file(memmap_path)
+            raise
+    else:
+        values = np.empty(shape, dtype=np.float32)
+    if temporary:
+        # every view of the distances keeps the memory map alive, the file is removed after the last one
+        weakref.finalize(values, _remove_file, memmap_path)
+
+    if chunk_size is None:
+        chunk_size = max(2 ** 23 // max(number_of_cells, 1), 1)
+
+    graph = calc_grid_graph(grid)
+    for start in range(0, len(sources), chunk_size):
+        values[start:start + chunk_size] = dijkstra(graph, indices=sources[start:start + chunk_size])
+
+    if isinstance(values, np.memmap):
+        values.flush()
+    return GridDistances(values, sources, number_of_cells)
+
+
+def _remove_file(path):
+    """
+    Removes a file, if it still exists
+    :param path: the path of the file
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
 
 def floyd_warshall(grid):
-    """ dist[][] will be the output matrix that will finally
-        have the shortest distances between every pair of vertices
-        initializing the solution matrix same as input graph matrix
-        OR we can say that the initial values of shortest distances
-        are based on shortest paths considerting no
-        intermedidate vertices
-    """
-    # noinspection PyPep8Naming
-    INF = 999999
-    dist = [[INF for x in range(len(grid.list_of_cells))] for y in range(len(grid.list_of_cells))]
-    for cell_id in range(len(grid.list_of_cells)):
-        cell1 = grid.get_cell(cell_id=cell_id)
-        for dN in cell1.direct_neighbours:
-            dist[cell_id][dN.id] = math_functions.calc_distance_2D(grid, cell1, dN)
-        dist[cell_id][cell_id] = 0
-    print(dist)
-
-    for k in range(len(grid.list_of_cells)):
-        print(k)
-        # pick all vertices as source one by one
-        for i in range(len(grid.list_of_cells)):
-            # Pick all vertices as destination for the
-            # above picked source
-            for j in range(len(grid.list_of_cells)):
-                dist[i][j] = min(dist[i][j],
-                                 dist[i][k] + dist[k][j]
-                                 )
-
-    new_csv = pd.DataFrame(dist)
-    pd.DataFrame.to_csv(new_csv, 'dmmatrix.csv', index=int, header=None)
-
-    # disttodist(dist, grid, 'csvs/tsne.csv', 'result.csv')
-    calc_neighborhood_preservation(dist, grid, 'csvs/FCPS/atom_pca.csv', 'result.csv')
+    """
+    Calculates the shortest distances between every pair of cells. This is the old name of calc_grid_distances.
+    :param grid: the grid
+    :return: the GridDistances with every cell as source
+    """
+    return calc_grid_distances(grid)
 
 
 def print_solution(dist):
@@ -48,7 +144,7 @@ def print_solution(dist):
     print("Following matrix shows the shortest distances between every pair of vertices")
     for i in range(len(dist)):
         for j in range(len(dist)):
-            if dist[i][j] == 999999:
+            if dist[i][j] == np.inf:
                 print("INF ,", end='')
             else:
                 print(dist[i][j], ",", end='')
@@ -56,107 +152,219 @@ def print_solution(dist):
                 print("")
 
 
-def disttodist(distmatrix, grid, list_of_points_before, list_of_points_after):
+def as_grid_distances(distmatrix):
+    """
+    Returns the distance matrix as GridDistances, a matrix with all cells is wrapped
+    :param distmatrix: GridDistances or a matrix (cells x cells)
+    :return: the GridDistances
+    """
+    if isinstance(distmatrix, GridDistances):
+        return distmatrix
+    values = np.asarray(distmatrix, dtype=np.float32)
+    return GridDistances(values, np.arange(len(values)), len(values))
+
+
+def load_points(path):
+    """
+    Loads the points of a csv with index and without header, the first two columns are x and y. A directory is read
+    as binary result of export.write_result_columns, its columns are memory mapped.
+    :param path: the path of the csv or the binary result
+    :return: the x coordinates, the y coordinates and the remaining columns as matrix
+    """
+    if os.path.isdir(path):
+        columns = export.read_result_columns(path, ('dred1', 'dred2', 'data'))
+        return columns['dred1'], columns['dred2'], columns['data']
+    values = pd.read_csv(path, index_col=0, header=None).values
+    return values[:, 0], values[:, 1], values[:, 2:]
+
+
+def calc_max_distance(values, chunk_size=1024):
+    """
+    Calculates the maximal euclidean distance between two rows of a matrix, in chunks of rows. In two dimensions
+    only the points of the convex hull are compared.
+    :param values: the matrix (points x dimensions)
+    :param chunk_size: the number of rows to compare with all others at once
+    :return: the maximal distance
+    """
+    values = np.asarray(values, dtype=float)
+    if values.shape[1] == 2 and len(values) > 3:
+        try:
+            values = values[ConvexHull(values).vertices]
+        except RuntimeError:
+            # all points on one line, we compare all of them
+            pass
+
+    squared_norms = np.einsum('ij,ij->i', values, values)
+    maximum = 0
+    for start in range(0, len(values), chunk_size):
+        squared_distances = squared_norms[start:start + chunk_size, None] + squared_norms[None, :] - \
+            2 * values[start:start + chunk_size] @ values.T
+        maximum = max(maximum, squared_distances.max())
+    return math.sqrt(max(maximum, 0))
+
+
+def calc_cell_neighbourhoods(distances, cell_ids, radius, chunk_size=1024):
+    """
+    Calculates which of the given cells are closer than radius times the maximal distance between two of them.
+    :param distances: the GridDistances, every cell in cell_ids has to be a source
+    :param cell_ids: the ids of the cells
+    :param radius: the radius relative to the maximal distance
+    :param chunk_size: the number of cells to handle at once
+    :return: a sparse matrix (cells x cells) in the order of cell_ids and the maximal distance
+    """
+    maximum = 0
+    for start in range(0, len(cell_ids), chunk_size):
+        maximum = max(maximum, distances.values[distances.rows_of_cells[cell_ids[start:start + chunk_size]]][
+            :, cell_ids].max())
+
+    rows = []
+    columns = []
+    for start in range(0, len(cell_ids), chunk_size):
+        block = distances.values[distances.rows_of_cells[cell_ids[start:start + chunk_size]]][:, cell_ids]
+        row, column = np.nonzero(block / maximum < radius)
+        rows.append(row + start)
+        columns.append(column)
+    rows = np.concatenate(rows)
+    columns = np.concatenate(columns)
+    neighbourhoods = coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(cell_ids), len(cell_ids)))
+    return neighbourhoods.tocsr(), maximum
+
+
+def calc_blocks(number_of_points, block_size):
+    """
+    Returns the pairs of blocks of the upper triangle of a (points x points) matrix and their weight. A block beside
+    the diagonal stands for itself and its mirror.
+    :param number_of_points: the number of points
+    :param block_size: the number of points in a block
+    :return: a list of (rows, columns, weight)
+    """
+    starts = range(0, number_of_points, block_size)
+    return [(slice(i, i + block_size), slice(j, j + block_size), 1 if i == j else 2)
+            for i in starts for j in starts if j >= i]
+
+
+def disttodist(distmatrix, grid, list_of_points_before, list_of_points_after, block_size=2048,
+               quantiles=(0.5, 0.9, 0.99), bins=1024):
     """
     This method calculates a distance to distance evaluation. It compares every distance between points and calculates
-    the difference after the dimensional reduction
-    :param distmatrix: the distance matrix for the original dataset
+    the difference after the dimensional reduction. The pairs of points are handled in blocks: a first pass finds the
+    maximal distances, a second pass sums up the differences of the normalized distances. The distances in the
+    original space are squared, like calc_distance_nD, and calculated in float32.
+    :param distmatrix: the distance matrix, GridDistances with all cells of the points as sources
     :param grid: the grid of our approach
     :param list_of_points_before: lists of points before iteration 0
     :param list_of_points_after:  lists of point after n iterations
-    :return: prints out the difference
-    """
-    import math
-
-    inputframe = pd.read_csv(list_of_points_before, index_col=0, header=None)
-    outputframe = pd.read_csv(list_of_points_after, index_col=0, header=None)
-
-    dred_val = inputframe.values
-    listof_points = []
-    tdv_val = outputframe.values
-    listof_points2 = []
-
-    for index in range(0, len(dred_val)):
-        listof_points.append(Datapoint.from_csv(dred_val[index:index + 1]))
-
-    for index in range(0, len(tdv_val)):
-        listof_points2.append(Datapoint.from_csv(tdv_val[index:index + 1]))
-
-    dist_in_org = []
-    dist_after_dim_red = []
-    dist_after_tdv = []
-    for i in range(len(listof_points)):
-        point = listof_points[i]
-        for j in range(len(listof_points)):
-            point2 = listof_points[j]
-            dist_in_org.append(math_functions.calc_distance_nD(point.data, point2.data)[0])
-            dist_after_dim_red.append(
-                math.sqrt(math.pow(point.x_axis - point2.x_axis, 2) + math.pow(point.y_axis - point2.y_axis, 2)))
-            dist_after_tdv.append(
-                distmatrix[grid.get_cell(point=listof_points2[i]).id][grid.get_cell(point=listof_points2[j]).id])
-
-            # print(point.x_axis, point2.x_axis, point.x_org, point2.x_org)
-    max1 = max(dist_in_org)
-    tmp = [a / max1 for a in dist_in_org]
-    dist_in_org = tmp
-
-    max1 = max(dist_after_dim_red)
-    tmp = [a / max1 for a in dist_after_dim_red]
-    dist_after_dim_red = tmp
-
-    max1 = max(dist_after_tdv)
-    tmp = [a / max1 for a in dist_after_tdv]
-    dist_after_tdv = tmp
-
+    :param block_size: the number of points in a block, this bounds the memory usage
+    :param quantiles: the quantiles of the differences to print
+    :param bins: the number of bins of the histogram used to estimate the quantiles
+    :return: prints out the difference, returns the mean, max and quantiles of the difference between the original
+    space and the dimensional reduction (dimred) and between the original space and tdv (tdv)
+    """
+    distances = as_grid_distances(distmatrix)
+
+    x_axis, y_axis, data = load_points(list_of_points_before)
+    data = np.asarray(data, dtype=np.float32)
+    squared_norms = np.einsum('ij,ij->i', data, data)
+    reduction = np.stack([x_axis, y_axis], axis=1)
+    squared_norms_reduction = np.einsum('ij,ij->i', reduction, reduction)
+    x_axis, y_axis, _ = load_points(list_of_points_after)
+    cell_ids = grid.bin_points(x_axis, y_axis)
+    if (cell_ids < 0).any():
+        raise ValueError
+    rows_of_points = distances.rows_of_cells[cell_ids]
+    if (rows_of_points < 0).any():
+        raise KeyError(cell_ids[rows_of_points < 0][0])
+
+    def block_distances(rows, columns):
+        dist_in_org = squared_norms[rows, None] + squared_norms[None, columns] - 2 * data[rows] @ data[columns].T
+        np.maximum(dist_in_org, 0, out=dist_in_org)
+        dist_after_dim_red = squared_norms_reduction[rows, None] + squared_norms_reduction[None, columns] \
+            - 2 * reduction[rows] @ reduction[columns].T
+        np.sqrt(np.maximum(dist_after_dim_red, 0, out=dist_after_dim_red), out=dist_after_dim_red)
+        # only the block is gathered, not the whole rows of the distance matrix
+        dist_after_tdv = distances.values[np.ix_(rows_of_points[rows], cell_ids[columns])]
+        return dist_in_org, dist_after_dim_red, dist_after_tdv
+
+    blocks = calc_blocks(len(data), block_size)
+
+    # first pass: the maximal distances
+    max1 = max2 = max3 = 0
+    for rows, columns, _ in blocks:
+        dist_in_org, dist_after_dim_red, dist_after_tdv = block_distances(rows, columns)
+        max1 = max(max1, float(dist_in_org.max()))
+        max2 = max(max2, float(dist_after_dim_red.max()))
+        max3 = max(max3, float(dist_after_tdv.max()))
+
+    # second pass: the differences of the normalized distances
     dif1 = 0
     dif2 = 0
-    for a in range(len(dist_in_org)):
-        print(a, "DORG:", dist_in_org[a], "DDIMRED", dist_after_dim_red[a], "DTDV", dist_after_tdv[a])
-        dif1 = dif1 + abs(dist_in_org[a] - dist_after_dim_red[a])
-        dif2 = dif2 + abs(dist_in_org[a] - dist_after_tdv[a])
-
-
-def calc_neighborhood_preservation(distmatrix, grid, list_of_points_before, list_of_points_after):
+    maxdif1 = 0
+    maxdif2 = 0
+    histogram1 = np.zeros(bins)
+    histogram2 = np.zeros(bins)
+    for rows, columns, weight in blocks:
+        dist_in_org, dist_after_dim_red, dist_after_tdv = block_distances(rows, columns)
+        difference1 = np.abs(dist_in_org / max1 - dist_after_dim_red / max2)
+        difference2 = np.abs(dist_in_org / max1 - dist_after_tdv / max3)
+        dif1 += weight * difference1.sum(dtype=float)
+        dif2 += weight * difference2.sum(dtype=float)
+        maxdif1 = max(maxdif1, float(difference1.max()))
+        maxdif2 = max(maxdif2, float(difference2.max()))
+        histogram1 += weight * np.histogram(difference1, bins=bins, range=(0, 1))[0]
+        histogram2 += weight * np.histogram(difference2, bins=bins, range=(0, 1))[0]
+
+    def calc_quantiles(histogram):
+        cumulative = np.cumsum(histogram) / histogram.sum()
+        return {q: float(np.searchsorted(cumulative, q) + 1) / bins for q in quantiles}
+
+    number_of_pairs = len(data) ** 2
+    result = {'dimred': {'mean': dif1 / number_of_pairs, 'max': maxdif1, 'quantiles': calc_quantiles(histogram1)},
+              'tdv': {'mean': dif2 / number_of_pairs, 'max': maxdif2, 'quantiles': calc_quantiles(histogram2)}}
+
+    for name, values in result.items():
+        print("Distance to distance of", name, "mean:", values['mean'], "max:", values['max'],
+              "quantiles:", values['quantiles'])
+    return result
+
+
+def calc_neighborhood_preservation(distmatrix, grid, list_of_points_before, list_of_points_after, radius=0.1,
+                                   chunk_size=1024):
     """
     Calculates the difference between the neighbourhoods in the original high dimensional dataset and the neighbourhoods
-    in after the dimensional reduction. This method prints the differences to evaluate different approaches
-    :param distmatrix: the distance matrix
+    in after the dimensional reduction. This method prints the differences to evaluate different approaches.
+    The neighbourhood of a point are all points closer than radius times the maximal distance (squared distances in
+    the original space, like calc_distance_nD). They are found with radius queries of spatial indexes and compared as
+    sparse matrices, whose rows are the sorted indices of the neighbours, for chunk_size points at once.
+    :param distmatrix: the distance matrix, GridDistances with all cells of the points as sources
     :param grid: the grid to use
     :param list_of_points_before: the list of points before iterartion 0
     :param list_of_points_after:  the list of points after n iterations
+    :param radius: the size of a neighbourhood relative to the maximal distance. The default is 0.1
+    :param chunk_size: the number of points to compare at once, this bounds the memory usage
     :return: the difference between the high dimensional and 2 dimensional space in form of neighbourhood preservation
     """
-    import math
-
-    inputframe = pd.read_csv(list_of_points_before, index_col=0, header=None)
-    outputframe = pd.read_csv(list_of_points_after, index_col=0, header=None)
-
-    dred_val = inputframe.values
-    listof_points = []
-    tdv_val = outputframe.values
-    listof_points2 = []
-
-    for index in range(0, len(dred_val)):
-        listof_points.append(Datapoint.from_csv(dred_val[index:index + 1]))
-    for index in range(0, len(tdv_val)):
-        listof_points2.append(Datapoint.from_csv(tdv_val[index:index + 1]))
-
-    dist_in_org = []
-    dist_after_dim_red = []
-    dist_after_tdv = []
-    for i in range(len(listof_points)):
-        point = listof_points[i]
-        for j in range(len(listof_points)):
-            point2 = listof_points[j]
-            dist_in_org.append(math_functions.calc_distance_nD(point.data, point2.data)[0])
-            dist_after_dim_red.append(
-                math.sqrt(math.pow(point.x_axis - point2.x_axis, 2) + math.pow(point.y_axis - point2.y_axis, 2)))
-            dist_after_tdv.append(
-                distmatrix[grid.get_cell(point=listof_points2[j]).id][grid.get_cell(point=listof_points2[i]).id])
-
-    max_distance_in_org = max(dist_in_org)
-    max_distance_in_red = max(dist_after_dim_red)
-    max_distance_after_tdv = max(dist_after_tdv)
+    distances = as_grid_distances(distmatrix)
+
+    x_axis, y_axis, data = load_points(list_of_points_before)
+    reduction = np.stack([x_axis, y_axis], axis=1)
+    x_axis, y_axis, _ = load_points(list_of_points_after)
+    cell_ids = grid.bin_points(x_axis, y_axis)
+    if (cell_ids < 0).any():
+        raise ValueError
+    number_of_points = len(data)
+
+    # squared distances in the original space: d^2 / max^2 < radius
+    max_distance_in_org = calc_max_distance(data)
+    max_distance_in_red = calc_max_distance(reduction)
+    index_in_org = NearestNeighbors(radius=np.nextafter(math.sqrt(radius) * max_distance_in_org, 0)).fit(data)
+    index_in_red = NearestNeighbors(radius=np.nextafter(radius * max_distance_in_red, 0)).fit(reduction)
+
+    # the neighbourhood after tdv are all points in the cells of the neighbourhood of the cell of a point
+    used_cells, cells_of_points = np.unique(cell_ids, return_inverse=True)
+    cell_neighbourhoods, _ = calc_cell_neighbourhoods(distances, used_cells, radius, chunk_size)
+    points_in_cells = csr_matrix((np.ones(number_of_points), (np.arange(number_of_points), cells_of_points)),
+                                 shape=(number_of_points, len(used_cells)))
+    cells_to_points = points_in_cells.T.tocsr()
 
     avg_precision1 = 0
     avg_recall1 = 0
@@ -166,50 +374,34 @@ def calc_neighborhood_preservation(distmatrix, grid, list_of_points_before, list
     leghttof_tdv = 0
     lenghtof_orginal = 0
 
-    for i in range(len(listof_points)):
-        point = listof_points[i]
-        neighbourhood_in_o = []
-        neighbourhood_in_r = []
-        neighbourhood_in_tdv = []
-        for j in range(len(listof_points)):
-            point2 = listof_points[j]
-            if math_functions.calc_distance_nD(point.data, point2.data)[0] / max_distance_in_org < 0.1:
-                neighbourhood_in_o.append(point2)
-            if (math.sqrt(math.pow(point.x_axis - point2.x_axis, 2) + math.pow(point.y_axis - point2.y_axis,
-                                                                               2)) / max_distance_in_red < 0.1):
-                neighbourhood_in_r.append(point2)
-            if distmatrix[grid.get_cell(
-                    point=listof_points2[i]).id][grid.get_cell(
-                        point=listof_points2[j]).id] / max_distance_after_tdv < 0.1:
-                neighbourhood_in_tdv.append(point2)
-        lenghtof_reduction += len(neighbourhood_in_r)
-        leghttof_tdv += len(neighbourhood_in_tdv)
-        lenghtof_orginal += len(neighbourhood_in_o)
-
-        from collections import Counter
-        print(i, len(neighbourhood_in_o), len(neighbourhood_in_r), len(neighbourhood_in_tdv))
-        counter1 = Counter(neighbourhood_in_o)
-        counter2 = Counter(neighbourhood_in_r)
-        false_neighbours1 = len(list(counter2 - counter1)) / len(neighbourhood_in_r)
-        precision = 1 - false_neighbours1
-        avg_precision1 += precision
-        miss1 = len(list(counter1 - counter2)) / len(neighbourhood_in_o)
-        avg_recall1 += (1 - miss1)
-
-        counter2 = Counter(neighbourhood_in_tdv)
-        false_neighbour2 = len(list(counter2 - counter1)) / len(neighbourhood_in_tdv)
-        precision = 1 - false_neighbour2
-        avg_precision2 += precision
-        miss2 = len(list(counter1 - counter2)) / len(neighbourhood_in_o)
-        avg_recall2 += (1 - miss2)
-
-    avg_precision1 = avg_precision1 / len(listof_points)
-    avg_precision2 = avg_precision2 / len(listof_points)
-    avg_recall1 = avg_recall1 / len(listof_points)
-    avg_recall2 = avg_recall2 / len(listof_points)
-    avg_neigbourhood_size1 = lenghtof_reduction / len(listof_points)
-    avg_neigbourhood_size2 = leghttof_tdv / len(listof_points)
-    avg_neigbourhood_size3 = lenghtof_orginal / len(listof_points)
+    for start in range(0, number_of_points, chunk_size):
+        neighbourhood_in_o = index_in_org.radius_neighbors_graph(data[start:start + chunk_size])
+        neighbourhood_in_r = index_in_red.radius_neighbors_graph(reduction[start:start + chunk_size])
+        neighbourhood_in_tdv = (points_in_cells[start:start + chunk_size] @ cell_neighbourhoods @ cells_to_points)
+        neighbourhood_in_tdv.data[:] = 1
+
+        size_o = np.asarray(neighbourhood_in_o.sum(axis=1)).ravel()
+        size_r = np.asarray(neighbourhood_in_r.sum(axis=1)).ravel()
+        size_tdv = np.asarray(neighbourhood_in_tdv.sum(axis=1)).ravel()
+        both_r = np.asarray(neighbourhood_in_o.multiply(neighbourhood_in_r).sum(axis=1)).ravel()
+        both_tdv = np.asarray(neighbourhood_in_o.multiply(neighbourhood_in_tdv).sum(axis=1)).ravel()
+
+        lenghtof_reduction += size_r.sum()
+        leghttof_tdv += size_tdv.sum()
+        lenghtof_orginal += size_o.sum()
+
+        avg_precision1 += (both_r / size_r).sum()
+        avg_recall1 += (both_r / size_o).sum()
+        avg_precision2 += (both_tdv / size_tdv).sum()
+        avg_recall2 += (both_tdv / size_o).sum()
+
+    avg_precision1 = avg_precision1 / number_of_points
+    avg_precision2 = avg_precision2 / number_of_points
+    avg_recall1 = avg_recall1 / number_of_points
+    avg_recall2 = avg_recall2 / number_of_points
+    avg_neigbourhood_size1 = lenghtof_reduction / number_of_points
+    avg_neigbourhood_size2 = leghttof_tdv / number_of_points
+    avg_neigbourhood_size3 = lenghtof_orginal / number_of_points
 
     print("Precision of R:", avg_precision1)
     print("Precision of T:", avg_precision2)
@@ -218,3 +410,7 @@ def calc_neighborhood_preservation(distmatrix, grid, list_of_points_before, list
     print("avg Neighbourhoodsize of R:", avg_neigbourhood_size1)
     print("avg Neighbourhoodsize of T", avg_neigbourhood_size2)
     print("avg Neighbourhoodsize of 0", avg_neigbourhood_size3)
+
+    return {'precision_r': avg_precision1, 'precision_t': avg_precision2,
+            'recall_r': avg_recall1, 'recall_t': avg_recall2,
+            'size_r': avg_neigbourhood_size1, 'size_t': avg_neigbourhood_size2, 'size_o': avg_neigbourhood_size3}
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('main')
+
+
+def write_result_csv(grid, output_csv, chunksize=None):
+    """
+    This method writes the result of the grid as csv, without header. Every row is one point in the order of the
+    input, the index is the index of the point in the input. The first three columns are x, y and the height of the
+    cell of the point, followed by the original dimensions. Points without a cell are not written.
+    :param grid: the grid with the points
+    :param output_csv: the path of the csv
+    :param chunksize: if given, the csv is written in chunks of this many rows, so the result is never in memory as
+    one table
+    :return: the number of written rows
+    """
+    store = grid.points
+    indices = np.flatnonzero(store.cell_ids >= 0)
+    if len(indices) < len(store):
+        logger.warning("'%i' points without cell are not written to '%s'", len(store) - len(indices), output_csv)
+
+    if not chunksize:
+        chunksize = max(len(indices), 1)
+
+    with open(output_csv, 'w', newline='') as file:
+        for start in range(0, len(indices), chunksize):
+            chunk = indices[start:start + chunksize]
+            tmp = pd.DataFrame({'dred1': store.x_axis[chunk],
+                                'dred2': store.y_axis[chunk],
+                                'heights': grid.heights[store.cell_ids[chunk]]},
+                               index=store.row_index[chunk])
+            tmp2 = pd.DataFrame(np.asarray(store.data[chunk]), index=tmp.index)
+            pd.concat([tmp, tmp2], axis=1).to_csv(file, header=False)
+
+    return len(indices)
+
+
+# the columns of the binary result, every column is one .npy file
+COLUMNS = ('index', 'dred1', 'dred2', 'heights', 'data')
+# the version of the binary result format
+VERSION = 1
+
+
+def write_result_columns(grid, output_dir, chunksize=None):
+    """
+    This method writes the result of the grid in a binary columnar format: a directory with one .npy file for every
+    column of the csv of write_result_csv (index, dred1, dred2, heights and the original dimensions as matrix data)
+    and the same points in the same order. The dtypes are kept. meta.json describes the grid and the columns,
+    cell_heights.npy contains the height of every cell. The directory is replaced only after everything is written.
+    :param grid: the grid with the points
+    :param output_dir: the path of the directory
+    :param chunksize: if given, the original dimensions are copied in chunks of this many rows
+    :return: the number of written rows
+    """
+    store = grid.points
+    indices = np.flatnonzero(store.cell_ids >= 0)
+    if len(indices) < len(store):
+        logger.warning("'%i' points without cell are not written to '%s'", len(store) - len(indices), output_dir)
+
+    parent = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(output_dir) + '.tmp-', dir=parent)
+
+    np.save(os.path.join(tmp, 'index.npy'), store.row_index[indices], allow_pickle=False)
+    np.save(os.path.join(tmp, 'dred1.npy'), store.x_axis[indices])
+    np.save(os.path.join(tmp, 'dred2.npy'), store.y_axis[indices])
+    np.save(os.path.join(tmp, 'heights.npy'), grid.heights[store.cell_ids[indices]])
+    data = np.lib.format.open_memmap(os.path.join(tmp, 'data.npy'), mode='w+', dtype=store.data.dtype,
+                                     shape=(len(indices), store.data.shape[1]))
+    if not chunksize:
+        chunksize = max(len(indices), 1)
+    for start in range(0, len(indices), chunksize):
+        data[start:start + chunksize] = store.data[indices[start:start + chunksize]]
+    data.flush()
+    del data
+    np.save(os.path.join(tmp, 'cell_heights.npy'), grid.heights)
+
+    meta = {'version': VERSION,
+            'rows': grid.rows,
+            'columns': grid.columns,
+            'cellwidth': grid.cellwidth,
+            'start_x': float(grid.posx.min()),
+            'start_y': float(grid.posy.min()),
+            'dimension': grid.dimension,
+            'points': len(indices),
+            'result_columns': list(COLUMNS)}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=1)
+
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(tmp, output_dir)
+    return len(indices)
+
+
+def read_result_meta(path):
+    """
+    Reads the description of a binary result
+    :param path: the directory of the result
+    :return: a dictionary with the grid parameters, the number of points and the columns
+    """
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+    if meta['version'] != VERSION:
+        raise ValueError("The result '%s' has version '%s', expected '%s'" % (path, meta['version'], VERSION))
+    return meta
+
+
+def read_result_columns(path, columns=('dred1', 'dred2', 'heights'), mmap_mode='r'):
+    """
+    Reads columns of a binary result of write_result_columns, the other columns are not touched
+    :param path: the directory of the result
+    :param columns: the names of the columns, see COLUMNS. 'cell_heights' reads the heights of all cells
+    :param mmap_mode: see numpy.load, the default maps the columns without reading them
+    :return: a dictionary with an array for every column
+    """
+    read_result_meta(path)
+    return {column: np.load(os.path.join(path, column + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+            for column in columns}
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from objects.pointstore import PointStore
+
+logger = logging.getLogger('main')
+
+# the version of the cache format, a cache with another version is converted again
+VERSION = 1
+
+
+def calc_cache_dir(input_csv):
+    """
+    Returns the default cache directory of an input file
+    :param input_csv: the input file
+    :return: the path of the cache directory, next to the input file
+    """
+    return input_csv + '.cache'
+
+
+def _source(input_csv, dtype):
+    """
+    Describes the input file, a cache is valid as long as this description does not change
+    :param input_csv: the input file
+    :param dtype: the dtype of the feature matrix
+    :return: a dictionary with the path, size and modification time of the file and the dtype
+    """
+    status = os.stat(input_csv)
+    return {'version': VERSION, 'path': os.path.abspath(input_csv), 'size': status.st_size,
+            'mtime_ns': status.st_mtime_ns, 'dtype': np.dtype(dtype).str}
+
+
+def read_meta(input_csv, cache_dir=None, dtype='float32'):
+    """
+    Reads the description of a valid cache
+    :param input_csv: the input file
+    :param cache_dir: the cache directory, the default is calc_cache_dir(input_csv)
+    :param dtype: the dtype of the feature matrix
+    :return: the description with the number of rows and dimensions, None if there is no valid cache
+    """
+    path = os.path.join(cache_dir or calc_cache_dir(input_csv), 'meta.json')
+    if not os.path.isfile(path):
+        return None
+    with open(path) as file:
+        meta = json.load(file)
+    if meta.get('source') != _source(input_csv, dtype):
+        return None
+    return meta
+
+
+def read_dimension(input_csv, cache_dir=None, dtype='float32'):
+    """
+    Returns the number of dimensions of the input (without the index and the x and y coordinates), from the cache
+    if there is a valid one, otherwise from the first row
+    :param input_csv: the input file
+    :param cache_dir: the cache directory, the default is calc_cache_dir(input_csv)
+    :param dtype: the dtype of the feature matrix
+    :return: the number of dimensions
+    """
+    meta = read_meta(input_csv, cache_dir, dtype)
+    if meta is not None:
+        return meta['dimension']
+    return pd.read_csv(input_csv, index_col=0, header=None, nrows=1).shape[1] - 2
+
+
+def count_rows(input_csv):
+    """
+    Counts the rows of a csv without parsing them, blank lines are skipped like in pandas.read_csv
+    :param input_csv: the input file
+    :return: the number of rows
+    """
+    with open(input_csv, 'rb') as file:
+        return sum(1 for line in file if not line.isspace())
+
+
+def ingest(grid, input_csv, cache_dir=None, dtype='float32', chunksize=65536):
+    """
+    This method reads the points of an input csv into the grid without holding the whole input in memory. The
+    original dimensions are converted once into a memory mapped matrix (features.npy) in the cache directory, later
+    runs on the same file only map it. While converting, every chunk of the csv is added to the cells as soon as
+    it is read, with a cache the points are added in chunks of the same size.
+    :param grid: the grid, the points are saved in grid.points
+    :param input_csv: the input file, a csv with index, without header. First two columns are x and y
+    :param cache_dir: the cache directory, the default is calc_cache_dir(input_csv)
+    :param dtype: the dtype of the feature matrix
+    :param chunksize: the number of rows read and binned at once
+    :return: the positions of all points without a cell, see Grid.assign_points
+    """
+    cache_dir = cache_dir or calc_cache_dir(input_csv)
+    meta = read_meta(input_csv, cache_dir, dtype)
+    if meta is not None:
+        logger.info("Input '%s' is read from the cache '%s'", input_csv, cache_dir)
+        coordinates = np.load(os.path.join(cache_dir, 'coordinates.npy'))
+        _set_store(grid, np.load(os.path.join(cache_dir, 'features.npy'), mmap_mode='r'), coordinates,
+                   np.load(os.path.join(cache_dir, 'index.npy')))
+        return grid.assign_points(chunk_size=chunksize)
+
+    number_of_rows = count_rows(input_csv)
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(cache_dir) + '.tmp-', dir=parent)
+    # the directory is removed if the conversion fails, the grid keeps no half read store
+    try:
+        features = np.lib.format.open_memmap(os.path.join(tmp, 'features.npy'), mode='w+', dtype=dtype,
+                                             shape=(number_of_rows, grid.dimension))
+        store = _set_store(grid, features, np.zeros((number_of_rows, 2)), np.zeros(number_of_rows, dtype=np.int64))
+
+        indices = []
+        not_found = []
+        start = 0
+        for chunk in pd.read_csv(input_csv, index_col=0, header=None, chunksize=chunksize):
+            stop = start + len(chunk)
+            values = chunk.values
+            features[start:stop] = values[:, 2:]
+            store.x_axis[start:stop] = store.x_org[start:stop] = values[:, 0]
+            store.y_axis[start:stop] = store.y_org[start:stop] = values[:, 1]
+            indices.append(chunk.index.values)
+            not_found.append(grid.assign_points(np.arange(start, stop), chunk_size=chunksize))
+            start = stop
+        if start != number_of_rows:
+            raise ValueError("'%i' rows counted in '%s', but '%i' rows read" % (number_of_rows, input_csv, start))
+
+        index = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        store.row_index = index if index.dtype != object else index.astype(str)
+        features.flush()
+        np.save(os.path.join(tmp, 'coordinates.npy'), np.stack([store.x_org, store.y_org], axis=1))
+        np.save(os.path.join(tmp, 'index.npy'), store.row_index, allow_pickle=False)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as file:
+            json.dump({'source': _source(input_csv, dtype), 'rows': number_of_rows, 'dimension': grid.dimension}, file)
+
+        # the new cache replaces the old one only if it is complete
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(tmp, cache_dir)
+    except BaseException:
+        grid.points = None
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    logger.info("Input '%s' converted to '%s' with '%i' rows", input_csv, cache_dir, number_of_rows)
+
+    return np.concatenate(not_found) if not_found else np.zeros(0, dtype=np.int64)
+
+
+def _set_store(grid, features, coordinates, row_index):
+    """
+    Creates the PointStore of the grid around a feature matrix, without copying it
+    :param grid: the grid
+    :param features: the matrix (points x dimensions) with the original dimensions
+    :param coordinates: a matrix (points x 2) with the x and y coordinates
+    :param row_index: the index of every point in the input
+    :return: the store
+    """
+    number_of_rows = len(features)
+    store = PointStore.from_arrays({'data': features,
+                                    'x_axis': coordinates[:, 0].copy(),
+                                    'y_axis': coordinates[:, 1].copy(),
+                                    'x_org': coordinates[:, 0].copy(),
+                                    'y_org': coordinates[:, 1].copy(),
+                                    'row_index': row_index,
+                                    'cell_ids': np.full(number_of_rows, -1, dtype=np.int64),
+                                    'org_ids': np.full(number_of_rows, -1, dtype=np.int64),
+                                    'shift_counts': np.zeros(number_of_rows, dtype=np.int64),
+                                    'shift_totals': np.zeros((number_of_rows, 2))})
+    store.grid = grid
+    grid.points = store
+    return store
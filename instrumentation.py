@@ -0,0 +1,129 @@
+import json
+import time
+from contextlib import nullcontext
+
+# Timers and counters for the phases of a run. Everything is disabled by default, then phase returns a shared
+# context that does nothing and count returns at once, so the calls can stay in the hot paths.
+
+# True if the timers and counters are recorded
+_enabled = False
+# the file for the records, one json object per line
+_output = None
+# True if the file was opened by enable
+_opened = False
+# the wall and cpu time of every phase since the last record
+_phases = {}
+# the counters since the last record
+_counters = {}
+_disabled_phase = nullcontext()
+
+
+class _Phase:
+    """
+    Measures the wall and cpu time of one phase and adds them to the phase
+    """
+    __slots__ = ('name', 'wall', 'cpu')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        timer = _phases.setdefault(self.name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        timer['wall'] += time.perf_counter() - self.wall
+        timer['cpu'] += time.process_time() - self.cpu
+        timer['calls'] += 1
+
+
+def enable(output=None):
+    """
+    Starts recording
+    :param output: a path or an open text file for the records, if None the records are only returned by emit
+    """
+    global _enabled, _output, _opened
+    disable()
+    _enabled = True
+    _opened = isinstance(output, str)
+    _output = open(output, 'a') if _opened else output
+    _phases.clear()
+    _counters.clear()
+
+
+def disable():
+    """
+    Stops recording and closes the file of the records if it was opened by enable
+    """
+    global _enabled, _output, _opened
+    if _opened:
+        _output.close()
+    _enabled = False
+    _output = None
+    _opened = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def phase(name):
+    """
+    A context to measure a phase, e.g. with instrumentation.phase('shifts'): ...
+    :param name: the name of the phase
+    :return: the context
+    """
+    if not _enabled:
+        return _disabled_phase
+    return _Phase(name)
+
+
+def count(name, value=1):
+    """
+    Adds a value to a counter
+    :param name: the name of the counter
+    :param value: the value to add
+    """
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def take_counters():
+    """
+    Returns the counters since the last record and resets them, e.g. to send them from a worker process
+    :return: a dictionary with the counters
+    """
+    counters = dict(_counters)
+    _counters.clear()
+    return counters
+
+
+def add_counters(counters):
+    """
+    Adds counters from take_counters
+    :param counters: a dictionary with counters
+    """
+    for name, value in counters.items():
+        count(name, value)
+
+
+def emit(**fields):
+    """
+    Writes one record with the fields, the phases and the counters since the last record and resets them
+    :param fields: more fields for the record, e.g. the number of the iteration
+    :return: the record, None if disabled
+    """
+    if not _enabled:
+        return None
+    record = dict(fields)
+    record['time'] = time.time()
+    record['phases'] = {name: dict(timer) for name, timer in _phases.items()}
+    record['counters'] = dict(_counters)
+    _phases.clear()
+    _counters.clear()
+    if _output is not None:
+        _output.write(json.dumps(record) + '\n')
+        _output.flush()
+    return record
@@ -1,6 +1,6 @@
 import logging
-import math
 import numpy as np
+import instrumentation
 
 # logger1 for logging in logfile.txt
 logger = logging.getLogger('math')
@@ -18,24 +18,18 @@ def calc_distance_2D(grid, cell, neighbour):
     :param neighbour: the second cell
     :return: the distance between the two points
     """
-    is_direct_neighbour = False
-    for c in cell.direct_neighbours:
-        if c == neighbour:
-            is_direct_neighbour = True
-            break
-
-    if is_direct_neighbour:
+    if neighbour.id in grid.direct_neighbour_ids[cell.id]:
         return grid.cellwidth + pow(cell.height - neighbour.height, 2)
         # alternative version:
         # E1
         # return 1 + pow(cell.height - neighbour.height, 2)
 
     else:
-        for pair in grid.get_cell(cell_id=cell.id).neighbourhood:
-            if pair[0] == neighbour:
-                return pair[1]
+        ids, distances = grid.get_neighbourhood(cell.id)
+        position = np.flatnonzero(ids == neighbour.id)
+        if len(position):
+            return distances[position[0]]
         raise ValueError
-        pass
 
 
 def calc_distance_nD(inputvector, inputvector2):
@@ -64,6 +58,178 @@ def calc_distance_nD(inputvector, inputvector2):
     return [e, error]
 
 
+def calc_neighbour_distances_nD(grid, cell_ids=None, chunk_size=4096):
+    """
+    Calculates the squared distances between the representatives of cells and the representatives of their four
+    direct neighbours. Like in calc_distance_nD a cell without representative has the distance 0 to every cell.
+    :param grid: the grid to work on
+    :param cell_ids: the ids of the cells, if None all cells are used
+    :param chunk_size: the number of cells to handle at once, this bounds the memory usage
+    :return: an array (len(cell_ids) x 4) with the distances in the order of grid.direct_neighbour_ids, 0 if the
+    neighbour does not exist
+    """
+    if cell_ids is None:
+        cell_ids = np.arange(len(grid.heights))
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+
+    neighbour_ids = grid.direct_neighbour_ids[cell_ids]
+    valid = (neighbour_ids >= 0) & grid.has_representative[neighbour_ids] & \
+        grid.has_representative[cell_ids][:, None]
+
+    distances = np.zeros(neighbour_ids.shape)
+    for start in range(0, len(cell_ids), chunk_size):
+        representatives = grid.representatives[cell_ids[start:start + chunk_size]]
+        for direction in range(neighbour_ids.shape[1]):
+            error = grid.representatives[neighbour_ids[start:start + chunk_size, direction]] - representatives
+            distances[start:start + chunk_size, direction] = np.einsum('ij,ij->i', error, error)
+
+    distances[~valid] = 0
+    return distances
+
+
+def calc_localerrors(grid, cell_ids=None, heights_to_test=None, distances_nD=None):
+    """
+    Calculates the localerror for many cells at once. This is the batched version of Cell.calc_localerror.
+    It also has the possibility to calculate hypothetical errors for a vector of heights per cell. The heights of the
+    neighbours are not changed for this.
+    :param grid: the grid to work on
+    :param cell_ids: the ids of the cells, if None all cells are used
+    :param heights_to_test: heights to test, an array (len(cell_ids)) or (len(cell_ids) x m) for m heights per cell
+    :param distances_nD: the distances from calc_neighbour_distances_nD, they are calculated if None
+    :return: the localerrors in the shape of heights_to_test, if heights_to_test is None the actual errors
+    """
+    if cell_ids is None:
+        cell_ids = np.arange(len(grid.heights))
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    if distances_nD is None:
+        distances_nD = calc_neighbour_distances_nD(grid, cell_ids)
+
+    if heights_to_test is None:
+        heights = grid.heights[cell_ids][:, None]
+    else:
+        heights = np.asarray(heights_to_test, dtype=float).reshape(len(cell_ids), -1)
+
+    neighbour_ids = grid.direct_neighbour_ids[cell_ids]
+    weights = grid.neutral_variance / np.maximum(grid.neutral_variance, grid.icvs[cell_ids])
+    distances_hd = np.sqrt(weights[:, None] * distances_nD)
+
+    # the distance in the dimensional reduction space, see calc_distance_2D
+    distances_2d = grid.cellwidth + (heights[:, :, None] - grid.heights[neighbour_ids][:, None, :]) ** 2
+    errors = (distances_hd[:, None, :] - distances_2d) ** 2
+    errors = np.where((neighbour_ids >= 0)[:, None, :], errors, 0).sum(axis=2)
+
+    if heights_to_test is None or np.ndim(heights_to_test) == 1:
+        return errors[:, 0]
+    return errors
+
+
+def calc_neighbourhood_offsets(radius):
+    """
+    Calculates every offset (dx, dy) on the grid, that can be reached with at most radius steps between direct
+    neighbours. The offsets are ordered by the number of steps, so (0, 0) is the first one.
+    :param radius: the maximal number of steps
+    :return: an array (offsets x 2) with dx and dy
+    """
+    offsets = [(dx, dy) for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)
+               if abs(dx) + abs(dy) <= radius]
+    offsets.sort(key=lambda offset: abs(offset[0]) + abs(offset[1]))
+    return np.array(offsets, dtype=np.int64).reshape(-1, 2)
+
+
+def calc_neighbourhood_distances(heights, cellwidth, max_distance, offsets):
+    """
+    Calculates the neighbourhoods of all cells of a block of the grid at once. The costs between two direct neighbours
+    are calc_distance_2D, so every step costs at least cellwidth and a neighbourhood never leaves the offsets of
+    calc_neighbourhood_offsets(max_distance / cellwidth). The shortest paths are found by relaxing all offsets in the
+    order of their number of steps until nothing changes.
+    :param heights: the heights of the block as an array (columns x rows), heights[tmp_y, tmp_x]
+    :param cellwidth: the cellwidth of the grid
+    :param max_distance: the maximal distance of the neighbourhood
+    :param offsets: the offsets from calc_neighbourhood_offsets
+    :return: an array (cells of the block x offsets) with the distances, inf if the cell is not in the neighbourhood
+    """
+    number_of_y, number_of_x = heights.shape
+    pad = int(np.abs(offsets).sum(axis=1).max()) + 1
+
+    # the costs of every step in every direction, inf if the step leaves the block
+    right = np.full((number_of_y, number_of_x), np.inf)
+    right[:, :-1] = cellwidth + (heights[:, :-1] - heights[:, 1:]) ** 2
+    left = np.full((number_of_y, number_of_x), np.inf)
+    left[:, 1:] = right[:, :-1]
+    down = np.full((number_of_y, number_of_x), np.inf)
+    down[:-1, :] = cellwidth + (heights[:-1, :] - heights[1:, :]) ** 2
+    up = np.full((number_of_y, number_of_x), np.inf)
+    up[1:, :] = down[:-1, :]
+    steps = {(1, 0): right, (-1, 0): left, (0, 1): down, (0, -1): up}
+    for step, costs in steps.items():
+        steps[step] = np.pad(costs, pad, mode='constant', constant_values=np.inf)
+
+    # the relaxations (offset, previous offset, costs of the last step for every start cell)
+    index = {(dx, dy): k for k, (dx, dy) in enumerate(offsets.tolist())}
+    relaxations = []
+    for k, (dx, dy) in enumerate(offsets.tolist()):
+        for (step_x, step_y), costs in steps.items():
+            previous = index.get((dx - step_x, dy - step_y))
+            if previous is not None:
+                y = pad + dy - step_y
+                x = pad + dx - step_x
+                relaxations.append((k, previous, costs[y:y + number_of_y, x:x + number_of_x]))
+
+    distances = np.full((len(offsets), number_of_y, number_of_x), np.inf)
+    distances[index[(0, 0)]] = 0
+    for sweep in range(pad):
+        before = distances.copy()
+        for k, previous, costs in relaxations:
+            np.minimum(distances[k], distances[previous] + costs, out=distances[k])
+        if np.array_equal(before, distances):
+            break
+    instrumentation.count('relaxation_sweeps', sweep + 1)
+
+    distances[distances > max_distance] = np.inf
+    return distances.reshape(len(offsets), -1).T
+
+
+def calc_manipulated_representatives(grid, cell_ids=None, chunk_size=1024):
+    """
+    Calculates the manipulated representatives for many cells at once (see Cell.manipulate_representative). Every
+    representative moves towards the representatives of his neighbourhood, a neighbour in the distance
+    calc_distance_2D has the weight 1 / (1 + distance). The sum is divided by the size of the neighbourhood.
+    Cells without representative do not move and neighbours without representative are ignored.
+    :param grid: the grid to work on
+    :param cell_ids: the ids of the cells, if None all cells are used
+    :param chunk_size: the number of cells to handle at once, this bounds the memory usage
+    :return: an array (len(cell_ids) x dimensions) with the new representatives
+    """
+    if cell_ids is None:
+        cell_ids = np.arange(len(grid.heights))
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+
+    ids = grid.neighbourhood_ids[cell_ids]
+    in_neighbourhood = ids >= 0
+
+    # direct neighbours have the direct distance, like in calc_distance_2D
+    distances = grid.neighbourhood_distances[cell_ids]
+    is_direct = (ids[:, :, None] == grid.direct_neighbour_ids[cell_ids][:, None, :]).any(axis=2) & in_neighbourhood
+    direct_distances = grid.cellwidth + (grid.heights[cell_ids][:, None] - grid.heights[ids]) ** 2
+    distances = np.where(is_direct, direct_distances, distances)
+
+    weights = np.zeros(ids.shape)
+    use = in_neighbourhood & grid.has_representative[ids] & grid.has_representative[cell_ids][:, None]
+    weights[use] = 1 / (1 + distances[use])
+    sizes = np.maximum(in_neighbourhood.sum(axis=1), 1)
+
+    new_representatives = grid.representatives[cell_ids]
+    for start in range(0, len(cell_ids), chunk_size):
+        end = start + chunk_size
+        representatives = new_representatives[start:end]
+        delta = np.zeros(representatives.shape)
+        for k in range(ids.shape[1]):
+            delta += weights[start:end, k, None] * (grid.representatives[ids[start:end, k]] - representatives)
+        new_representatives[start:end] = representatives + delta / sizes[start:end, None]
+
+    return new_representatives
+
+
 def calc_neutral_variance(grid, n):
     """
     Calculates the neutral variance
@@ -81,44 +247,109 @@ def calc_mountain_height(cell, neutral_variance):
     :param neutral_variance: the neutral variance from the grid
     :return: the new height
     """
+    return calc_mountain_heights(cell.grid, [cell.id], neutral_variance=neutral_variance)[0]
+
+
+def calc_cubic_roots(coefficients):
+    """
+    Calculates the roots of many cubic polynomials a * x^3 + b * x^2 + c * x + d at once. The roots are the
+    eigenvalues of the companion matrices, like np.roots. Polynomials with a leading coefficient of 0 (or so small
+    that the companion matrix is not finite) have less than three roots, they are calculated with np.roots one by
+    one.
+    :param coefficients: an array (polynomials x 4) with a, b, c and d
+    :return: a complex array (polynomials x 3) with the roots, nan if a polynomial has less than three roots
+    """
+    coefficients = np.asarray(coefficients, dtype=float).reshape(-1, 4)
+    roots = np.full((len(coefficients), 3), np.nan, dtype=complex)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        normed = -coefficients[:, 1:] / coefficients[:, :1]
+    regular = np.isfinite(normed).all(axis=1)
+
+    companion = np.zeros((int(regular.sum()), 3, 3))
+    companion[:, 0, :] = normed[regular]
+    companion[:, 1, 0] = 1
+    companion[:, 2, 1] = 1
+    if len(companion):
+        roots[regular] = np.linalg.eigvals(companion)
 
-    sum_of_weights = 0
+    # the fallback for degenerate polynomials
+    for row in np.flatnonzero(~regular).tolist():
+        row_roots = np.roots(coefficients[row])
+        roots[row, :len(row_roots)] = row_roots
+    return roots
 
-    for neighbour in cell.direct_neighbours:
-        sum_of_weights += len(neighbour.list_of_points)
 
-    if sum_of_weights == 0:
-        return 0
+def calc_mountain_heights(grid, cell_ids, neutral_variance=None):
+    """
+    Calculates new heights for many cells at once. Every new height minimizes the localerror of his cell, while the
+    heights of the neighbours stay the same. The derivative of the localerror is a cubic polynomial, its roots are
+    calculated with calc_cubic_roots for all cells in one call. Every real root is tested with calc_localerrors,
+    roots >= -0.1 are preferred. A cell without real root keeps his height.
+    :param grid: the grid to work on
+    :param cell_ids: the ids of the cells
+    :param neutral_variance: the neutral variance, if None the neutral variance from the grid is used
+    :return: an array with the new heights
+    """
+    if neutral_variance is None:
+        neutral_variance = grid.neutral_variance
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    if not len(cell_ids):
+        return np.zeros(0)
 
-    f = [1 for x in cell.direct_neighbours]  # prefactor (not used)
-    h = [x.height for x in cell.direct_neighbours]  # Heights
-    r = [neutral_variance / max(neutral_variance, cell.ICV) * math.sqrt(
-        calc_distance_nD(cell.representative, x.representative)[0]) for x in
-         cell.direct_neighbours]  # representatives
+    neighbour_ids = grid.direct_neighbour_ids[cell_ids]
+    f = (neighbour_ids >= 0).astype(float)  # prefactor (not used), 0 if the neighbour does not exist
+    h = grid.heights[neighbour_ids] * f  # Heights
+    distances_nD = calc_neighbour_distances_nD(grid, cell_ids)
+    r = (neutral_variance / np.maximum(neutral_variance, grid.icvs[cell_ids]))[:, None] * np.sqrt(
+        distances_nD)  # representatives
 
-    a = np.real(4 * sum(f))
-    b = np.real(-12 * sum([fi * hi for fi, hi in zip(f, h)]))
-    c = np.real(4 * cell.grid.cellwidth * sum(f) - 4 * sum([fi * ri for fi, ri in zip(f, r)]) + 12 * sum(
-        [fi * hi ** 2 for fi, hi in zip(f, h)]))
-    d = np.real(
-        -4 * cell.grid.cellwidth * sum([fi * hi for fi, hi in zip(f, h)]) + 4 * sum(
-            [fi * hi * ri for fi, hi, ri in zip(f, h, r)]) - 4 * sum(
-            [fi * hi ** 3 for fi, hi in zip(f, h)]))
+    a = 4 * f.sum(axis=1)
+    b = -12 * (f * h).sum(axis=1)
+    c = 4 * grid.cellwidth * f.sum(axis=1) - 4 * (f * r).sum(axis=1) + 12 * (f * h ** 2).sum(axis=1)
+    d = -4 * grid.cellwidth * (f * h).sum(axis=1) + 4 * (f * h * r).sum(axis=1) - 4 * (f * h ** 3).sum(axis=1)
 
-    ppar = [a, b, c, d]
-    roots = np.roots(ppar)
+    roots = calc_cubic_roots(np.stack((a, b, c, d), axis=1))
     logger.debug("Roots calculated: '%s'", roots)
 
-    roots = roots[np.isreal(roots)]
+    is_real = np.isreal(roots) & ~np.isnan(roots)
+    roots = np.where(is_real, np.real(roots), 0)
+    instrumentation.count('roots_evaluated', int(is_real.sum()))
+    errors = calc_localerrors(grid, cell_ids, heights_to_test=roots, distances_nD=distances_nD)
+
+    # prefer roots >= -0.1, only if there is none all real roots are used
+    preferred = is_real & (roots >= -0.1)
+    allowed = np.where(preferred.any(axis=1)[:, None], preferred, is_real)
+    errors = np.where(allowed, errors, np.inf)
+    new_heights = roots[np.arange(len(cell_ids)), np.argmin(errors, axis=1)]
+    without_root = ~is_real.any(axis=1)
+    new_heights[without_root] = grid.heights[cell_ids[without_root]]
 
-    dic = {}
-    for root in roots:
-        if root >= -0.1:
-            dic.update({root: cell.calc_localerror(height_to_test=root)})
+    # cells without points in the direct neighbourhood get the height 0
+    sum_of_weights = np.where(neighbour_ids >= 0, grid.point_counts[neighbour_ids], 0).sum(axis=1)
+    new_heights[sum_of_weights == 0] = 0
+    return new_heights
 
-    if not dic:
-        for root in roots:
-            dic.update({root: cell.calc_localerror(height_to_test=root)})
 
-    minmum = min(dic.items(), key=lambda x: x[1])
-    return np.real(minmum[0])
+def calc_bilinear(values, y, x):
+    """
+    Interpolates a lattice of values bilinear at fractional positions. Positions outside of the lattice take the
+    value at the border.
+    :param values: an array (columns x rows x ...) with one value (or vector) for every cell
+    :param y: the fractional row positions, 0 is the first row
+    :param x: the fractional column positions, 0 is the first column
+    :return: the interpolated values, one for every position
+    """
+    y = np.clip(np.asarray(y, dtype=float), 0, values.shape[0] - 1)
+    x = np.clip(np.asarray(x, dtype=float), 0, values.shape[1] - 1)
+    y0 = np.minimum(np.floor(y).astype(np.int64), max(values.shape[0] - 2, 0))
+    x0 = np.minimum(np.floor(x).astype(np.int64), max(values.shape[1] - 2, 0))
+    y1 = np.minimum(y0 + 1, values.shape[0] - 1)
+    x1 = np.minimum(x0 + 1, values.shape[1] - 1)
+
+    # the weights get a new axis for every trailing dimension of the values
+    shape = y.shape + (1,) * (values.ndim - 2)
+    fy = (y - y0).reshape(shape)
+    fx = (x - x0).reshape(shape)
+    return ((1 - fy) * ((1 - fx) * values[y0, x0] + fx * values[y0, x1]) +
+            fy * ((1 - fx) * values[y1, x0] + fx * values[y1, x1]))
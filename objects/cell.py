@@ -1,5 +1,5 @@
 import logging
-import math
+import numpy as np
 import pandas as pd
 import math_functions as mf
 
@@ -14,25 +14,118 @@ class Cell:
     This class represents one cell in the grid. A cell is a group of points, represented by a representative. It has
     information about his neighbourhood, his homogeneity and height.
     It has 4 direct neighbours, a x and y position (lower left corner) and has a unique id.
+    The numerical state of a cell is stored in the arrays of the grid, the cell is a view on the entries of his id.
     """
 
+    __slots__ = ('id', 'grid')
+
     def __init__(self,
                  id,
                  grid,
-                 posx=0,
-                 posy=0,
-                 height=0):
+                 posx=None,
+                 posy=None,
+                 height=None):
 
         self.id = id
-        self.posx = posx
-        self.posy = posy
-        self.height = height
-        self.list_of_points = []
-        self.neighbourhood = []
-        self.direct_neighbours = []
-        self.representative = []
         self.grid = grid
-        self.ICV = 0
+        if posx is not None:
+            self.posx = posx
+        if posy is not None:
+            self.posy = posy
+        if height is not None:
+            self.height = height
+
+    @property
+    def posx(self):
+        return self.grid.posx[self.id]
+
+    @posx.setter
+    def posx(self, value):
+        self.grid.posx[self.id] = value
+
+    @property
+    def posy(self):
+        return self.grid.posy[self.id]
+
+    @posy.setter
+    def posy(self, value):
+        self.grid.posy[self.id] = value
+
+    @property
+    def height(self):
+        return self.grid.heights[self.id]
+
+    @height.setter
+    def height(self, value):
+        self.grid.heights[self.id] = value
+
+    # noinspection PyPep8Naming
+    @property
+    def ICV(self):
+        return self.grid.icvs[self.id]
+
+    # noinspection PyPep8Naming
+    @ICV.setter
+    def ICV(self, value):
+        self.grid.icvs[self.id] = value
+
+    @property
+    def localerror(self):
+        return self.grid.localerrors[self.id]
+
+    @localerror.setter
+    def localerror(self, value):
+        self.grid.localerrors[self.id] = value
+
+    @property
+    def representative(self):
+        """
+        The representative as a row of the representative matrix of the grid, an empty list if the cell has none
+        """
+        if not self.grid.has_representative[self.id]:
+            return []
+        return self.grid.representatives[self.id]
+
+    @representative.setter
+    def representative(self, value):
+        value = np.asarray(value, dtype=float)
+        if value.size == 0:
+            self.grid.has_representative[self.id] = False
+        else:
+            self.grid.representatives[self.id] = value
+            self.grid.has_representative[self.id] = True
+
+    @property
+    def point_indices(self):
+        """
+        The positions of the points of this cell in the PointStore of the grid
+        """
+        return self.grid.cell_points[self.id]
+
+    @property
+    def list_of_points(self):
+        """
+        The points of this cell as Datapoints
+        """
+        if not len(self.grid.cell_points[self.id]):
+            return []
+        return self.grid.points.get_points(self.grid.cell_points[self.id])
+
+    @property
+    def neighbourhood(self):
+        """
+        The neighbourhood as a list of cells and their distances, like Grid.calc_neighbourhood
+        """
+        ids, distances = self.grid.get_neighbourhood(self.id)
+        return [[self.grid.list_of_cells[i], d] for i, d in zip(ids, distances)]
+
+    @neighbourhood.setter
+    def neighbourhood(self, value):
+        self.grid.set_neighbourhood(self.id, value)
+
+    @property
+    def direct_neighbours(self):
+        return [self.grid.list_of_cells[i] for i in self.grid.direct_neighbour_ids[self.id] if i >= 0]
 
     def __eq__(self, other):
         """
@@ -51,27 +144,53 @@ class Cell:
 
     def add_point(self, point):
         """
-        this method adds a point or a list of points to the list
-        :param point: the points to add
+        this method adds a point or a list of points to the list. The mean and variance of the points in this cell are
+        updated in O(dimensions) with Welford's method.
+        :param point: the points to add, they have to be in the PointStore of the grid
         """
-        if not self.list_of_points:
-            self.list_of_points = [point]
+        if isinstance(point, list):
+            self.add_points([p.index for p in point])
         else:
-            self.list_of_points.append(point)
+            self.add_points([point.index])
+
+    def add_points(self, indices):
+        """
+        this method adds points by their positions in the PointStore of the grid
+        :param indices: the positions of the points
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        self.grid.add_points_to_cells(indices, np.full(len(indices), self.id))
+
+    def remove_point(self, point):
+        """
+        this method removes a point from the list. The mean and variance of the points in this cell are updated in
+        O(dimensions) by reverting Welford's method.
+        :param point: the point to remove
+        """
+        self.remove_points([point.index])
+
+    def remove_points(self, indices):
+        """
+        this method removes points by their positions in the PointStore of the grid
+        :param indices: the positions of the points
+        """
+        self.grid.remove_points_from_cell(self.id, indices)
 
     def calc_representative(self, cells_with_points=True, empty_cells=False):
         """
-        This method calculates the representative. The representative is the mean value of all points
+        This method calculates the representative. The representative is the mean value of all points, taken from the
+        running statistics of the cell.
         :param cells_with_points: if true the representative of all cells with points are calculated. The default
         is True
         :param empty_cells: if true the representative of all empty cells are calculated. The default is False.
         """
-        if self.list_of_points:
+        if self.grid.point_counts[self.id]:
             # calculate the representative of all cells with points
             if cells_with_points:
-                self.representative = self.points_to_dataframe(only_data=True).mean(axis=0)
-                logger.debug("Cell '%i' has '%i' points", self.id, len(self.list_of_points))
-                logger.debug("Cell '%i' finished calculation of rep '%s'", self.id, str(self.print_rep()))
+                self.representative = self.grid.point_means[self.id]
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Cell '%i' has '%i' points", self.id, self.grid.point_counts[self.id])
+                    logger.debug("Cell '%i' finished calculation of rep '%s'", self.id, self.print_rep())
                 self.ICV = self.calc_ICV()[0]
                 logger.debug("ICV for '%i' calculated: '%f'", self.id, self.ICV)
 
@@ -80,25 +199,24 @@ class Cell:
             # How to calculate the Representative of an empty cell:
             # sum_n((len(direct-neighbour_n.list_of_points)*direct-neighbour_n.representative)/
             # sum_n(len(direct-neighbour_n.list_of_points)
+            grid = self.grid
             sum_of_elements = 0
-            tmp = pd.Series()
-            for cell in self.direct_neighbours:
-                if not isinstance(cell.representative, list):
-                    if not cell.representative.empty:
-                        if tmp.empty:
-                            tmp = cell.representative.mul(len(cell.list_of_points))
-                        else:
-                            tmp = tmp.add(cell.representative.mul(len(cell.list_of_points)))
-                        sum_of_elements += len(cell.list_of_points)
+            tmp = []
+            for cell_id in grid.direct_neighbour_ids[self.id]:
+                if cell_id >= 0 and grid.has_representative[cell_id] and grid.point_counts[cell_id]:
+                    weighted = grid.representatives[cell_id] * grid.point_counts[cell_id]
+                    tmp = weighted if sum_of_elements == 0 else tmp + weighted
+                    sum_of_elements += grid.point_counts[cell_id]
 
             if sum_of_elements > 0:
-                tmp = tmp.div(sum_of_elements)
-                tmp = [a + 0.00000001 for a in tmp]  # adding an epsilon of 0.00000001
+                tmp = tmp / sum_of_elements
+                tmp = tmp + 0.00000001  # adding an epsilon of 0.00000001
 
             self.representative = tmp
 
-            logger.debug("Cell '%i' has no points = '%s'. The Rep is '%s' ", self.id, len(self.list_of_points) == 0,
-                         self.print_rep())
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Cell '%i' has no points = '%s'. The Rep is '%s' ", self.id,
+                             self.grid.point_counts[self.id] == 0, self.print_rep())
             self.ICV = self.calc_ICV()[0]
             logger.debug("ICV for '%i' calculated: '%f'", self.id, self.ICV)
 
@@ -106,72 +224,68 @@ class Cell:
         """
         This method manipulates the representative by bringing the representative closer to his neighbourhood.
         For this it calculates the distance between the representative and calculates
-        a tmp_delta to add on the representative. the shorter the distance the bigger the influence of the neighbour
+        a tmp_delta to add on the representative. the shorter the distance the bigger the influence of the neighbour.
+        The calculation is done by mf.calc_manipulated_representatives.
         """
 
-        delta = []
-        new_x = 0
-        new_y = 0
-
-        if not self.neighbourhood:
+        if not self.grid.has_representative[self.id] or not len(self.grid.get_neighbourhood(self.id)[0]):
             return [self, self.representative]
 
-        for neighbour in self.neighbourhood:
-            neighbour = neighbour[0]
-            dist = mf.calc_distance_2D(self.grid, self, neighbour)
-            tmp_delta = [(rep - dimension) * (-1 / (1 + dist)) for dimension, rep in
-                         zip(neighbour.representative, self.representative)]
-            delta_x = 1 / (1 + dist) * (neighbour.posx - self.posx)
-            delta_y = 1 / (1 + dist) * (neighbour.posy - self.posy)
-            new_x = new_x + delta_x
-            new_y = new_y + delta_y
-
-        if delta:
-            delta = [a + b for a, b in zip(delta, tmp_delta)]
-        else:
-            delta = tmp_delta
-
-        sum_representative = [a + b / len(self.neighbourhood) for a, b in zip(self.representative, delta)]
+        return [self, mf.calc_manipulated_representatives(self.grid, [self.id])[0]]
 
-        return [self, sum_representative]
-
-    def shift_points(self):
+    def shift_points(self, touched=None):
         """
         This method shifts the points. Shifting means, it searches for a better representative in the neighbourhood for
         every points. If it founds some, it will remove the point and add it in the new cell.
+        Only points which started in a cell of the neighbourhood are shifted.
+        :param touched: a set, if given the ids of all cells that lost or received points are added
         :return the number of shifts
         """
 
-        i = 0
-        list_to_remove = []
-        list_to_add = []
-        for point in self.list_of_points:
-            in_neighbourhood = False
-            for n in self.neighbourhood:
-                if point.get_org() == n[0]:
-                    in_neighbourhood = True
-                    break
-            if in_neighbourhood:
-                best = [self, mf.calc_distance_nD(self.representative, point.data)]
-                for neighbour in self.neighbourhood:
-                    attemp = [neighbour[0], mf.calc_distance_nD(neighbour[0].representative, point.data)]
-                    if attemp[1] < best[1]:
-                        best = attemp
-                if best[0] is not self:
-                    list_to_remove.append(point)
-                    best[0].list_of_points.append(point)
-                    list_to_add.append(best[0])
-                    i = i + 1
-
-                point.add_shift(new_x_center=best[0].posx + best[0].grid.cellwidth / 2,
-                                new_y_center=best[0].posy + best[0].grid.cellwidth / 2,
-                                oldcenter=[self.posx + self.grid.cellwidth / 2, self.posy + self.grid.cellwidth / 2])
-
-        for point in list_to_remove:
-            self.list_of_points.remove(point)
-            self.calc_representative()
-
-        return i
+        grid = self.grid
+        store = grid.points
+        neighbourhood_ids, _ = grid.get_neighbourhood(self.id)
+        indices = grid.cell_points[self.id]
+        indices = indices[np.isin(store.org_ids[indices], neighbourhood_ids)]
+        if not len(indices):
+            return 0
+
+        # the distance to every representative, the own cell first. Like in calc_distance_nD a cell without
+        # representative has the distance 0.
+        candidates = np.concatenate(([self.id], neighbourhood_ids))
+        data = np.asarray(store.data[indices], dtype=float)
+        distances = np.zeros((len(indices), len(candidates)))
+        for column, cell_id in enumerate(candidates):
+            if grid.has_representative[cell_id]:
+                error = data - grid.representatives[cell_id]
+                distances[:, column] = np.einsum('ij,ij->i', error, error)
+        best_ids = candidates[np.argmin(distances, axis=1)]
+
+        # every point moves with the center of his best cell
+        store.add_shifts(indices,
+                         new_x_centers=grid.posx[best_ids] + grid.cellwidth / 2,
+                         new_y_centers=grid.posy[best_ids] + grid.cellwidth / 2,
+                         old_x_centers=self.posx + grid.cellwidth / 2,
+                         old_y_centers=self.posy + grid.cellwidth / 2)
+
+        is_shifted = best_ids != self.id
+        if not is_shifted.any():
+            return 0
+
+        self.remove_points(indices[is_shifted])
+        grid.add_points_to_cells(indices[is_shifted], best_ids[is_shifted])
+
+        # the statistics are already up to date, both sides only take over the new mean and ICV
+        self.calc_representative()
+        receivers = np.unique(best_ids[is_shifted]).tolist()
+        for cell_id in receivers:
+            grid.list_of_cells[cell_id].calc_representative()
+
+        if touched is not None:
+            touched.add(self.id)
+            touched.update(receivers)
+
+        return int(is_shifted.sum())
 
     def calc_localerror(self, height_to_test=None):
         """
@@ -180,55 +294,39 @@ class Cell:
         :param height_to_test: a height to test
         :return: the possible error, if height_to_test is None the actual error of this cell
         """
-        sum_of_error = 0
-
         if height_to_test is not None:
             logger.debug("Test new height: '%f'", height_to_test)
-            tmp = self.height
-            self.height = height_to_test
-        else:
-            logger.debug("actual height: '%f'", self.height)
 
+        # sum over the direct neighbours of:
+        # (sqrt(neutral_variance / max(neutral_variance, ICV) * distance_nD) - distance_2D)^2
+        sum_of_error = mf.calc_localerrors(self.grid, [self.id],
+                                           heights_to_test=None if height_to_test is None else [height_to_test])[0]
+
+        '''
+        Alternative implementations:
+        #E1
+        error_neighbour = pow(math.sqrt(
+            mf.calc_distance_nD(self.representative, neighbour.representative)[0])
+                 - mf.calc_distance_2D(self.grid, self, neighbour), 2)
+        
+        #E2
+        error_neighbour = pow(math.sqrt(
+            (1 / max(1, self.ICV)) *
+                mf.calc_distance_nD(self.representative, neighbour.representative)[0]) 
+                - mf.calc_distance_2D(self.grid, self, neighbour), 2)
+        
+        #E3
+        s = 0
         for neighbour in self.direct_neighbours:
-
-            error_neighbour = pow(math.sqrt(
-                (self.grid.neutral_variance / max(self.grid.neutral_variance, self.ICV)) *
-                mf.calc_distance_nD(self.representative, neighbour.representative)[0]) - mf.calc_distance_2D(self.grid,
-                                                                                                             self,
-                                                                                                             neighbour),
-                                  2)
-
-            '''
-            Alternative implementations:
-            #E1
-            error_neighbour = pow(math.sqrt(
-                mf.calc_distance_nD(self.representative, neighbour.representative)[0])
-                     - mf.calc_distance_2D(self.grid, self, neighbour), 2)
-            
-            #E2
-            error_neighbour = pow(math.sqrt(
-                (1 / max(1, self.ICV)) *
-                    mf.calc_distance_nD(self.representative, neighbour.representative)[0]) 
-                    - mf.calc_distance_2D(self.grid, self, neighbour), 2)
-            
-            #E3
-            s = 0
-            for neighbour in self.direct_neighbours:
-                s += len(neighbour.list_of_points)
-            if s == 0:
-                s=1
-            
-            error_neighbour = len(neighbour.list_of_points)/s * pow(math.sqrt(
-                (self.grid.neutral_variance / max(self.grid.neutral_variance, self.ICV)) *
-                    mf.calc_distance_nD(self.representative, neighbour.representative)[0]) 
-                    - mf.calc_distance_2D(self.grid, self, neighbour), 2)
-            '''
-
-            logger.debug("Part of Error between '%i' and '%i' is '%f'", self.id, neighbour.id, error_neighbour)
-            sum_of_error += error_neighbour
-
-            if height_to_test:
-                self.height = tmp
+            s += len(neighbour.list_of_points)
+        if s == 0:
+            s=1
+        
+        error_neighbour = len(neighbour.list_of_points)/s * pow(math.sqrt(
+            (self.grid.neutral_variance / max(self.grid.neutral_variance, self.ICV)) *
+                mf.calc_distance_nD(self.representative, neighbour.representative)[0]) 
+                - mf.calc_distance_2D(self.grid, self, neighbour), 2)
+        '''
 
         return sum_of_error
 
@@ -236,12 +334,15 @@ class Cell:
     def calc_ICV(self):
         """
          this method calculates the localerror by considering the variance within the cell.
-         This method does not consider neighbourhood.
+         This method does not consider neighbourhood. The variance is taken from the running statistics of the cell.
          """
-        if len(self.list_of_points) == 1:
+        number_of_points = self.grid.point_counts[self.id]
+        if number_of_points == 1:
             return [0, 0]
+        if number_of_points == 0:
+            return [0, []]
 
-        tmp = self.points_to_dataframe(only_data=True).var(axis=0).values.tolist()
+        tmp = (np.maximum(self.grid.point_m2[self.id], 0) / (number_of_points - 1)).tolist()
         return [sum(tmp), tmp]
 
     def points_to_dataframe(self, only_data=False):
@@ -250,21 +351,16 @@ class Cell:
         :param only_data: if True, the generate x and y coordinate will not be in the dataframe
         :return: the dataframe object
         """
-        df = pd.DataFrame()
+        store = self.grid.points
+        indices = self.grid.cell_points[self.id]
+        if not len(indices):
+            return pd.DataFrame()
+        df = pd.DataFrame(np.asarray(store.data[indices]), index=indices)
         if not only_data:
-            for point in self.list_of_points:
-                if df.empty:
-                    df = pd.DataFrame(point.to_dictionary())
-                else:
-                    tmp = pd.DataFrame(point.to_dictionary())
-                    df = pd.concat([df, tmp])
-        else:
-            for point in self.list_of_points:
-                if df.empty:
-                    df = pd.DataFrame(point.to_dictionary()['data'])
-                else:
-                    tmp = pd.DataFrame(point.to_dictionary()['data'])
-                    df = pd.concat([df, tmp])
+            df.insert(0, 'yorg', store.y_org[indices])
+            df.insert(0, 'xorg', store.x_org[indices])
+            df.insert(0, 'y', store.y_axis[indices])
+            df.insert(0, 'x', store.x_axis[indices])
         return df
 
     def print_rep(self):
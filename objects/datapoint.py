@@ -1,6 +1,10 @@
+from objects.pointstore import PointStore
+
+
 class Datapoint:
     """
     This class represents a point of data, mean it represents one line of the input csv.
+    The values are stored in a PointStore, a Datapoint is a view on one row of the store.
 
     Attributes:
         x_axis (float): the x coordinate of the point in the image space after n iterations
@@ -11,26 +15,83 @@ class Datapoint:
         x_org (float): the x coordinate of the original point in the image space
         y_org (float: the y coordinate of the original point in the image space
 
-        shifts (list): a list of 2D-tuple, saving all changes to x and y coordinates
+        shift_count (int): the number of shifts of this point
+        shift_total (list): the sum of all changes to x and y coordinates
+
+        store (PointStore): the store with the values of this point
+        index (int): the position of this point in the store
     """
 
+    __slots__ = ('store', 'index')
+
     def __init__(self,
                  x_axis=None,
                  y_axis=None,
                  data=None,
+                 store=None,
+                 index=None,
                  ):
 
-        assert x_axis is not None
-        self.x_axis = x_axis
-        self.x_org = x_axis
-        assert y_axis is not None
-        self.y_axis = y_axis
-        self.y_org = y_axis
-        assert data is not None
-        self.data = data
+        if store is None:
+            assert x_axis is not None
+            assert y_axis is not None
+            assert data is not None
+            store = PointStore([x_axis], [y_axis], [data])
+            index = 0
+
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        """
+        Two points are equal if they are the same row of the same store
+        :param other: the point to compare
+        :return: if the points are equal
+        """
+        return isinstance(other, Datapoint) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    @property
+    def x_axis(self):
+        return self.store.x_axis[self.index]
 
-        self.shifts = None
-        self.org = None
+    @x_axis.setter
+    def x_axis(self, value):
+        self.store.x_axis[self.index] = value
+
+    @property
+    def y_axis(self):
+        return self.store.y_axis[self.index]
+
+    @y_axis.setter
+    def y_axis(self, value):
+        self.store.y_axis[self.index] = value
+
+    @property
+    def x_org(self):
+        return self.store.x_org[self.index]
+
+    @property
+    def y_org(self):
+        return self.store.y_org[self.index]
+
+    @property
+    def data(self):
+        return self.store.data[self.index]
+
+    @property
+    def row_index(self):
+        return self.store.row_index[self.index]
+
+    @property
+    def shift_count(self):
+        return self.store.shift_counts[self.index]
+
+    @property
+    def shift_total(self):
+        return self.store.shift_totals[self.index].tolist()
 
     @classmethod
     def from_csv(cls, point_as_list):
@@ -56,10 +117,13 @@ class Datapoint:
         return new_point
 
     def set_org(self, cell):
-        self.org = cell
+        self.store.org_ids[self.index] = cell.id
+        self.store.grid = cell.grid
 
     def get_org(self):
-        return self.org
+        if self.store.org_ids[self.index] < 0:
+            return None
+        return self.store.grid.list_of_cells[self.store.org_ids[self.index]]
 
     def get_coordinates(self):
         """
@@ -99,16 +163,7 @@ class Datapoint:
            None
         """
 
-        divx = self.x_axis - oldcenter[0]
-        divy = self.y_axis - oldcenter[1]
-
-        if not self.shifts:
-            self.shifts = [[new_x_center + divx - self.x_axis, new_y_center + divy - self.y_axis]]
-        else:
-            self.shifts.append([new_x_center + divx - self.x_axis, new_y_center + divy - self.y_axis])
-
-        self.x_axis = new_x_center + divx
-        self.y_axis = new_y_center + divy
+        self.store.add_shifts([self.index], [new_x_center], [new_y_center], [oldcenter[0]], [oldcenter[1]])
 
     def to_dictionary(self):
         """
@@ -1,13 +1,21 @@
+import heapq
 import logging
+import numpy as np
+import instrumentation
 import math_functions as mf
 from objects.cell import Cell
-from objects.datapoint import Datapoint
+from objects.pointstore import PointStore
 
 # Logger for everything (saves his log in logs/logfile.txt
 logger = logging.getLogger('Grid')
 
 
 class Grid:
+    # the names of the arrays with the state of the cells, every array is indexed by the cell id
+    ARRAYS = ('posx', 'posy', 'heights', 'icvs', 'localerrors', 'point_counts', 'representatives',
+              'has_representative', 'point_means', 'point_m2', 'direct_neighbour_ids', 'neighbourhood_offsets',
+              'neighbourhood_ids', 'neighbourhood_distances', 'in_error_cut', 'in_icv_cut')
+
     def __init__(self,
                  rows,
                  dimension,
@@ -16,6 +24,8 @@ class Grid:
                  ):
         """
         This class represents the grid used for my gridbased approach. It contains information about cells and data.
+        The state of the cells (positions, heights, ICV, localerrors, number of points and representatives) is stored
+        in flat arrays indexed by the cell id. The cells in list_of_cells are thin views on these arrays.
         :param rows: the number of rows
         :param dimension number of dimensions in the original data
         :param columns: the number of columns
@@ -29,13 +39,93 @@ class Grid:
         if columns is not None:
             self.columns = columns
 
+        self.dimension = dimension
+        number_of_cells = self.rows * self.columns
+
+        # the state of every cell, indexed by the cell id
+        self.posx = np.zeros(number_of_cells)
+        self.posy = np.zeros(number_of_cells)
+        self.heights = np.zeros(number_of_cells)
+        self.icvs = np.zeros(number_of_cells)
+        self.localerrors = np.zeros(number_of_cells)
+        self.point_counts = np.zeros(number_of_cells, dtype=np.int64)
+        self.representatives = np.zeros((number_of_cells, dimension))
+        self.has_representative = np.zeros(number_of_cells, dtype=bool)
+        # running mean and sum of squared deviations (Welford) of the points in every cell
+        self.point_means = np.zeros((number_of_cells, dimension))
+        self.point_m2 = np.zeros((number_of_cells, dimension))
+        # True if the cell was in the cut of the highest localerrors (ICVs) of the last iteration
+        self.in_error_cut = np.zeros(number_of_cells, dtype=bool)
+        self.in_icv_cut = np.zeros(number_of_cells, dtype=bool)
+        # the points of the grid and the positions of the points of every cell in this store
+        self.points = None
+        self.cell_points = [np.zeros(0, dtype=np.int64) for _ in range(number_of_cells)]
+        # the ids of the four direct neighbours (right, left, lower, upper), -1 if the neighbour does not exist
+        self.direct_neighbour_ids = np.full((number_of_cells, 4), -1, dtype=np.int64)
+        # the neighbourhoods, one column for every offset in neighbourhood_offsets (id -1 and distance inf if the
+        # cell at this offset is not part of the neighbourhood)
+        self.neighbourhood_offsets = np.zeros((0, 2), dtype=np.int64)
+        self.neighbourhood_ids = np.full((number_of_cells, 0), -1, dtype=np.int64)
+        self.neighbourhood_distances = np.full((number_of_cells, 0), np.inf)
+
         if cells:
             self.list_of_cells = cells
+        else:
+            self.list_of_cells = []
 
         self.cellwidth = 1 / (rows-2)
 
         self.neutral_variance = mf.calc_neutral_variance(self,dimension)
 
+    @classmethod
+    def from_arrays(cls, rows, dimension, arrays, columns=None):
+        """
+        This method creates a grid around existing arrays (e.g. in shared memory), the arrays are not copied.
+        The grid has no points, set points and cell_points if needed.
+        :param rows: the number of rows
+        :param dimension: number of dimensions in the original data
+        :param arrays: a dictionary with an array for every name in Grid.ARRAYS
+        :param columns: the number of columns
+        :return: the grid
+        """
+        grid = cls.__new__(cls)
+        grid.rows = rows
+        grid.columns = columns if columns is not None else rows
+        grid.dimension = dimension
+        for name in cls.ARRAYS:
+            setattr(grid, name, arrays[name])
+        grid.points = None
+        grid.cell_points = [np.zeros(0, dtype=np.int64) for _ in range(grid.rows * grid.columns)]
+        grid.list_of_cells = [Cell(cell_id, grid) for cell_id in range(grid.rows * grid.columns)]
+        grid.cellwidth = 1 / (rows-2)
+        grid.neutral_variance = mf.calc_neutral_variance(grid, dimension)
+        return grid
+
+    def copy(self):
+        """
+        This method copies the grid with all arrays and points. The original data of the points is not copied,
+        it is never changed and the copy shares it with this grid.
+        :return: the copy
+        """
+        grid = Grid.from_arrays(self.rows, self.dimension, {name: getattr(self, name).copy() for name in Grid.ARRAYS},
+                                columns=self.columns)
+        if self.points is not None:
+            grid.points = self.points.copy()
+            grid.points.grid = grid
+            # the index arrays of the cells are replaced and never changed, so they can be shared
+            grid.cell_points = list(self.cell_points)
+        return grid
+
+    def __getstate__(self):
+        # the cells are only views on the arrays, they are created again after unpickling
+        state = self.__dict__.copy()
+        del state['list_of_cells']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.list_of_cells = [Cell(cell_id, self) for cell_id in range(self.rows * self.columns)]
+
     @classmethod
     def autogenerated(cls,
                       rows,
@@ -67,18 +157,15 @@ class Grid:
         start_x = 0 - cellwidth_x
         start_y = 0 - cellwidth_y
 
-        list_of_cells = []
-        # the cell id, starting by 0
-        tmp_id = 0
+        # the cell id is tmp_y * rows + tmp_x, starting by 0
+        tmp_x = np.tile(np.arange(grid.rows), grid.columns)
+        tmp_y = np.repeat(np.arange(grid.columns), grid.rows)
+        grid.posx[:] = start_x + tmp_x * cellwidth_x
+        grid.posy[:] = start_y + (grid.columns - 1) * cellwidth_y - tmp_y * cellwidth_y
+        grid.heights[:] = 0
 
         # add cells to grid
-        for tmp_y in range(0, grid.columns):
-            for tmp_x in range(0, grid.rows):
-                list_of_cells.append(Cell(tmp_id, grid, posx=start_x + tmp_x * cellwidth_x,
-                                          posy=start_y + (grid.columns - 1) * cellwidth_y - tmp_y * cellwidth_y, height=0))
-                tmp_id += 1
-
-        grid.list_of_cells = list_of_cells
+        grid.list_of_cells = [Cell(cell_id, grid) for cell_id in range(grid.rows * grid.columns)]
         grid.set_direct_neighbours()
 
         # return the grid with generated cells
@@ -87,66 +174,189 @@ class Grid:
     def init_points_to_right_cell(self, points):
         """
         This method gets a list of points. For every point it searched the correct cell by his x and y coordinate and
-        add the point to this cell
-        :param points:  list of points
-
-        Raises:
-            Raise a ValueError if the cell could not be found. This means the input was incorrect.
+        add the point to this cell. The points are saved in a PointStore, the cells only keep the positions of their
+        points in this store.
+        :param points:  list of points, or a Dataframe with the index of every point
+        :return: the positions of all points without a cell. They are reported together in one log message.
         """
 
         # if points is a Dataframe instead of a list
         if not isinstance(points, list):
-            points_val = points.values
+            self.points = PointStore.from_csv(points.values, row_index=points.index.values)
         else:
-            points_val = points
-
-        # for every point
-        for index in range(0, len(points_val)):
-            point = Datapoint.from_csv(points_val[index:index + 1])
-            x = point.x_axis
-            y = point.y_axis
-            found = False
-            for cell in self.list_of_cells:
-                if cell.posx <= x <= cell.posx + self.cellwidth and cell.posy <= y <= cell.posy + self.cellwidth:
-                    cell.add_point(point)
-                    point.set_org(cell)
-                    found = True
-            if not found:
-                logger.critical("ERROR by Point did not find cell for '%f', '%f'", point.x_axis, point.y_axis)
-                #raise ValueError
-                #pass
+            self.points = PointStore.from_csv(np.asarray(points, dtype=float))
+        self.points.grid = self
+
+        return self.assign_points()
+
+    def assign_points(self, indices=None, chunk_size=65536):
+        """
+        This method searches the cells for points of the PointStore and adds them to these cells. The cell of a point
+        is also the cell he started in.
+        :param indices: the positions of the points in the store, if None all points are assigned
+        :param chunk_size: the number of points to add at once, this bounds the memory usage
+        :return: the positions of all points without a cell. They are reported together in one log message.
+        """
+        if indices is None:
+            indices = np.arange(len(self.points))
+        indices = np.asarray(indices, dtype=np.int64)
+
+        cell_ids = self.bin_points(self.points.x_axis[indices], self.points.y_axis[indices])
+        self.points.org_ids[indices] = cell_ids
+
+        inside = cell_ids >= 0
+        for start in range(0, len(indices), chunk_size):
+            self.add_points_to_cells(indices[start:start + chunk_size][inside[start:start + chunk_size]],
+                                     cell_ids[start:start + chunk_size][inside[start:start + chunk_size]])
+
+        not_found = indices[~inside]
+        if len(not_found):
+            logger.critical("ERROR by '%i' Points did not find a cell, the first ones are '%s'", len(not_found),
+                            np.stack([self.points.x_axis[not_found[:5]], self.points.y_axis[not_found[:5]]],
+                                     axis=1).tolist())
+        return not_found
+
+    def add_points_to_cells(self, indices, cell_ids):
+        """
+        This method adds many points to their cells. The mean and variance of every cell are merged with the mean
+        and variance of his new points (Chan's parallel version of Welford's method).
+        :param indices: the positions of the points in the store
+        :param cell_ids: the new cell of every point
+        """
+        targets, counts, means, m2, groups = self.calc_point_statistics(indices, cell_ids)
+        if not len(targets):
+            return
+
+        old_counts = self.point_counts[targets]
+        new_counts = old_counts + counts
+        delta = means - self.point_means[targets]
+        self.point_means[targets] += delta * (counts / new_counts)[:, None]
+        self.point_m2[targets] += m2 + delta ** 2 * (old_counts * counts / new_counts)[:, None]
+        self.point_counts[targets] = new_counts
+
+        for cell_id, group in zip(targets.tolist(), groups):
+            self.cell_points[cell_id] = np.concatenate((self.cell_points[cell_id], group))
+        self.points.cell_ids[indices] = cell_ids
+
+    def remove_points_from_cell(self, cell_id, indices):
+        """
+        This method removes points from a cell. The mean and variance of the cell are updated by reverting Chan's
+        method.
+        :param cell_id: the id of the cell
+        :param indices: the positions of the points in the store
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if not len(indices):
+            return
+        _, counts, means, m2, _ = self.calc_point_statistics(indices, np.full(len(indices), cell_id))
+
+        old_count = self.point_counts[cell_id]
+        new_count = old_count - counts[0]
+        if new_count == 0:
+            self.point_means[cell_id] = 0
+            self.point_m2[cell_id] = 0
+        else:
+            new_mean = self.point_means[cell_id] - (means[0] - self.point_means[cell_id]) * (counts[0] / new_count)
+            delta = means[0] - new_mean
+            self.point_m2[cell_id] -= m2[0] + delta ** 2 * (new_count * counts[0] / old_count)
+            self.point_means[cell_id] = new_mean
+        self.point_counts[cell_id] = new_count
+
+        members = self.cell_points[cell_id]
+        self.cell_points[cell_id] = members[~np.isin(members, indices)]
+        self.points.cell_ids[indices] = -1
+
+    def calc_point_statistics(self, indices, cell_ids):
+        """
+        This method groups points by their cells and calculates the number of points, the mean and the sum of squared
+        deviations of every group
+        :param indices: the positions of the points in the store
+        :param cell_ids: the cell of every point
+        :return: the cell ids of the groups, the counts, the means, the sums of squared deviations and the positions of
+        the points of every group (in the order of indices)
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        if not len(indices):
+            empty = np.zeros((0, self.dimension))
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), empty, empty, []
+
+        order = np.argsort(cell_ids, kind='stable')
+        indices = indices[order]
+        cell_ids = cell_ids[order]
+        starts = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1]])
+        counts = np.diff(np.r_[starts, len(cell_ids)])
+
+        data = np.asarray(self.points.data[indices], dtype=float)
+        means = np.add.reduceat(data, starts, axis=0) / counts[:, None]
+        m2 = np.add.reduceat((data - np.repeat(means, counts, axis=0)) ** 2, starts, axis=0)
+
+        return cell_ids[starts], counts, means, m2, np.split(indices, starts[1:])
+
+    def bin_points(self, x_axis, y_axis):
+        """
+        This method calculates the cell ids for many points at once. Every cell contains the points in
+        [posx, posx + cellwidth) x [posy, posy + cellwidth), so a point on the border between two cells belongs to the
+        cell on the right or upper side. Points on the outer right and upper border of the grid belong to the cells at
+        this border.
+        :param x_axis: an array with the x coordinates of the points
+        :param y_axis: an array with the y coordinates of the points
+        :return: an array with the cell id for every point, -1 if the point is outside of the grid
+        """
+        x_axis = np.asarray(x_axis, dtype=float)
+        y_axis = np.asarray(y_axis, dtype=float)
+
+        start_x = self.posx.min()
+        start_y = self.posy.min()
+
+        with np.errstate(invalid='ignore'):
+            tmp_x = np.floor((x_axis - start_x) / self.cellwidth)
+            tmp_y = np.floor((y_axis - start_y) / self.cellwidth)
+
+            # the outer right and upper border are part of the grid
+            tmp_x[(tmp_x == self.rows) & (x_axis <= start_x + self.rows * self.cellwidth)] = self.rows - 1
+            tmp_y[(tmp_y == self.columns) & (y_axis <= start_y + self.columns * self.cellwidth)] = self.columns - 1
+
+            inside = (tmp_x >= 0) & (tmp_x < self.rows) & (tmp_y >= 0) & (tmp_y < self.columns)
+
+        cell_ids = np.full(x_axis.shape, -1, dtype=np.int64)
+        # the first row of cells is the upper one
+        cell_ids[inside] = (self.columns - 1 - tmp_y[inside]) * self.rows + tmp_x[inside]
+        return cell_ids
 
     def get_all_points(self):
         """
         This method returns every Point in the grid
         :return: a list_of_points with every point of every cell
         """
-        list_of_points = []
-        for cell in self.list_of_cells:
-            list_of_points = list_of_points + cell.list_of_points
-        return list_of_points
+        if self.points is None or not len(self.points):
+            return []
+        return self.points.get_points(np.concatenate(self.cell_points))
 
     def set_direct_neighbours(self):
         """
         This method iterates over the cells of the grid and sets the direct 4 neighbours for every cell
         """
 
-        for cell in self.list_of_cells:
-            if (cell.id + 1) % self.rows != 0:
-                cell.direct_neighbours.append(self.get_cell(cell_id=cell.id + 1))
-                self.get_cell(cell_id=cell.id + 1).direct_neighbours.append(cell)
-            if cell.id + self.columns < self.columns * self.rows:
-                cell.direct_neighbours.append(self.get_cell(cell_id=cell.id + self.columns))
-                self.get_cell(cell_id=cell.id + self.columns).direct_neighbours.append(cell)
+        ids = np.arange(self.rows * self.columns)
+        tmp_x = ids % self.rows
+        tmp_y = ids // self.rows
 
-            cell.direct_neighbours = list(set(cell.direct_neighbours))
-            logger.debug("List of direct neighbours for '%i' are '%s'", cell.id, cell.print_direct_neighbour())
+        self.direct_neighbour_ids[:] = -1
+        self.direct_neighbour_ids[:, 0] = np.where(tmp_x < self.rows - 1, ids + 1, -1)
+        self.direct_neighbour_ids[:, 1] = np.where(tmp_x > 0, ids - 1, -1)
+        self.direct_neighbour_ids[:, 2] = np.where(tmp_y < self.columns - 1, ids + self.rows, -1)
+        self.direct_neighbour_ids[:, 3] = np.where(tmp_y > 0, ids - self.rows, -1)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for cell in self.list_of_cells:
+                logger.debug("List of direct neighbours for '%i' are '%s'", cell.id, cell.print_direct_neighbour())
 
     def get_cell(self, column=None, row=None, cell_id=None, point=None):
         """
         Returns a cell. Their are two different methods to search for a cell.
         First you can search with the coordinates of the cell. Second you can search by the id. You only need one of
-        both. The id method is to prefer.
+        both. All lookups are O(1), a point is assigned like in bin_points.
 
         :param column: the y coordinate of the searched cell
         :param row: the x coordinate of the searches cell
@@ -157,68 +367,161 @@ class Grid:
         Raises:
             Raise a ValueError if the cell could not be found. This means the input was incorrect.
         """
-        if column and row:
+        if column is not None and row is not None:
             cell_id = row * self.rows + column
-            for neuron in self.list_of_cells:
-                if neuron.id == cell_id:
-                    return neuron
-            raise ValueError
-            pass
-        elif cell_id or cell_id == 0:
-            for neuron in self.list_of_cells:
-                if neuron.id == cell_id:
-                    return neuron
-            raise ValueError
-            pass
+
+        if cell_id is not None:
+            if not 0 <= cell_id < len(self.list_of_cells):
+                raise ValueError
+            return self.list_of_cells[cell_id]
         else:
-            x = point.x_axis
-            y = point.y_axis
-            for cell in self.list_of_cells:
-                if cell.posx <= x <= cell.posx + self.cellwidth and cell.posy <= y <= cell.posy + self.cellwidth:
-                    return cell
-            raise ValueError
-            pass
+            cell_id = self.bin_points([point.x_axis], [point.y_axis])[0]
+            if cell_id < 0:
+                raise ValueError
+            return self.list_of_cells[cell_id]
 
-    def calc_neighbourhood(self, max_distance, cell, visited_cells=None, costs=0, only_cells=False):
+    def calc_neighbourhood(self, max_distance, cell, only_cells=False):
         """
-        This method calculates a list with all cells of the neighbourhood for one specific cell
+        This method calculates a list with all cells of the neighbourhood for one specific cell. It is a Dijkstra
+        search with a priority queue, that stops at max_distance.
 
         :param max_distance: the maximals distance to go. Every cell in a smaller distance is reachable and part of the
         neighbourhood
         :param cell: the specific cell
-        :param visited_cells: a list with all visited cells and their distance
-        :param costs: the cost we already went.
         :param only_cells: if False the method returns a List with cells and distances,
         if true it returns only the cells
-        :return: the neighbourhood as list
-        """
-        if visited_cells is None:
-            visited_cells = []
-        if not visited_cells:
-            if only_cells:
-                visited_cells = [cell]
-            else:
-                visited_cells = [[cell, 0]]
-
-        for neighbour in cell.direct_neighbours:
-            distance = costs + mf.calc_distance_2D(grid=self, cell=cell, neighbour=neighbour)
-            if max_distance - distance >= 0:
-                is_element = False
-                for v in visited_cells:
-                    if v[0] == neighbour:
-                        is_element = True
-                        if v[1] > distance:
-                            v[1] = distance
-                            is_element = False
-                if not is_element:
-                    if only_cells:
-                        visited_cells.append(neighbour)
-                    else:
-                        visited_cells.append([neighbour, distance])
-                    visited_cells = self.calc_neighbourhood(max_distance=max_distance, cell=neighbour,
-                                                            visited_cells=visited_cells,
-                                                            costs=distance)
-        return visited_cells
+        :return: the neighbourhood as list, starting with the cell itself
+        """
+        distances = {cell.id: 0}
+        visited_cells = []
+        settled = set()
+        queue = [(0, cell.id)]
+
+        while queue:
+            costs, cell_id = heapq.heappop(queue)
+            if cell_id in settled:
+                continue
+            settled.add(cell_id)
+            visited_cells.append(cell_id)
+            instrumentation.count('dijkstra_expansions')
+
+            for neighbour_id in self.direct_neighbour_ids[cell_id]:
+                if neighbour_id < 0:
+                    continue
+                # the same costs as calc_distance_2D between direct neighbours
+                distance = costs + self.cellwidth + (self.heights[cell_id] - self.heights[neighbour_id]) ** 2
+                if max_distance - distance >= 0 and distance < distances.get(neighbour_id, np.inf):
+                    distances[neighbour_id] = distance
+                    heapq.heappush(queue, (distance, neighbour_id))
+
+        if only_cells:
+            return [self.list_of_cells[cell_id] for cell_id in visited_cells]
+        return [[self.list_of_cells[cell_id], distances[cell_id]] for cell_id in visited_cells]
+
+    def calc_neighbourhoods(self, max_distance, cell_ids=None):
+        """
+        This method calculates the neighbourhoods of many cells in one call and saves them in neighbourhood_ids and
+        neighbourhood_distances. The result is the same as calc_neighbourhood for every cell.
+
+        :param max_distance: the maximals distance to go
+        :param cell_ids: the ids of the cells to calculate, if None the neighbourhoods of all cells are calculated
+        """
+        offsets = mf.calc_neighbourhood_offsets(int(max_distance / self.cellwidth + 1e-9))
+        if not np.array_equal(offsets, self.neighbourhood_offsets):
+            self.resize_neighbourhoods(offsets, keep=False)
+            cell_ids = None
+
+        # a neighbourhood never reaches further than the radius of the offsets, so we only need the rows around
+        # the cells
+        heights = self.heights.reshape(self.columns, self.rows)
+        if cell_ids is None:
+            cell_ids = np.arange(self.rows * self.columns)
+            first_row, last_row = 0, self.columns
+        else:
+            cell_ids = np.asarray(cell_ids, dtype=np.int64)
+            if not len(cell_ids):
+                return
+            radius = int(np.abs(offsets).sum(axis=1).max())
+            first_row = max(int(cell_ids.min()) // self.rows - radius, 0)
+            last_row = min(int(cell_ids.max()) // self.rows + radius + 1, self.columns)
+
+        distances = mf.calc_neighbourhood_distances(heights[first_row:last_row], self.cellwidth, max_distance,
+                                                    offsets)
+        positions = cell_ids - first_row * self.rows
+        distances = distances[positions]
+
+        ids = cell_ids[:, None] + offsets[:, 1] * self.rows + offsets[:, 0]
+        self.neighbourhood_ids[cell_ids] = np.where(np.isfinite(distances), ids, -1)
+        self.neighbourhood_distances[cell_ids] = distances
+        # every cell of a neighbourhood is one expansion of calc_neighbourhood
+        instrumentation.count('dijkstra_expansions', int(np.isfinite(distances).sum()))
+
+    def get_neighbourhood(self, cell_id):
+        """
+        Returns the neighbourhood of a cell as arrays
+        :param cell_id: the id of the cell
+        :return: the ids of the cells in the neighbourhood and their distances
+        """
+        ids = self.neighbourhood_ids[cell_id]
+        in_neighbourhood = ids >= 0
+        return ids[in_neighbourhood], self.neighbourhood_distances[cell_id][in_neighbourhood]
+
+    def set_neighbourhood(self, cell_id, neighbourhood):
+        """
+        Sets the neighbourhood of a cell
+        :param cell_id: the id of the cell
+        :param neighbourhood: the neighbourhood as a list of cells and distances, like calc_neighbourhood
+        """
+        ids = np.array([pair[0].id for pair in neighbourhood], dtype=np.int64)
+        distances = np.array([pair[1] for pair in neighbourhood], dtype=float)
+        offsets = np.stack([ids % self.rows - cell_id % self.rows, ids // self.rows - cell_id // self.rows], axis=1)
+
+        index = {(dx, dy): k for k, (dx, dy) in enumerate(self.neighbourhood_offsets.tolist())}
+        if any(tuple(offset) not in index for offset in offsets.tolist()):
+            radius = int(np.abs(offsets).sum(axis=1).max())
+            self.resize_neighbourhoods(mf.calc_neighbourhood_offsets(radius))
+            index = {(dx, dy): k for k, (dx, dy) in enumerate(self.neighbourhood_offsets.tolist())}
+
+        columns = [index[tuple(offset)] for offset in offsets.tolist()]
+        self.neighbourhood_ids[cell_id] = -1
+        self.neighbourhood_distances[cell_id] = np.inf
+        self.neighbourhood_ids[cell_id, columns] = ids
+        self.neighbourhood_distances[cell_id, columns] = distances
+
+    def resize_neighbourhoods(self, offsets, keep=True):
+        """
+        Changes the offsets of the saved neighbourhoods
+        :param offsets: the new offsets
+        :param keep: if True the saved neighbourhoods are copied, the new offsets must contain the old ones
+        """
+        ids = np.full((self.rows * self.columns, len(offsets)), -1, dtype=np.int64)
+        distances = np.full((self.rows * self.columns, len(offsets)), np.inf)
+        if keep:
+            index = {(dx, dy): k for k, (dx, dy) in enumerate(offsets.tolist())}
+            for old, (dx, dy) in enumerate(self.neighbourhood_offsets.tolist()):
+                ids[:, index[(dx, dy)]] = self.neighbourhood_ids[:, old]
+                distances[:, index[(dx, dy)]] = self.neighbourhood_distances[:, old]
+        self.neighbourhood_offsets = offsets
+        self.neighbourhood_ids = ids
+        self.neighbourhood_distances = distances
+
+    def expand_cells(self, cell_ids):
+        """
+        This method returns every cell that depends on the given cells: the cells itself, their direct neighbours
+        and every cell whose neighbourhood (in the radius of neighbourhood_offsets) can reach them.
+        :param cell_ids: the ids of the cells
+        :return: the sorted ids of all dependent cells
+        """
+        cells = np.zeros((self.columns, self.rows), dtype=bool)
+        cells.flat[np.asarray(cell_ids, dtype=np.int64)] = True
+
+        # the offsets are symmetric, so every cell in reach is found by shifting the cells by every offset
+        offsets = np.concatenate((self.neighbourhood_offsets, [[0, 0], [1, 0], [-1, 0], [0, 1], [0, -1]]))
+        dependent = np.zeros_like(cells)
+        for dx, dy in np.unique(offsets, axis=0).tolist():
+            dependent[max(dy, 0):self.columns + min(dy, 0), max(dx, 0):self.rows + min(dx, 0)] |= \
+                cells[max(-dy, 0):self.columns + min(-dy, 0), max(-dx, 0):self.rows + min(-dx, 0)]
+        return np.flatnonzero(dependent)
 
     def sort_and_cut(self, percent=None, number_of_cells=5, searchparameter=lambda cell: cell.localerror):
         """
@@ -238,10 +541,25 @@ class Grid:
         else:
             return sorted_list[:number_of_cells]
 
+    def cut_ids(self, values, percent=None, number_of_cells=5):
+        """
+        Like sort_and_cut, but for a value of every cell as array: returns the ids of the cells with the percent
+        highest values or the number_of_cells cells, in the same order as sort_and_cut
+        :param values: an array with one value for every cell, e.g. grid.localerrors or grid.icvs
+        :param percent: the percent of highest values to cut, as a int between 1 and 100
+        :param number_of_cells: the number of cells if percent is 0 or None
+        :return: an array of cell ids, sorted descending by the values
+        """
+        # sorted is stable and reversed afterwards, so equal values are in descending order of the ids
+        order = np.argsort(values, kind='stable')[::-1]
+        if percent:
+            return order[:int(len(order) * percent / 100)]
+        return order[:number_of_cells]
+
     def set_mountains(self, new_heights):
         """
         This method gets a map of cells by id and new heights. It sets the new heights
         :param new_heights: a Map with cell by id and their new heights
         """
         for key, value in new_heights.items():
-            self.get_cell(cell_id=key).height = value
+            self.heights[key] = value
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class PointStore:
+    """
+    This class stores all points of the input in columns, every point is one row of these columns. The points keep
+    their position in the store for the whole run, so a position is a stable id of the point.
+
+    Attributes:
+        data (ndarray): a matrix (points x dimensions) with the original dimensions of the original space
+
+        x_axis (ndarray): the x coordinates of the points in the image space after n iterations
+        y_axis (ndarray): the y coordinates of the points in the image space after n iterations
+
+        x_org (ndarray): the x coordinates of the original points in the image space
+        y_org (ndarray): the y coordinates of the original points in the image space
+
+        row_index (ndarray): the index of every point in the input (the first column of the input csv)
+        cell_ids (ndarray): the id of the cell every point belongs to, -1 if the point is in no cell
+        org_ids (ndarray): the id of the cell every point started in, -1 if it is not set
+
+        shift_counts (ndarray): the number of shifts of every point
+        shift_totals (ndarray): a matrix (points x 2) with the sum of all changes to the x and y coordinates
+
+        grid (Grid): the grid the cell ids belong to
+    """
+    # the names of the arrays with the state of the points, every array is indexed by the position in the store
+    ARRAYS = ('data', 'x_axis', 'y_axis', 'x_org', 'y_org', 'row_index', 'cell_ids', 'org_ids', 'shift_counts',
+              'shift_totals')
+
+    def __init__(self,
+                 x_axis,
+                 y_axis,
+                 data,
+                 row_index=None,
+                 ):
+
+        self.data = np.asarray(data)
+        if self.data.ndim == 1:
+            self.data = self.data.reshape(len(self.data), -1)
+        if not np.issubdtype(self.data.dtype, np.floating):
+            self.data = self.data.astype(float)
+
+        self.x_axis = np.array(x_axis, dtype=float)
+        self.y_axis = np.array(y_axis, dtype=float)
+        self.x_org = self.x_axis.copy()
+        self.y_org = self.y_axis.copy()
+
+        if row_index is None:
+            row_index = np.arange(len(self.x_axis))
+        self.row_index = np.asarray(row_index)
+
+        self.cell_ids = np.full(len(self.x_axis), -1, dtype=np.int64)
+        self.org_ids = np.full(len(self.x_axis), -1, dtype=np.int64)
+
+        self.shift_counts = np.zeros(len(self.x_axis), dtype=np.int64)
+        self.shift_totals = np.zeros((len(self.x_axis), 2))
+
+        self.grid = None
+
+    @classmethod
+    def from_csv(cls, values, row_index=None):
+        """
+        this method initializes the store with the values of the input csv
+
+        Args:
+            :param values: a matrix with one row for every point in form [x_axis,y_axis,data]
+            :param row_index: the index of every row, the default is 0..n-1
+
+        Returns:
+            :return: a PointStore with coordinates and data set
+        """
+        values = np.asarray(values)
+        return PointStore(values[:, 0], values[:, 1], values[:, 2:], row_index=row_index)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        this method creates a store around existing arrays (e.g. memory mapped), the arrays are not copied
+
+        Args:
+            :param arrays: a dictionary with an array for every name in PointStore.ARRAYS
+
+        Returns:
+            :return: a PointStore without grid
+        """
+        store = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(store, name, arrays[name])
+        store.grid = None
+        return store
+
+    def copy(self):
+        """
+        Copies the store without the grid. The data is not copied, it is never changed and the copy shares it.
+        :return: the copy
+        """
+        return PointStore.from_arrays({name: getattr(self, name) if name == 'data' else getattr(self, name).copy()
+                                       for name in PointStore.ARRAYS})
+
+    def __len__(self):
+        return len(self.x_axis)
+
+    @property
+    def dimension(self):
+        return self.data.shape[1]
+
+    def get_point(self, index):
+        """
+        Returns a view on one point
+        :param index: the position of the point in the store
+        :return: a Datapoint
+        """
+        from objects.datapoint import Datapoint
+        return Datapoint(store=self, index=index)
+
+    def get_points(self, indices):
+        """
+        Returns views on many points
+        :param indices: the positions of the points in the store
+        :return: a list of Datapoints
+        """
+        from objects.datapoint import Datapoint
+        return [Datapoint(store=self, index=index) for index in np.asarray(indices).tolist()]
+
+    def add_shifts(self, indices, new_x_centers, new_y_centers, old_x_centers, old_y_centers):
+        """
+        this method shifts many points at once. Every point keeps his position relative to the center of his cell.
+        See Datapoint.add_shift
+
+        Args:
+            :param indices: the positions of the points in the store
+            :param new_x_centers: the x coordinates of the new centers
+            :param new_y_centers: the y coordinates of the new centers
+            :param old_x_centers: the x coordinates of the old centers
+            :param old_y_centers: the y coordinates of the old centers
+        """
+        shift_x = np.asarray(new_x_centers, dtype=float) - old_x_centers
+        shift_y = np.asarray(new_y_centers, dtype=float) - old_y_centers
+
+        self.x_axis[indices] += shift_x
+        self.y_axis[indices] += shift_y
+        self.shift_totals[indices, 0] += shift_x
+        self.shift_totals[indices, 1] += shift_y
+        self.shift_counts[indices] += 1
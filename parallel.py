@@ -0,0 +1,252 @@
+import logging
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import instrumentation
+import math_functions as mf
+from objects.grid import Grid
+
+logger = logging.getLogger('main')
+
+# the grid of a worker process, all arrays of this grid are in shared memory
+_worker_grid = None
+# the shared memory blocks of a worker process, they must stay open as long as the arrays are used
+_worker_blocks = []
+# the arrays for the new heights and representatives of a worker process
+_worker_scratch = {}
+
+
+class SerialExecutor:
+    """
+    This class runs the phases of an iteration on the cells of the grid in this process. Every phase only reads
+    the state of the grid before this phase (the new heights and representatives are all calculated before the
+    first one is set), so the result does not depend on the order of the cells.
+    """
+
+    def __init__(self, grid):
+        """
+        :param grid: the grid to work on
+        """
+        self.grid = grid
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def calc_localerrors(self, cell_ids):
+        """
+        Calculates the localerror of the cells and saves them in grid.localerrors
+        :param cell_ids: the ids of the cells
+        """
+        self.grid.localerrors[cell_ids] = mf.calc_localerrors(self.grid, cell_ids)
+
+    def set_mountains(self, cell_ids):
+        """
+        Calculates the new heights of the cells and saves them in grid.heights
+        :param cell_ids: the ids of the cells
+        """
+        self.grid.heights[cell_ids] = mf.calc_mountain_heights(self.grid, cell_ids)
+
+    def calc_neighbourhoods(self, max_distance, cell_ids):
+        """
+        Calculates the neighbourhoods of the cells, see Grid.calc_neighbourhoods
+        :param max_distance: the maximal distance of the neighbourhoods
+        :param cell_ids: the ids of the cells
+        """
+        self.grid.calc_neighbourhoods(max_distance, cell_ids=cell_ids)
+
+    def manipulate_representatives(self, cell_ids):
+        """
+        Calculates the manipulated representatives of the cells and saves them in grid.representatives
+        :param cell_ids: the ids of the cells
+        """
+        self.grid.representatives[cell_ids] = mf.calc_manipulated_representatives(self.grid, cell_ids)
+
+
+class TiledExecutor(SerialExecutor):
+    """
+    This class runs the phases of an iteration in worker processes. The grid is split into tiles (bands of rows)
+    and every tile is one task. All arrays of the grid are moved to shared memory, so a worker reads the border
+    cells of the other tiles (up to the radius of the neighbourhoods deep) directly from the state the phase before
+    has written. The end of every phase is the exchange of these borders: a phase starts after all tiles of the
+    phase before are finished.
+
+    The new heights and representatives are written to separate arrays first and copied to the grid after all
+    tiles are finished, so every tile reads the old values of his borders, like the serial version.
+
+    The shifts are not part of this class, they run in the order of the ICV and every shift changes the
+    representatives read by the next cells, so they stay serial in the main process.
+    """
+
+    def __init__(self, grid, workers=None, max_distance=None, tiles_per_worker=4, start_method=None):
+        """
+        :param grid: the grid to work on. Its arrays are replaced by arrays in shared memory until close is called
+        :param workers: the number of worker processes, the default is the number of cpus
+        :param max_distance: the maximal distance of the neighbourhoods. The neighbourhood arrays are allocated for
+        this distance, calc_neighbourhoods only accepts distances with the same radius
+        :param tiles_per_worker: the number of tiles for every worker, more tiles balance the work better
+        :param start_method: the start method of the worker processes, see multiprocessing.get_context
+        """
+        super().__init__(grid)
+        self.workers = workers or os.cpu_count()
+
+        if max_distance is not None:
+            offsets = mf.calc_neighbourhood_offsets(int(max_distance / grid.cellwidth + 1e-9))
+            if not np.array_equal(offsets, grid.neighbourhood_offsets):
+                grid.resize_neighbourhoods(offsets, keep=False)
+
+        # the first cell id of every tile and the end of the last tile
+        number_of_tiles = max(min(self.workers * tiles_per_worker, grid.columns), 1)
+        self.tile_bounds = np.linspace(0, grid.columns, number_of_tiles + 1).astype(np.int64) * grid.rows
+
+        self.blocks = []
+        self.pool = None
+        specs = {}
+        try:
+            for name in Grid.ARRAYS:
+                setattr(grid, name, self._share(name, getattr(grid, name), specs))
+            self.new_heights = self._share('new_heights', np.zeros_like(grid.heights), specs)
+            self.new_representatives = self._share('new_representatives', np.zeros_like(grid.representatives),
+                                                   specs)
+
+            context = multiprocessing.get_context(start_method)
+            self.pool = context.Pool(self.workers, initializer=_init_worker,
+                                     initargs=(grid.rows, grid.columns, grid.dimension, specs,
+                                               instrumentation.is_enabled()))
+        except BaseException:
+            self._release()
+            raise
+        logger.info("'%i' workers started for '%i' tiles", self.workers, number_of_tiles)
+
+    def _share(self, name, array, specs):
+        """
+        Copies an array to a new block of shared memory
+        :param name: the name of the array
+        :param array: the array
+        :param specs: the description of the shared arrays for the workers, the new array is added
+        :return: the array in shared memory
+        """
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        specs[name] = (block.name, array.shape, array.dtype.str)
+        return shared
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+
+    def close(self, terminate=False):
+        """
+        Stops the workers and copies the arrays of the grid back to the memory of this process. The shared memory is
+        released even if stopping the workers fails.
+        :param terminate: if True the workers are stopped without finishing their tasks, e.g. after a worker raised
+        """
+        if self.pool is None and not self.blocks:
+            return
+        try:
+            if self.pool is not None:
+                if terminate:
+                    self.pool.terminate()
+                else:
+                    self.pool.close()
+                self.pool.join()
+        finally:
+            self.pool = None
+            self._release()
+
+    def _release(self):
+        """
+        Copies the arrays of the grid back to the memory of this process, then closes and unlinks every block of
+        shared memory
+        """
+        for name in Grid.ARRAYS:
+            setattr(self.grid, name, np.array(getattr(self.grid, name)))
+        self.new_heights = None
+        self.new_representatives = None
+        blocks, self.blocks = self.blocks, []
+        for block in blocks:
+            try:
+                block.close()
+            finally:
+                block.unlink()
+
+    def _map(self, phase, cell_ids, argument=None):
+        """
+        Runs one phase for the cells, every tile with cells is one task
+        :param phase: the name of the phase, see _run_tile
+        :param cell_ids: the ids of the cells
+        :param argument: an argument for the phase
+        :return: the sorted cell ids
+        """
+        cell_ids = np.sort(np.asarray(cell_ids, dtype=np.int64))
+        tiles = np.split(cell_ids, np.searchsorted(cell_ids, self.tile_bounds[1:-1]))
+        for counters in self.pool.map(_run_tile, [(phase, tile, argument) for tile in tiles if len(tile)]):
+            instrumentation.add_counters(counters)
+        return cell_ids
+
+    def calc_localerrors(self, cell_ids):
+        self._map('localerrors', cell_ids)
+
+    def set_mountains(self, cell_ids):
+        cell_ids = self._map('mountains', cell_ids)
+        self.grid.heights[cell_ids] = self.new_heights[cell_ids]
+
+    def calc_neighbourhoods(self, max_distance, cell_ids):
+        offsets = mf.calc_neighbourhood_offsets(int(max_distance / self.grid.cellwidth + 1e-9))
+        if not np.array_equal(offsets, self.grid.neighbourhood_offsets):
+            raise ValueError("The neighbourhoods in shared memory are allocated for another max_distance")
+        self._map('neighbourhoods', cell_ids, max_distance)
+
+    def manipulate_representatives(self, cell_ids):
+        cell_ids = self._map('representatives', cell_ids)
+        self.grid.representatives[cell_ids] = self.new_representatives[cell_ids]
+
+
+def _init_worker(rows, columns, dimension, specs, instrumented=False):
+    """
+    Opens the shared arrays in a worker process and creates the grid around them
+    :param rows: the number of rows
+    :param columns: the number of columns
+    :param dimension: number of dimensions in the original data
+    :param specs: the name of the shared memory block, the shape and the dtype of every array
+    :param instrumented: if True the counters of the tiles are recorded and sent back
+    """
+    global _worker_grid
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _worker_blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _worker_grid = Grid.from_arrays(rows, dimension, arrays, columns=columns)
+    if instrumented:
+        instrumentation.enable()
+    _worker_scratch['heights'] = arrays['new_heights']
+    _worker_scratch['representatives'] = arrays['new_representatives']
+
+
+def _run_tile(task):
+    """
+    Runs one phase for the cells of one tile in a worker process
+    :param task: the name of the phase, the ids of the cells and an argument for the phase
+    :return: the counters of the tile, see instrumentation.take_counters
+    """
+    phase, cell_ids, argument = task
+    grid = _worker_grid
+    if phase == 'localerrors':
+        grid.localerrors[cell_ids] = mf.calc_localerrors(grid, cell_ids)
+    elif phase == 'mountains':
+        _worker_scratch['heights'][cell_ids] = mf.calc_mountain_heights(grid, cell_ids)
+    elif phase == 'neighbourhoods':
+        grid.calc_neighbourhoods(argument, cell_ids=cell_ids)
+    elif phase == 'representatives':
+        _worker_scratch['representatives'][cell_ids] = mf.calc_manipulated_representatives(grid, cell_ids)
+    else:
+        raise ValueError("Unknown phase '%s'" % phase)
+    return instrumentation.take_counters()
@@ -1,16 +1,38 @@
 import logging.config
+import os
+import numpy as np
 import pandas as pd
-import math_functions as mf
 from objects.grid import Grid
-import draw_image as di
+import export
+import checkpoint
+import ingest
+import instrumentation
+import parallel
+import pyramid
+import render
+
+# detailed logger for logfile.txt
+logger = logging.getLogger('main')
+# minimal logger for logfile2.txt
+logger2 = logging.getLogger('main2')
 
 # The input file, a csv with index, without header. First two columns are x and y.
 INPUT_CSV: str = 'example/isolet_tsne.csv'
+# If set, the input is read in chunks of this many rows and converted once into a memory mapped matrix next to
+# the input (INPUT_CSV.cache), later runs read this matrix. If None, the input is read at once
+INGEST_CHUNKSIZE: int or None = None
+# The dtype of the memory mapped matrix of the original dimensions
+INGEST_DTYPE: str = 'float32'
 # The output file, a csv with index, without header, First three columns are x,y and z.
 OUTPUT_CSV: str = 'example/result.csv'
+# If set, the result is also written to this directory in a binary columnar format (see
+# export.write_result_columns), the topogram and the evaluation read it instead of OUTPUT_CSV
+OUTPUT_COLUMNS: str or None = None
+# If set, the output file is written in chunks of this many rows instead of one table
+EXPORT_CHUNKSIZE: int or None = None
 # Number of rows
 ROWS: int = 42
-# Number of rows
+# Number of iterations
 ITERATIONS: int = 10
 # Number of columns, if None, ROWS will be used instead
 COLUMNS: int or None = None
@@ -28,157 +50,282 @@ LEVELCOUNT: int = 7
 COLOR_MAP: str = 'gist_earth'
 # If True, the topogram takes the OUTPUT_CSV and the points instead of the centerpoints from the cells
 TAKE_POINTS_INSTEAD_OF_GRID: bool = False
+# The directory for the images, every figure has its own file
+IMAGES_DIR: str = 'images'
+# The format of the images, e.g. 'png', 'pdf' or 'svg'
+IMAGE_FORMAT: str = 'png'
+# Number of worker processes drawing the images at the same time, if None the number of cpus
+RENDER_WORKERS: int or None = None
 # The maximal distance for the initial neighbourhood. Will be multiplied with 1/rows
 MAX_DISTANCE: int = 5
 # The percentage indication when to cut the lists of highest error and highest icv. Will be multiplied with 1/100
 CUT_LIST_AT: int = 75
-
-
-def iteration(grid, list_to_manipulate):
+# Number of grids in the pyramid. The first grid has (ROWS-2)/2^(PYRAMID_LEVELS-1) inner rows and runs ITERATIONS
+# iterations, every next grid has twice as many rows and starts with the heights and representatives of the grid
+# before. The last grid has ROWS rows. 1 runs only the grid with ROWS rows, 3 was faster and ended with a lower
+# global error in the measurements in the README
+PYRAMID_LEVELS: int = 1
+# Number of iterations on every grid of the pyramid after the first one
+PYRAMID_ITERATIONS: int = 3
+# A height or representative changed if it moved more than this. Only the cells that depend on changed cells are
+# calculated in the next iteration
+CHANGE_TOLERANCE: float = 1e-6
+# The iterations stop if the global error changed less than this (relative to the global error before), e.g. 1e-4.
+# None disables this stop, then ITERATIONS iterations run unless no cell changed
+ERROR_TOLERANCE: float or None = None
+# The iterations stop if less than this number of points were shifted. None disables this stop
+SHIFT_TOLERANCE: int or None = None
+# If set, the state of the grid is saved in this directory every CHECKPOINT_EVERY iterations and after the last one
+CHECKPOINT_DIR: str or None = None
+# Number of iterations between two checkpoints
+CHECKPOINT_EVERY: int = 1
+# If True and CHECKPOINT_DIR contains a checkpoint, the run continues after the iteration of this checkpoint
+RESUME: bool = False
+# If set, the timers and counters of every iteration are appended to this file, one json object per line
+METRICS_FILE: str or None = None
+# Number of worker processes, the grid is split into tiles for them. If None, everything runs in this process
+WORKERS: int or None = None
+
+
+def iteration(grid, list_to_manipulate, executor=None):
+    """
+    One iteration of the approach: localerrors, mountains, neighbourhoods, shifts and the manipulation of the
+    representatives
+    :param grid: the grid to work on
+    :param list_to_manipulate: the cells to work on
+    :param executor: runs the phases on the cells, a parallel.TiledExecutor or by default a parallel.SerialExecutor
+    :return: the cells for the next iteration (every cell that depends on a cell changed in this iteration) and the
+    number of shifts
+    """
     logger.debug("new iteration started")
-
-    for cell in list_to_manipulate:
-        cell.localerror = cell.calc_localerror()
-        logger.debug("calculate localerror for '%i' with LE = '%f' ", cell.id, cell.localerror)
+    if executor is None:
+        executor = parallel.SerialExecutor(grid)
+
+    cell_ids = np.array([cell.id for cell in list_to_manipulate], dtype=np.int64)
+    active = np.zeros(len(grid.list_of_cells), dtype=bool)
+    active[cell_ids] = True
+    instrumentation.count('active_cells', len(cell_ids))
+    with instrumentation.phase('localerror'):
+        executor.calc_localerrors(cell_ids)
+    if logger.isEnabledFor(logging.DEBUG):
+        for cell in list_to_manipulate:
+            logger.debug("calculate localerror for '%i' with LE = '%f' ", cell.id, cell.localerror)
 
     logger.info("------------------Calculation of localerror finished")
     logger2.debug("------------------Calculation of localerror finished")
 
-    cell_with_high_errors = grid.sort_and_cut(percent=CUT_LIST_AT)
-    cell_with_ICVs = grid.sort_and_cut(percent=CUT_LIST_AT, searchparameter=lambda cell: cell.ICV)
-
-    for cell in cell_with_high_errors:
-        grid.set_mountains({cell.id: mf.calc_mountain_height(cell=cell, neutral_variance=grid.neutral_variance)})
-        logger.debug("calulate new height for '%i' = '%f', with LE = '%f'", cell.id, cell.height, cell.localerror)
+    # the cuts rank every cell, the localerrors and ICVs of the other cells did not change since they were
+    # calculated. A cell that enters a cut was not calculated in the last iteration, so it is calculated even if it
+    # did not change
+    with instrumentation.phase('sort_and_cut'):
+        high_error_ids = grid.cut_ids(grid.localerrors, percent=CUT_LIST_AT)
+        high_icv_ids = grid.cut_ids(grid.icvs, percent=CUT_LIST_AT)
+        error_entries = ~grid.in_error_cut[high_error_ids]
+        icv_entries = ~grid.in_icv_cut[high_icv_ids]
+        grid.in_error_cut[:] = False
+        grid.in_error_cut[high_error_ids] = True
+        grid.in_icv_cut[:] = False
+        grid.in_icv_cut[high_icv_ids] = True
+        high_error_ids = high_error_ids[active[high_error_ids] | error_entries]
+        high_icv_ids = high_icv_ids[active[high_icv_ids] | icv_entries]
+    instrumentation.count('cut_entries', int(error_entries.sum() + icv_entries.sum()))
+
+    # every new height is calculated with the heights before this step. The other cells did not change since their
+    # last height
+    with instrumentation.phase('mountains'):
+        old_heights = grid.heights[high_error_ids]
+        executor.set_mountains(high_error_ids)
+        changed_heights = high_error_ids[np.abs(grid.heights[high_error_ids] - old_heights) > CHANGE_TOLERANCE]
+    instrumentation.count('changed_heights', len(changed_heights))
+    if logger.isEnabledFor(logging.DEBUG):
+        for cell_id in high_error_ids.tolist():
+            logger.debug("calulate new height for '%i' = '%f', with LE = '%f'", cell_id, grid.heights[cell_id],
+                         grid.localerrors[cell_id])
 
     logger.info("------------------Mountains set")
     logger2.debug("------------------Mountains set")
 
-    for cell in list_to_manipulate:
-        cell.neighbourhood = grid.calc_neighbourhood(cell=cell, max_distance=MAX_DISTANCE*(1/ROWS))
-        logger.debug("NEIGHBOURHOOD calculation for cell '%i' finished '%s'", cell.id, cell.print_neighbourhood())
+    with instrumentation.phase('neighbourhood'):
+        executor.calc_neighbourhoods(MAX_DISTANCE*(1/grid.rows), cell_ids)
+    if logger.isEnabledFor(logging.DEBUG):
+        for cell in list_to_manipulate:
+            logger.debug("NEIGHBOURHOOD calculation for cell '%i' finished '%s'", cell.id, cell.print_neighbourhood())
 
     logger.info("------------------Neighbourhood calculation finished")
     logger2.debug("------------------Neighbourhood calculation finished")
 
+    # the shifts run in the order of the ICV, every shift changes the representatives for the next cells
     nos = 0
-    for cell in cell_with_ICVs:
-        nos += cell.shift_points()
+    touched = set()
+    with instrumentation.phase('shifts'):
+        for cell_id in high_icv_ids.tolist():
+            nos += grid.list_of_cells[cell_id].shift_points(touched)
+    instrumentation.count('shifts', nos)
 
     logger2.debug("Number of Shifts: '%d', Shifts done.", nos)
     logger.info("------------------Shifts done")
 
-    list_of_new_reps = []
-    for cell in list_to_manipulate:
-        list_of_new_reps.append(cell.manipulate_representative())
-    for pair in list_of_new_reps:
-        pair[0].representative = pair[1]
-        # logger.debug("manipulation of cell representative of '%i' with '%s' finished", pair[0].id, pair[1])
+    # every new representative is calculated before the first one is set
+    with instrumentation.phase('manipulation'):
+        old_representatives = grid.representatives[cell_ids]
+        executor.manipulate_representatives(cell_ids)
+        changes = np.abs(grid.representatives[cell_ids] - old_representatives)
+        changed_representatives = cell_ids[changes.max(axis=1, initial=0) > CHANGE_TOLERANCE]
+    instrumentation.count('changed_representatives', len(changed_representatives))
 
     logger.info("------------------Manipulation is finished")
     logger2.debug("------------------Manipulation is finished")
 
-    global_icv = 0
-    for cell in grid.list_of_cells:
-        global_icv += cell.ICV
+    global_icv = grid.icvs.sum()
     logger2.debug("Global ICV ist '%f'", global_icv)
 
-    numer_of_empty_cells = 0
-    for cell in grid.list_of_cells:
-        if not cell.list_of_points:
-            numer_of_empty_cells += 1
+    numer_of_empty_cells = (grid.point_counts == 0).sum()
+    instrumentation.count('empty_cells', int(numer_of_empty_cells))
 
     tmp = numer_of_empty_cells / len(grid.list_of_cells)
     logger2.debug("------------------ '%f' of cells are empty", tmp)
 
-    return grid.list_of_cells
+    changed = np.concatenate((changed_heights, changed_representatives, np.fromiter(touched, dtype=np.int64)))
+    next_ids = grid.expand_cells(changed)
+    logger2.debug("'%i' cells changed, '%i' cells for the next iteration", len(np.unique(changed)), len(next_ids))
+
+    return [grid.list_of_cells[cell_id] for cell_id in next_ids.tolist()], nos
+
+
+def run_iterations(grid, iterations, level=0, resume=None):
+    """
+    Runs the iterations on a grid, with WORKERS worker processes if set. Every iteration only works on the cells that
+    changed in the iteration before, the iterations stop early if ERROR_TOLERANCE or SHIFT_TOLERANCE are reached.
+    Every CHECKPOINT_EVERY iterations and after the last iteration a checkpoint is written to CHECKPOINT_DIR.
+    :param grid: the grid to work on
+    :param iterations: the number of iterations
+    :param level: the level of the grid in the pyramid
+    :param resume: the state of a checkpoint of this grid (see checkpoint.read_checkpoint), the iterations continue
+    after the iteration of the checkpoint. Nothing runs if the checkpoint stopped early or already has the number of
+    iterations, a checkpoint of a finished run continues if iterations is larger
+    """
+    first = 0
+    tmp_list = grid.list_of_cells
+    last_globalE = None
+    if resume is not None:
+        if resume.get('stopped') or resume['iteration'] >= iterations:
+            return
+        first = resume['iteration']
+        if resume['cell_ids'] is not None:
+            tmp_list = [grid.list_of_cells[cell_id] for cell_id in resume['cell_ids'].tolist()]
+        last_globalE = resume.get('last_globalE')
+
+    if WORKERS:
+        executor = parallel.TiledExecutor(grid, workers=WORKERS, max_distance=MAX_DISTANCE*(1/grid.rows))
+    else:
+        executor = parallel.SerialExecutor(grid)
+
+    with executor:
+        for i in range(first, iterations):
+            tmp_list, nos = iteration(grid, tmp_list, executor)
+            globalE = grid.localerrors.sum()
+
+            logger.info(
+                "---------------------------------------Iteration '%i' finished with '%f' "
+                "------------------------------------\n",
+                i + 1, globalE)
+            logger2.debug("Iteration '%i' finished with '%f' \n", i, globalE)
+
+            stopped = True
+            if not tmp_list:
+                logger2.debug("Stopped after iteration '%i', no cell changed", i)
+            elif SHIFT_TOLERANCE is not None and nos < SHIFT_TOLERANCE:
+                logger2.debug("Stopped after iteration '%i', only '%d' shifts", i, nos)
+            elif ERROR_TOLERANCE is not None and last_globalE is not None and \
+                    abs(globalE - last_globalE) <= ERROR_TOLERANCE * abs(last_globalE):
+                logger2.debug("Stopped after iteration '%i', the global error changed less than '%f'", i,
+                              ERROR_TOLERANCE)
+            else:
+                stopped = False
+            last_globalE = float(globalE)
+            instrumentation.emit(level=level, iteration=i + 1, global_error=last_globalE, stopped=stopped)
+
+            if CHECKPOINT_DIR and (stopped or i + 1 == iterations or (i + 1) % CHECKPOINT_EVERY == 0):
+                checkpoint.write_checkpoint(grid, CHECKPOINT_DIR, i + 1, cell_ids=[cell.id for cell in tmp_list],
+                                            info={'level': level, 'last_globalE': last_globalE,
+                                                  'stopped': stopped})
+            if stopped:
+                break
 
 
 if __name__ == '__main__':
 
-    # detailed logger for logfile.txt
-    logger = logging.getLogger('main')
-    # minimal logger for logfile2.txt
-    logger2 = logging.getLogger('main2')
     logging.config.fileConfig(fname='logger_config.ini', disable_existing_loggers=False)
-
-    input_dataset = pd.read_csv(INPUT_CSV, index_col=0, header=None)
-    dimensions = input_dataset.shape[1] - 2
-
-    # generate grid
-    grid = Grid.autogenerated(rows=ROWS, columns=COLUMNS, dimension=dimensions, start_x=STARTX, start_y=STARTY)
-
-    # init points
-    grid.init_points_to_right_cell(input_dataset)
-    di.draw_scatterplot(grid.get_all_points())
-
-    # init representative
-    for cell in grid.list_of_cells:
-        cell.calc_representative()
-    for cell in grid.list_of_cells:
-        cell.calc_representative(cells_with_points=False, empty_cells=True)
-
-    logger.info("------------------Representative calculation finished")
+    if METRICS_FILE:
+        instrumentation.enable(METRICS_FILE)
+
+    levels = pyramid.calc_levels(ROWS, COLUMNS, PYRAMID_LEVELS)
+    resume = None
+    input_points = None
+    if RESUME and checkpoint.has_checkpoint(CHECKPOINT_DIR):
+        grid, resume = checkpoint.read_checkpoint(CHECKPOINT_DIR)
+    else:
+        if INGEST_CHUNKSIZE:
+            dimensions = ingest.read_dimension(INPUT_CSV, dtype=INGEST_DTYPE)
+        else:
+            input_dataset = pd.read_csv(INPUT_CSV, index_col=0, header=None)
+            dimensions = input_dataset.shape[1] - 2
+
+        # generate grid, the first grid of the pyramid
+        grid = Grid.autogenerated(rows=levels[0][0], columns=levels[0][1], dimension=dimensions, start_x=STARTX,
+                                  start_y=STARTY)
+
+        # init points
+        if INGEST_CHUNKSIZE:
+            ingest.ingest(grid, INPUT_CSV, dtype=INGEST_DTYPE, chunksize=INGEST_CHUNKSIZE)
+        else:
+            grid.init_points_to_right_cell(input_dataset)
+        # the points before the first iteration, they are drawn with the other figures at the end
+        input_points = render.GridSnapshot(grid).points
+
+        # init representative
+        for cell in grid.list_of_cells:
+            cell.calc_representative()
+        for cell in grid.list_of_cells:
+            cell.calc_representative(cells_with_points=False, empty_cells=True)
+
+        logger.info("------------------Representative calculation finished")
     logger.info("NEUTRAL VARIANCE is calculated: '%f' ", grid.neutral_variance)
     logger2.debug("NEUTRAL VARIANCE is calculated: '%f' ", grid.neutral_variance)
 
-    tmp_list = grid.list_of_cells
-    for i in range(ITERATIONS):
-        tmp_list = iteration(grid, tmp_list)
-        globalE = 0
-        for neuron in grid.list_of_cells:
-            globalE += neuron.localerror
-
-        logger.info(
-            "---------------------------------------Iteration '%i' finished with '%f' "
-            "------------------------------------\n",
-            i + 1, globalE)
-        logger2.debug("Iteration '%i' finished with '%f' \n", i, globalE)
-
-    # sort the points in the original order (like the original dataset)
-    points = []
-    c = 0
-    index = []
-    for point in grid.get_all_points():
-        df = (input_dataset.loc[input_dataset[1] == point.x_org])
-        index.append(df.index.tolist())
-        points.append([point.x_axis + c, point.y_axis + c, grid.get_cell(point=point).height])
-
-    import itertools
-
-    merged = list(itertools.chain(*index))
-    mergeIn = [0 for i in merged]
-    mergeIn.append(0)
-    mergeIn.append(0)
-
-    for num in range(0, len(merged)):
-        mergeIn[merged[num] - 1] = num
-
-    input_dataset = input_dataset.reindex(merged)
-    input_dataset = input_dataset.reset_index(drop=True)
-
-    tmp = pd.DataFrame(points, columns=['dred1', 'dred2', 'heights'])
-    tmp2 = input_dataset.drop(columns=1, axis=1)
-    tmp2 = tmp2.drop(columns=2, axis=1)
-
-    # generates the output csv
-    new_csv = pd.concat([tmp, tmp2], axis=1)
-    new_csv = new_csv.reindex(mergeIn)
-    new_csv = new_csv.reset_index(drop=True)
-    pd.DataFrame.to_csv(new_csv, OUTPUT_CSV, index=int, header=None)
+    first_level = resume['level'] if resume else 0
+    for level in range(first_level, len(levels)):
+        if level > first_level:
+            grid = pyramid.upsample(grid, *levels[level])
+        run_iterations(grid, PYRAMID_ITERATIONS if level else ITERATIONS, level=level,
+                       resume=resume if level == first_level else None)
+
+    # generates the output csv in the original order of the points
+    with instrumentation.phase('export'):
+        export.write_result_csv(grid, OUTPUT_CSV, chunksize=EXPORT_CHUNKSIZE)
+        if OUTPUT_COLUMNS:
+            export.write_result_columns(grid, OUTPUT_COLUMNS, chunksize=EXPORT_CHUNKSIZE)
+    instrumentation.emit(stage='export')
 
     # Evaluate
-    # eval.floydWarshall(grid)
+    # eval.calc_grid_distances(grid, only_occupied=True)
 
     # Visualize
-    di.draw_scatterplot(grid.get_all_points())
-    di.draw_heatmap(grid, cm=COLOR_MAP)
-    di.draw_heatmap(grid, heights=True, gaussian=True, cm=COLOR_MAP)
-    di.draw_heatmap(grid, heights=True, gaussian=False, cm=COLOR_MAP)
-
-    di.draw_topogram(grid, drawcenters=DRAW_CENTERS, drawpoints=grid.get_all_points() if DRAW_POINTS else None,
-                     levelcount=LEVELCOUNT, colormap=COLOR_MAP)
-
-    di.draw_topogram(grid, inputfile=OUTPUT_CSV if TAKE_POINTS_INSTEAD_OF_GRID else None, drawcenters=DRAW_CENTERS,
-                     drawpoints=grid.get_all_points() if DRAW_POINTS else None,
-                     levelcount=LEVELCOUNT, colormap=COLOR_MAP)
+    def image(name):
+        return os.path.join(IMAGES_DIR, '%s.%s' % (name, IMAGE_FORMAT))
+
+    topogram = {'drawcenters': DRAW_CENTERS, 'drawpoints': DRAW_POINTS, 'levelcount': LEVELCOUNT,
+                'colormap': COLOR_MAP}
+    figures = [('scatterplot', image('scatterplot'), {}),
+               ('heatmap', image('localheatmap'), {'cm': COLOR_MAP}),
+               ('heatmap', image('heightmap_gaussian'), {'heights': True, 'gaussian': True, 'cm': COLOR_MAP}),
+               ('heatmap', image('heightmap'), {'heights': True, 'gaussian': False, 'cm': COLOR_MAP}),
+               ('topogram', image('topogram'), topogram)]
+    if input_points is not None:
+        figures.insert(0, ('scatterplot', image('scatterplot_input'), {'points': input_points}))
+    if TAKE_POINTS_INSTEAD_OF_GRID:
+        figures.append(('topogram', image('topogram_points'), dict(topogram, inputfile=OUTPUT_COLUMNS or OUTPUT_CSV)))
+
+    with instrumentation.phase('render'):
+        rendered = render.render(render.GridSnapshot(grid), figures, workers=RENDER_WORKERS)
+    instrumentation.emit(stage='render', figures=rendered.to_dict('records'))
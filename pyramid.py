@@ -0,0 +1,90 @@
+import logging
+import numpy as np
+import math_functions as mf
+from objects.grid import Grid
+
+logger = logging.getLogger('main')
+
+# Number of times the heights of all cells are fitted to the heights of their neighbours after the interpolation
+HEIGHT_PASSES: int = 3
+
+
+def calc_levels(rows, columns=None, levels=1):
+    """
+    Calculates the size of every level of the pyramid. Every level has half of the inner cells (without the border
+    cells) of the next finer level, the last level has the given size.
+    :param rows: the number of rows of the finest level
+    :param columns: the number of columns of the finest level, if None rows is used
+    :param levels: the number of levels
+    :return: a list with (rows, columns) for every level, starting with the coarsest
+    """
+    if columns is None:
+        columns = rows
+    sizes = []
+    for level in reversed(range(levels)):
+        sizes.append((max((rows - 2) >> level, 1) + 2, max((columns - 2) >> level, 1) + 2))
+    return sizes
+
+
+def upsample(coarse, rows, columns=None, height_passes=HEIGHT_PASSES):
+    """
+    This method creates a finer grid from a coarse grid. The heights and representatives are interpolated
+    bilinear at the centers of the new cells. The points of the coarse grid are moved to the new grid with their
+    current coordinates, their cell of origin is the cell of their original coordinates in the new grid. The
+    representatives stay interpolated, the means of the points of a new cell are much further apart than the
+    smoothed representatives of the coarse grid. Only cells with points and without interpolated representative get
+    the mean of their points. The ICVs are calculated from the points. The border cells of the coarse grid are wider,
+    points shifted into them are moved onto the border of the new grid.
+    At last the heights of all cells are fitted to the representatives of the new grid with calc_mountain_heights.
+    The interpolated heights are only the start of this fit, the distances between the new neighbours are shorter.
+    :param coarse: the coarse grid
+    :param rows: the number of rows of the new grid
+    :param columns: the number of columns of the new grid
+    :param height_passes: the number of times the heights of all cells are fitted at the same time
+    :return: the new grid
+    """
+    fine = Grid.autogenerated(rows=rows, columns=columns, dimension=coarse.dimension)
+
+    # the fractional position of the centers of the new cells in the lattice of the coarse grid, the first row of
+    # both lattices is the upper one
+    x = (fine.posx - coarse.posx.min()) / coarse.cellwidth + (fine.cellwidth / coarse.cellwidth - 1) / 2
+    y = (coarse.posy.max() - fine.posy) / coarse.cellwidth - (fine.cellwidth / coarse.cellwidth - 1) / 2
+
+    fine.heights[:] = mf.calc_bilinear(coarse.heights.reshape(coarse.columns, coarse.rows), y, x)
+
+    # cells without representative do not count for the interpolation
+    weights = coarse.has_representative.astype(float)
+    weight = mf.calc_bilinear(weights.reshape(coarse.columns, coarse.rows), y, x)
+    representatives = mf.calc_bilinear((coarse.representatives * weights[:, None]).reshape(
+        coarse.columns, coarse.rows, coarse.dimension), y, x)
+    fine.has_representative[:] = weight > 0
+    fine.representatives[fine.has_representative] = (representatives[fine.has_representative] /
+                                                     weight[fine.has_representative][:, None])
+
+    store = coarse.points
+    if store is not None:
+        store.cell_ids[:] = -1
+        start_x = fine.posx.min()
+        start_y = fine.posy.min()
+        np.clip(store.x_axis, start_x, start_x + fine.rows * fine.cellwidth, out=store.x_axis)
+        np.clip(store.y_axis, start_y, start_y + fine.columns * fine.cellwidth, out=store.y_axis)
+        store.grid = fine
+        fine.points = store
+        fine.assign_points()
+        store.org_ids[:] = fine.bin_points(store.x_org, store.y_org)
+        coarse.points = None
+
+        for cell_id in np.flatnonzero(fine.point_counts).tolist():
+            cell = fine.list_of_cells[cell_id]
+            if fine.has_representative[cell_id]:
+                cell.ICV = cell.calc_ICV()[0]
+            else:
+                cell.calc_representative()
+
+    cell_ids = np.arange(len(fine.heights))
+    for _ in range(height_passes):
+        fine.heights[:] = mf.calc_mountain_heights(fine, cell_ids)
+
+    logger.info("Grid with '%i' x '%i' cells upsampled to '%i' x '%i' cells", coarse.rows, coarse.columns,
+                fine.rows, fine.columns)
+    return fine
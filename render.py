@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import draw_image as di
+
+logger = logging.getLogger('main')
+
+# the snapshot of a worker process
+_worker_snapshot = None
+
+
+class GridSnapshot:
+    """
+    This class holds copies of the arrays of a grid the figures are drawn from. It has the attributes of a grid
+    that draw_image.draw_heatmap and draw_image.draw_topogram read, but no cells, neighbourhoods or original
+    dimensions, so it is cheap to send to worker processes.
+    """
+
+    def __init__(self, grid):
+        """
+        :param grid: the grid, later changes of the grid do not change the snapshot
+        """
+        self.rows = grid.rows
+        self.columns = grid.columns
+        self.posx = np.array(grid.posx)
+        self.posy = np.array(grid.posy)
+        self.heights = np.array(grid.heights)
+        self.localerrors = np.array(grid.localerrors)
+        self.point_counts = np.array(grid.point_counts)
+        # the x and y coordinates of every point with a cell
+        self.points = np.zeros((0, 2))
+        if grid.points is not None:
+            store = grid.points
+            indices = np.flatnonzero(store.cell_ids >= 0)
+            self.points = np.stack([store.x_axis[indices], store.y_axis[indices]], axis=1)
+
+
+def _init_worker(snapshot, backend):
+    """
+    Saves the snapshot in a worker process and switches to a backend without windows
+    :param snapshot: the GridSnapshot
+    :param backend: the matplotlib backend
+    """
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+    plt.switch_backend(backend)
+
+
+def _render_figure(task):
+    """
+    Draws one figure of the snapshot in a worker process
+    :param task: the kind of the figure ('scatterplot', 'heatmap' or 'topogram'), the path of the image and the
+    arguments of the drawing function. A topogram with drawpoints=True shows the points of the snapshot, a
+    scatterplot shows the given points or the points of the snapshot
+    :return: the path, the wall time in seconds and the error if the figure failed
+    """
+    kind, filename, options = task
+    snapshot = _worker_snapshot
+    options = dict(options)
+    start = time.perf_counter()
+    error = None
+    try:
+        if kind == 'scatterplot':
+            di.draw_scatterplot(options.pop('points', snapshot.points), filename=filename, **options)
+        elif kind == 'heatmap':
+            di.draw_heatmap(snapshot, filename=filename, **options)
+        elif kind == 'topogram':
+            drawpoints = snapshot.points if options.pop('drawpoints', False) else None
+            di.draw_topogram(snapshot, drawpoints=drawpoints, filename=filename, **options)
+        else:
+            raise ValueError("Unknown figure '%s'" % kind)
+    except Exception as exception:
+        error = repr(exception)
+    finally:
+        plt.close('all')
+    return filename, time.perf_counter() - start, error
+
+
+def render(snapshot, figures, workers=None, backend='Agg'):
+    """
+    This method draws figures of a grid at the same time in worker processes. Every worker draws on a backend
+    without windows, so nothing blocks, and closes every figure after it is saved.
+    :param snapshot: the GridSnapshot to draw
+    :param figures: a list of figures, every figure is a tuple of the kind ('scatterplot', 'heatmap' or
+    'topogram'), the path of the image (the format is given by the extension) and a dictionary with the arguments
+    of the drawing function
+    :param workers: the number of worker processes, the default is the number of cpus
+    :param backend: the matplotlib backend of the workers
+    :return: a table with the path, the kind, the wall time and the error (None if drawn) of every figure
+    """
+    for _, filename, _ in figures:
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    workers = min(workers or os.cpu_count(), max(len(figures), 1))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot, backend)) as pool:
+        results = list(pool.map(_render_figure, figures))
+
+    rows = []
+    for (kind, _, _), (filename, seconds, error) in zip(figures, results):
+        if error:
+            logger.warning("Figure '%s' failed: '%s'", filename, error)
+        else:
+            logger.info("Figure '%s' drawn in '%f' seconds", filename, seconds)
+        rows.append({'figure': filename, 'kind': kind, 'seconds': seconds, 'error': error})
+    return pd.DataFrame(rows, columns=['figure', 'kind', 'seconds', 'error'])
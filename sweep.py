@@ -0,0 +1,146 @@
+import itertools
+import logging.config
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.pyplot as plt
+import pandas as pd
+from objects.grid import Grid
+import draw_image as di
+import export
+import process
+
+logger = logging.getLogger('main')
+
+# The input file, a csv with index, without header. First two columns are x and y.
+INPUT_CSV: str = process.INPUT_CSV
+# The directory for the results of every configuration
+OUTPUT_DIR: str = 'example/sweep'
+# The table with one row for every configuration
+RESULTS_CSV: str = 'example/sweep/results.csv'
+# The values to test, every combination is one configuration. The names are constants of process.py
+PARAMETERS: dict = {'ROWS': [32, 42],
+                    'MAX_DISTANCE': [3, 5],
+                    'CUT_LIST_AT': [50, 75],
+                    'ITERATIONS': [10],
+                    'LEVELCOUNT': [7]}
+# Number of configurations running at the same time, if None the number of cpus
+SWEEP_WORKERS: int or None = None
+# If True, a topogram is drawn for every configuration
+DRAW_TOPOGRAMS: bool = True
+
+# the initial grids of the worker process, by the number of rows
+_base_grids = {}
+
+
+def calc_configurations(parameters):
+    """
+    Calculates every combination of the parameters
+    :param parameters: a dictionary with a list of values for every constant of process.py
+    :return: a list of dictionaries, one for every combination
+    """
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+
+def build_grid(input_dataset, rows):
+    """
+    This method does all the work that only depends on the input and the number of rows: it generates the grid,
+    adds the points to their cells and calculates the representatives and the neutral variance.
+    :param input_dataset: the input as Dataframe
+    :param rows: the number of rows
+    :return: the grid
+    """
+    grid = Grid.autogenerated(rows=rows, dimension=input_dataset.shape[1] - 2)
+    grid.init_points_to_right_cell(input_dataset)
+    for cell in grid.list_of_cells:
+        cell.calc_representative()
+    for cell in grid.list_of_cells:
+        cell.calc_representative(cells_with_points=False, empty_cells=True)
+    return grid
+
+
+def _init_worker(base_grids):
+    """
+    Saves the initial grids in a worker process
+    :param base_grids: the initial grids by the number of rows
+    """
+    _base_grids.update(base_grids)
+    # the configurations already run in parallel and must not write to the same checkpoint
+    process.WORKERS = None
+    process.CHECKPOINT_DIR = None
+
+
+def _run_configuration(task):
+    """
+    Runs one configuration on a copy of the initial grid with the same number of rows
+    :param task: the number of the configuration, the configuration, the output directory and if a topogram is drawn
+    :return: a dictionary with the configuration, the global error, the timings and the output paths
+    """
+    number, configuration, output_dir, draw = task
+    for name, value in configuration.items():
+        setattr(process, name, value)
+
+    start = time.perf_counter()
+    grid = _base_grids[process.ROWS].copy()
+    copied = time.perf_counter()
+    process.run_iterations(grid, process.ITERATIONS)
+    finished = time.perf_counter()
+
+    output_csv = os.path.join(output_dir, 'result_%i.csv' % number)
+    export.write_result_csv(grid, output_csv)
+    topogram = None
+    if draw:
+        topogram = os.path.join(output_dir, 'topogram_%i.png' % number)
+        di.draw_topogram(grid, levelcount=process.LEVELCOUNT, colormap=process.COLOR_MAP, filename=topogram)
+        plt.close('all')
+
+    return dict(configuration, configuration=number, global_error=float(grid.localerrors.sum()),
+                copy_seconds=copied - start, run_seconds=finished - copied,
+                output_seconds=time.perf_counter() - finished, output_csv=output_csv, topogram=topogram)
+
+
+def run_sweep(input_csv, parameters, output_dir, results_csv=None, workers=None, draw=True):
+    """
+    This method runs every combination of the parameters. The input is read once and the initial grid is build
+    once for every number of rows, every configuration starts with a copy of this grid. The configurations run in
+    worker processes at the same time.
+    :param input_csv: the input file, like process.INPUT_CSV
+    :param parameters: a dictionary with a list of values for every constant of process.py
+    :param output_dir: the directory for the result csv and topogram of every configuration
+    :param results_csv: if given, the table of the results is saved there
+    :param workers: the number of worker processes, the default is the number of cpus
+    :param draw: if True a topogram is drawn for every configuration
+    :return: the table of the results, one row for every configuration
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    configurations = calc_configurations(parameters)
+
+    input_dataset = pd.read_csv(input_csv, index_col=0, header=None)
+    base_grids = {}
+    setup_seconds = {}
+    for rows in sorted({configuration.get('ROWS', process.ROWS) for configuration in configurations}):
+        start = time.perf_counter()
+        base_grids[rows] = build_grid(input_dataset, rows)
+        setup_seconds[rows] = time.perf_counter() - start
+        logger.info("Initial grid with '%i' rows build in '%f' seconds", rows, setup_seconds[rows])
+
+    tasks = [(number, dict(configuration, ROWS=configuration.get('ROWS', process.ROWS)), output_dir, draw)
+             for number, configuration in enumerate(configurations)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(base_grids,)) as pool:
+        results = list(pool.map(_run_configuration, tasks))
+
+    for result in results:
+        result['setup_seconds'] = setup_seconds[result['ROWS']]
+    table = pd.DataFrame(results).set_index('configuration')
+    if results_csv:
+        table.to_csv(results_csv)
+    return table
+
+
+if __name__ == '__main__':
+
+    logging.config.fileConfig(fname='logger_config.ini', disable_existing_loggers=False)
+
+    print(run_sweep(INPUT_CSV, PARAMETERS, OUTPUT_DIR, results_csv=RESULTS_CSV, workers=SWEEP_WORKERS,
+                    draw=DRAW_TOPOGRAMS))
@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# the modules of the repository are imported from its root, like the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from objects.grid import Grid  # noqa: E402
+
+
+def build_grid(rows=22, number_of_points=600, dimension=5, seed=0, coordinates=None, index=None):
+    """
+    Builds a grid with the points of three gaussian clusters, like process.py
+    :param coordinates: the x and y coordinates of the points, random if None
+    :param index: the index of the points in the input, 1 to number_of_points if None
+    """
+    random = np.random.RandomState(seed)
+    centers = random.uniform(0, 4, (3, dimension))
+    data = centers[random.randint(0, 3, number_of_points)] + random.normal(0, 0.5, (number_of_points, dimension))
+    if coordinates is None:
+        coordinates = random.uniform(0.01, 0.99, (number_of_points, 2))
+    if index is None:
+        index = np.arange(1, number_of_points + 1)
+    grid = Grid.autogenerated(rows=rows, dimension=dimension)
+    grid.init_points_to_right_cell(pd.DataFrame(np.concatenate((coordinates, data), axis=1), index=index))
+    for cell in grid.list_of_cells:
+        cell.calc_representative()
+    for cell in grid.list_of_cells:
+        cell.calc_representative(cells_with_points=False, empty_cells=True)
+    return grid
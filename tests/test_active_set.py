@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import math_functions as mf
+import process
+from conftest import build_grid
+
+
+@pytest.fixture
+def exact(monkeypatch):
+    # every change counts, so the active set must give exactly the result of recomputing every cell
+    monkeypatch.setattr(process, 'CHANGE_TOLERANCE', 0)
+
+
+def test_active_set_equals_full_recompute_while_the_cut_changes(exact):
+    active_grid = build_grid()
+    full_grid = build_grid()
+    cells = active_grid.list_of_cells
+    cut_changed = False
+    for _ in range(6):
+        previous_cut = active_grid.in_error_cut.copy()
+        cells, _ = process.iteration(active_grid, cells)
+        process.iteration(full_grid, full_grid.list_of_cells)
+        cut_changed |= previous_cut.any() and not np.array_equal(previous_cut, active_grid.in_error_cut)
+
+        for name in ('heights', 'localerrors', 'icvs', 'representatives'):
+            np.testing.assert_array_equal(getattr(active_grid, name), getattr(full_grid, name), err_msg=name)
+        np.testing.assert_array_equal(active_grid.points.x_axis, full_grid.points.x_axis)
+        np.testing.assert_array_equal(active_grid.points.y_axis, full_grid.points.y_axis)
+    assert cut_changed
+
+
+def test_cells_entering_the_cut_are_calculated_without_change(exact, monkeypatch):
+    grid = build_grid()
+    process.iteration(grid, grid.list_of_cells)
+    entering = np.flatnonzero(~grid.in_error_cut)
+    old_heights = grid.heights[entering].copy()
+    expected = mf.calc_mountain_heights(grid, entering)
+    assert not np.allclose(expected, old_heights)
+
+    # no cell changed, but every cell is in the cut now
+    monkeypatch.setattr(process, 'CUT_LIST_AT', 100)
+    process.iteration(grid, [])
+    np.testing.assert_array_equal(grid.heights[entering], expected)
+    assert grid.in_error_cut.all()
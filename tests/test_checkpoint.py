@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import checkpoint
+import process
+from conftest import build_grid
+from objects.grid import Grid
+
+
+class Killed(Exception):
+    pass
+
+
+@pytest.fixture
+def checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(process, 'CHECKPOINT_DIR', str(tmp_path))
+    monkeypatch.setattr(process, 'CHECKPOINT_EVERY', 2)
+    monkeypatch.setattr(process, 'ERROR_TOLERANCE', None)
+    monkeypatch.setattr(process, 'WORKERS', None)
+    return str(tmp_path)
+
+
+def assert_same_state(grid, expected):
+    for name in Grid.ARRAYS:
+        np.testing.assert_array_equal(getattr(grid, name), getattr(expected, name), err_msg=name)
+    for name in ('x_axis', 'y_axis', 'cell_ids', 'org_ids'):
+        np.testing.assert_array_equal(getattr(grid.points, name), getattr(expected.points, name), err_msg=name)
+
+
+def uninterrupted(iterations, monkeypatch):
+    grid = build_grid()
+    with monkeypatch.context() as patch:
+        patch.setattr(process, 'CHECKPOINT_DIR', None)
+        process.run_iterations(grid, iterations)
+    return grid
+
+
+def test_killed_run_resumes_to_the_uninterrupted_result(checkpoints, monkeypatch):
+    expected = uninterrupted(6, monkeypatch)
+
+    # the run is killed in the fourth iteration, the last checkpoint is after the second one
+    calls = []
+    iteration = process.iteration
+
+    def killed_in_fourth(*arguments):
+        calls.append(None)
+        if len(calls) == 4:
+            raise Killed
+        return iteration(*arguments)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(process, 'iteration', killed_in_fourth)
+        with pytest.raises(Killed):
+            process.run_iterations(build_grid(), 6)
+
+    grid, resume = checkpoint.read_checkpoint(checkpoints)
+    assert resume['iteration'] == 2 and not resume['stopped']
+    process.run_iterations(grid, 6, resume=resume)
+    assert_same_state(grid, expected)
+
+
+def test_finished_run_continues_with_more_iterations(checkpoints, monkeypatch):
+    expected = uninterrupted(6, monkeypatch)
+
+    process.run_iterations(build_grid(), 4)
+    grid, resume = checkpoint.read_checkpoint(checkpoints)
+    assert resume['iteration'] == 4 and not resume['stopped']
+
+    # the same number of iterations again does nothing
+    heights = np.array(grid.heights)
+    process.run_iterations(grid, 4, resume=resume)
+    np.testing.assert_array_equal(grid.heights, heights)
+
+    process.run_iterations(grid, 6, resume=resume)
+    assert_same_state(grid, expected)
+    assert checkpoint.read_checkpoint(checkpoints)[1]['iteration'] == 6
@@ -0,0 +1,27 @@
+import os
+import numpy as np
+import dim_red
+
+
+def cache_size(cache_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(cache_dir))
+
+
+def test_cache_never_exceeds_max_bytes(tmp_path):
+    cache_dir = str(tmp_path)
+    reduction = np.zeros((100, 2))
+    file_size = 128 + reduction.nbytes
+    max_bytes = 2 * file_size
+
+    for key in ('a', 'b', 'c'):
+        dim_red.write_cache(cache_dir, key, reduction, max_bytes)
+        assert cache_size(cache_dir) <= max_bytes
+    # the least recently used reduction is removed, the new one is kept
+    assert sorted(os.listdir(cache_dir)) == ['b.npy', 'c.npy']
+    np.testing.assert_array_equal(np.load(os.path.join(cache_dir, 'c.npy')), reduction)
+
+    # larger than the cache: nothing is saved and nothing is removed
+    dim_red.write_cache(cache_dir, 'd', np.zeros((1000, 2)), max_bytes)
+    # only the header is too large
+    dim_red.write_cache(cache_dir, 'e', np.zeros(max_bytes // 8), max_bytes)
+    assert sorted(os.listdir(cache_dir)) == ['b.npy', 'c.npy']
@@ -0,0 +1,110 @@
+import gc
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import eval
+import export
+import process
+from conftest import build_grid
+
+
+def test_temporary_memmap_of_the_grid_distances_is_removed():
+    grid = build_grid(rows=12, number_of_points=100)
+    distances = eval.calc_grid_distances(grid, memmap_threshold=0)
+    path = distances.values.filename
+    assert os.path.exists(path)
+    row = distances[5]
+    expected = eval.calc_grid_distances(grid)
+    np.testing.assert_array_equal(row, expected[5])
+
+    # a row of the distances keeps the file
+    del distances
+    gc.collect()
+    assert os.path.exists(path)
+    del row
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_given_memmap_path_is_kept(tmp_path):
+    grid = build_grid(rows=12, number_of_points=100)
+    path = str(tmp_path / 'distances.npy')
+    distances = eval.calc_grid_distances(grid, memmap_path=path)
+    del distances
+    gc.collect()
+    np.testing.assert_array_equal(np.load(path), eval.calc_grid_distances(grid).values)
+
+
+@pytest.fixture
+def evaluation(tmp_path):
+    """
+    A grid after two iterations, the input csv, the binary result and the distances between the occupied cells
+    """
+    grid = build_grid(rows=12, number_of_points=150)
+    cells = grid.list_of_cells
+    for _ in range(2):
+        cells, _ = process.iteration(grid, cells)
+
+    store = grid.points
+    before = str(tmp_path / 'input.csv')
+    pd.DataFrame(np.column_stack((store.x_org, store.y_org, store.data)), index=store.row_index).to_csv(
+        before, header=False)
+    after = str(tmp_path / 'result')
+    export.write_result_columns(grid, after)
+    return grid, before, after, eval.calc_grid_distances(grid, only_occupied=True)
+
+
+def dense_distances(grid, distances, before, after):
+    """
+    Every distance between two points like the loops of the first versions of disttodist and
+    calc_neighborhood_preservation: squared in the original space, euclidean after the dimensional reduction and on
+    the grid between the cells of the points
+    """
+    x_axis, y_axis, data = eval.load_points(before)
+    dist_in_org = ((data[:, None, :] - data[None, :, :]) ** 2).sum(axis=2)
+    dist_after_dim_red = np.sqrt((x_axis[:, None] - x_axis[None, :]) ** 2 + (y_axis[:, None] - y_axis[None, :]) ** 2)
+    x_axis, y_axis, _ = eval.load_points(after)
+    cell_ids = grid.bin_points(x_axis, y_axis)
+    dist_after_tdv = np.array([[distances[i][j] for j in cell_ids] for i in cell_ids], dtype=float)
+    return dist_in_org, dist_after_dim_red, dist_after_tdv
+
+
+def test_disttodist_equals_the_dense_formula(evaluation):
+    grid, before, after, distances = evaluation
+    dist_in_org, dist_after_dim_red, dist_after_tdv = dense_distances(grid, distances, before, after)
+    difference1 = np.abs(dist_in_org / dist_in_org.max() - dist_after_dim_red / dist_after_dim_red.max())
+    difference2 = np.abs(dist_in_org / dist_in_org.max() - dist_after_tdv / dist_after_tdv.max())
+
+    bins = 1024
+    result = eval.disttodist(distances, grid, before, after, block_size=32, bins=bins)
+    for name, difference in (('dimred', difference1), ('tdv', difference2)):
+        assert result[name]['mean'] == pytest.approx(difference.mean(), rel=1e-5)
+        assert result[name]['max'] == pytest.approx(difference.max(), rel=1e-5)
+        # the quantiles are the upper edges of the bins of the histogram
+        for q, value in result[name]['quantiles'].items():
+            assert np.quantile(difference, q) <= value + 1e-5
+            assert value - 1 / bins <= np.quantile(difference, q) + 1e-5
+
+
+def test_neighborhood_preservation_equals_the_dense_formula(evaluation):
+    grid, before, after, distances = evaluation
+    radius = 0.1
+    dist_in_org, dist_after_dim_red, dist_after_tdv = dense_distances(grid, distances, before, after)
+    neighbourhood_in_o = dist_in_org / dist_in_org.max() < radius
+    neighbourhood_in_r = dist_after_dim_red / dist_after_dim_red.max() < radius
+    neighbourhood_in_tdv = dist_after_tdv / dist_after_tdv.max() < radius
+
+    size_o = neighbourhood_in_o.sum(axis=1)
+    size_r = neighbourhood_in_r.sum(axis=1)
+    size_tdv = neighbourhood_in_tdv.sum(axis=1)
+    expected = {'precision_r': ((neighbourhood_in_o & neighbourhood_in_r).sum(axis=1) / size_r).mean(),
+                'precision_t': ((neighbourhood_in_o & neighbourhood_in_tdv).sum(axis=1) / size_tdv).mean(),
+                'recall_r': ((neighbourhood_in_o & neighbourhood_in_r).sum(axis=1) / size_o).mean(),
+                'recall_t': ((neighbourhood_in_o & neighbourhood_in_tdv).sum(axis=1) / size_o).mean(),
+                'size_r': size_r.mean(), 'size_t': size_tdv.mean(), 'size_o': size_o.mean()}
+    assert 1 < expected['size_o'] < len(dist_in_org) and 1 < expected['size_t'] < len(dist_in_org)
+
+    result = eval.calc_neighborhood_preservation(distances, grid, before, after, radius=radius, chunk_size=32)
+    for name, value in expected.items():
+        assert result[name] == pytest.approx(value, rel=1e-12), name
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import export
+import process
+from conftest import build_grid
+
+
+def build_shifted_grid():
+    """
+    A grid after two iterations, the points repeat three x values and the index of the input is not sorted
+    """
+    random = np.random.RandomState(5)
+    number_of_points = 200
+    coordinates = np.stack((random.choice([0.2, 0.5, 0.8], number_of_points),
+                            random.uniform(0.01, 0.99, number_of_points)), axis=1)
+    index = random.permutation(1000)[:number_of_points]
+    grid = build_grid(rows=12, number_of_points=number_of_points, coordinates=coordinates, index=index)
+    cells = grid.list_of_cells
+    for _ in range(2):
+        cells, _ = process.iteration(grid, cells)
+    return grid, index
+
+
+def test_chunked_csv_keeps_the_input_order(tmp_path):
+    grid, index = build_shifted_grid()
+    store = grid.points
+    assert len(np.unique(store.x_org)) == 3
+
+    path = str(tmp_path / 'result.csv')
+    assert export.write_result_csv(grid, path, chunksize=7) == len(index)
+    result = pd.read_csv(path, index_col=0, header=None)
+    np.testing.assert_array_equal(result.index.values, index)
+    # the csv does not keep the last bit of every float
+    np.testing.assert_allclose(result.values[:, 0], store.x_axis, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(result.values[:, 1], store.y_axis, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(result.values[:, 2], grid.heights[store.cell_ids], rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(result.values[:, 3:], store.data, rtol=1e-12, atol=1e-15)
+
+    # the same rows as one chunk
+    whole = str(tmp_path / 'whole.csv')
+    export.write_result_csv(grid, whole)
+    with open(path) as chunked, open(whole) as file:
+        assert chunked.read() == file.read()
+
+
+def test_chunked_columns_keep_the_input_order(tmp_path):
+    grid, index = build_shifted_grid()
+    store = grid.points
+
+    path = str(tmp_path / 'result')
+    assert export.write_result_columns(grid, path, chunksize=7) == len(index)
+    columns = export.read_result_columns(path, export.COLUMNS + ('cell_heights',))
+    np.testing.assert_array_equal(columns['index'], index)
+    np.testing.assert_array_equal(columns['dred1'], store.x_axis)
+    np.testing.assert_array_equal(columns['dred2'], store.y_axis)
+    np.testing.assert_array_equal(columns['heights'], grid.heights[store.cell_ids])
+    np.testing.assert_array_equal(columns['data'], store.data)
+    np.testing.assert_array_equal(columns['cell_heights'], grid.heights)
+    assert export.read_result_meta(path)['points'] == len(index)
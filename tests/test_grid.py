@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from conftest import build_grid
+from objects.grid import Grid
+
+
+def assert_statistics(grid):
+    """
+    Compares the running statistics of every cell with the mean and variance of the points of the cell
+    """
+    for cell_id, indices in enumerate(grid.cell_points):
+        assert grid.point_counts[cell_id] == len(indices)
+        assert (grid.points.cell_ids[indices] == cell_id).all()
+        cell = grid.list_of_cells[cell_id]
+        if not len(indices):
+            np.testing.assert_array_equal(grid.point_means[cell_id], 0)
+            np.testing.assert_array_equal(grid.point_m2[cell_id], 0)
+            assert cell.calc_ICV() == [0, []]
+            continue
+
+        data = grid.points.data[indices]
+        np.testing.assert_allclose(grid.point_means[cell_id], np.mean(data, axis=0), rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(grid.point_m2[cell_id] / len(indices), np.var(data, axis=0), rtol=1e-8,
+                                   atol=1e-12)
+        if len(indices) == 1:
+            assert cell.calc_ICV() == [0, 0]
+        else:
+            np.testing.assert_allclose(cell.calc_ICV()[0], np.var(data, axis=0, ddof=1).sum(), rtol=1e-8)
+
+
+def test_running_statistics_follow_added_and_removed_points():
+    grid = build_grid(rows=12, number_of_points=400)
+    assert_statistics(grid)
+    random = np.random.RandomState(1)
+
+    for _ in range(5):
+        # remove a batch of points from some cells and add them to other cells
+        removed = []
+        for cell_id in random.choice(np.flatnonzero(grid.point_counts), 15, replace=False).tolist():
+            indices = grid.cell_points[cell_id]
+            batch = random.choice(indices, random.randint(1, len(indices) + 1), replace=False)
+            grid.remove_points_from_cell(cell_id, batch)
+            removed.append(batch)
+        removed = np.concatenate(removed)
+        grid.add_points_to_cells(removed, random.randint(0, len(grid.cell_points), len(removed)))
+        assert_statistics(grid)
+
+
+def test_running_statistics_of_empty_and_single_point_cells():
+    grid = build_grid(rows=12, number_of_points=400)
+    cell_id = int(np.argmax(grid.point_counts))
+    indices = grid.cell_points[cell_id]
+
+    # all but one point, then the last one
+    grid.remove_points_from_cell(cell_id, indices[1:])
+    assert grid.point_counts[cell_id] == 1
+    np.testing.assert_allclose(grid.point_means[cell_id], grid.points.data[indices[0]], rtol=1e-10)
+    assert_statistics(grid)
+    grid.remove_points_from_cell(cell_id, indices[:1])
+    assert grid.point_counts[cell_id] == 0
+    assert_statistics(grid)
+
+    # an empty cell gets one point, then all points back
+    grid.add_points_to_cells(indices[:1], [cell_id])
+    np.testing.assert_array_equal(grid.point_means[cell_id], grid.points.data[indices[0]])
+    assert_statistics(grid)
+    grid.add_points_to_cells(indices[1:], np.full(len(indices) - 1, cell_id))
+    assert_statistics(grid)
+
+    # the representative of a cell with points is the mean of his points
+    grid.list_of_cells[cell_id].calc_representative()
+    np.testing.assert_allclose(grid.representatives[cell_id], np.mean(grid.points.data[indices], axis=0),
+                               rtol=1e-10)
+
+
+def cell_id(grid, tmp_x, tmp_y):
+    # the first row of cells is the upper one
+    return (grid.columns - 1 - tmp_y) * grid.rows + tmp_x
+
+
+def test_points_on_cell_edges_and_on_the_outer_border():
+    # cellwidth 1/8 and start -1/8, so every edge is exact in floating point
+    grid = Grid.autogenerated(rows=10, dimension=1)
+    border = grid.posx.min() + grid.rows * grid.cellwidth
+    assert border == 1.125
+
+    points = [
+        # x, y, cell (tmp_x, tmp_y)
+        (0.25, 0.5, (3, 5)),  # an inner edge belongs to the cell on the right and upper side
+        (0.3, 0.25, (3, 3)),
+        (0.0, 0.0, (1, 1)),
+        (-0.125, -0.125, (0, 0)),  # the outer left and lower border
+        (1.0, 0.3, (9, 3)),  # the edge to the border cells
+        (1.125, 0.3, (9, 3)),  # the outer right border
+        (0.3, 1.125, (3, 9)),  # the outer upper border
+        (1.125, 1.125, (9, 9)),
+    ]
+    x_axis = np.array([point[0] for point in points])
+    y_axis = np.array([point[1] for point in points])
+    expected = np.array([cell_id(grid, *point[2]) for point in points])
+    np.testing.assert_array_equal(grid.bin_points(x_axis, y_axis), expected)
+
+    # assign_points puts every point into this cell
+    table = pd.DataFrame(np.stack((x_axis, y_axis, np.arange(len(points))), axis=1),
+                         index=np.arange(1, len(points) + 1))
+    assert not len(grid.init_points_to_right_cell(table))
+    np.testing.assert_array_equal(grid.points.cell_ids, expected)
+    np.testing.assert_array_equal(grid.points.org_ids, expected)
+    for position, cell in enumerate(expected.tolist()):
+        assert position in grid.cell_points[cell]
+
+
+def test_points_outside_of_the_grid():
+    grid = Grid.autogenerated(rows=10, dimension=1)
+    x_axis = np.array([np.nextafter(1.125, 2), 0.3, -0.125 - 1e-12, 0.3, np.nan])
+    y_axis = np.array([0.3, np.nextafter(1.125, 2), 0.3, -0.2, 0.3])
+    np.testing.assert_array_equal(grid.bin_points(x_axis, y_axis), -1)
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import ingest
+from objects.grid import Grid
+
+
+def write_input(path, number_of_points=100, dimension=3):
+    random = np.random.RandomState(6)
+    values = np.concatenate((random.uniform(0.01, 0.99, (number_of_points, 2)),
+                             random.normal(size=(number_of_points, dimension))), axis=1)
+    pd.DataFrame(values, index=np.arange(1, number_of_points + 1)).to_csv(path, header=False)
+    return values
+
+
+def test_cache_is_written_and_read(tmp_path):
+    path = str(tmp_path / 'input.csv')
+    values = write_input(path)
+    grid = Grid.autogenerated(rows=12, dimension=3)
+    ingest.ingest(grid, path, dtype='float64', chunksize=30)
+    assert os.path.isdir(ingest.calc_cache_dir(path))
+
+    cached = Grid.autogenerated(rows=12, dimension=3)
+    ingest.ingest(cached, path, dtype='float64', chunksize=30)
+    np.testing.assert_array_equal(cached.points.data, grid.points.data)
+    np.testing.assert_allclose(cached.points.data, values[:, 2:], rtol=1e-12)
+    np.testing.assert_array_equal(cached.point_counts, grid.point_counts)
+    assert sorted(os.listdir(str(tmp_path))) == ['input.csv', 'input.csv.cache']
+
+
+def test_failed_conversion_leaves_no_directory(tmp_path, monkeypatch):
+    path = str(tmp_path / 'input.csv')
+    write_input(path)
+    # one row more than the file has
+    monkeypatch.setattr(ingest, 'count_rows', lambda input_csv: 101)
+    grid = Grid.autogenerated(rows=12, dimension=3)
+    with pytest.raises(ValueError):
+        ingest.ingest(grid, path, dtype='float64', chunksize=30)
+    assert os.listdir(str(tmp_path)) == ['input.csv']
+    assert grid.points is None
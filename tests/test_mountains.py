@@ -0,0 +1,72 @@
+import numpy as np
+import math_functions as mf
+from conftest import build_grid
+
+
+def sorted_roots(roots):
+    roots = np.asarray(roots, dtype=complex)
+    roots = roots[~np.isnan(roots)]
+    return roots[np.lexsort((roots.imag, roots.real))]
+
+
+def test_cubic_roots_equal_np_roots():
+    random = np.random.RandomState(3)
+    coefficients = random.normal(size=(50, 4))
+    # degenerate leading coefficients, the polynomials have less than three roots
+    coefficients[5, 0] = 0
+    coefficients[6, :2] = 0
+    coefficients[7, :3] = 0
+    coefficients[8] = [0, 1, -2, 1]
+    coefficients[9] = [4, -12, 12, -4]
+
+    roots = mf.calc_cubic_roots(coefficients)
+    assert roots.shape == (50, 3)
+    for row in range(len(coefficients)):
+        expected = sorted_roots(np.roots(coefficients[row]))
+        np.testing.assert_allclose(sorted_roots(roots[row]), expected, rtol=1e-6, atol=1e-6)
+    assert np.isnan(roots[5, 2]) and np.isnan(roots[6, 1:]).all() and np.isnan(roots[7]).all()
+
+
+def reference_mountain_height(grid, cell_id):
+    """
+    The height of one cell like the loop over np.roots before the batched version
+    """
+    neighbour_ids = grid.direct_neighbour_ids[cell_id]
+    neighbour_ids = neighbour_ids[neighbour_ids >= 0]
+    if not grid.point_counts[neighbour_ids].sum():
+        return 0, False
+
+    h = grid.heights[neighbour_ids]
+    weight = grid.neutral_variance / max(grid.neutral_variance, grid.icvs[cell_id])
+    r = weight * np.sqrt(mf.calc_neighbour_distances_nD(grid, [cell_id])[0][grid.direct_neighbour_ids[cell_id] >= 0])
+    a = 4 * len(h)
+    b = -12 * h.sum()
+    c = 4 * grid.cellwidth * len(h) - 4 * r.sum() + 12 * (h ** 2).sum()
+    d = -4 * grid.cellwidth * h.sum() + 4 * (h * r).sum() - 4 * (h ** 3).sum()
+    roots = np.roots([a, b, c, d])
+    roots = np.real(roots[np.isreal(roots)])
+
+    # roots >= -0.1 are preferred
+    preferred = roots[roots >= -0.1]
+    candidates = preferred if len(preferred) else roots
+    errors = [mf.calc_localerrors(grid, [cell_id], heights_to_test=[root])[0] for root in candidates]
+    return candidates[np.argmin(errors)], not len(preferred)
+
+
+def test_mountain_heights_equal_np_roots_cell_by_cell():
+    grid = build_grid(rows=12, number_of_points=200)
+    random = np.random.RandomState(4)
+    grid.heights[:] = random.uniform(0, 0.3, len(grid.heights))
+    # cells between very low neighbours only have roots < -0.1
+    low = grid.direct_neighbour_ids[[26, 90]].ravel()
+    grid.heights[low[low >= 0]] = -2
+
+    cell_ids = np.arange(len(grid.heights))
+    heights = mf.calc_mountain_heights(grid, cell_ids)
+    fallbacks = 0
+    for cell_id in cell_ids.tolist():
+        expected, fallback = reference_mountain_height(grid, cell_id)
+        np.testing.assert_allclose(heights[cell_id], expected, rtol=1e-7, atol=1e-9, err_msg=str(cell_id))
+        fallbacks += fallback
+    assert fallbacks >= 2
+    assert (heights[[26, 90]] < -0.1).all()
@@ -0,0 +1,76 @@
+import numpy as np
+import math_functions as mf
+from conftest import build_grid
+
+
+def build_hilly_grid():
+    """
+    Builds a small grid with empty cells and random heights, the empty cells have the height 0
+    """
+    grid = build_grid(rows=12, number_of_points=150)
+    random = np.random.RandomState(2)
+    grid.heights[:] = np.where(grid.point_counts > 0, random.uniform(0, 0.4, len(grid.heights)), 0)
+    assert (grid.point_counts == 0).any()
+    return grid
+
+
+def test_batched_neighbourhoods_equal_dijkstra_for_every_cell():
+    grid = build_hilly_grid()
+    max_distance = 5 * (1 / grid.rows)
+    grid.calc_neighbourhoods(max_distance)
+
+    for cell in grid.list_of_cells:
+        expected = {neighbour.id: distance for neighbour, distance in grid.calc_neighbourhood(max_distance, cell)}
+        ids, distances = grid.get_neighbourhood(cell.id)
+        assert sorted(ids.tolist()) == sorted(expected)
+        np.testing.assert_allclose(distances, [expected[cell_id] for cell_id in ids.tolist()], rtol=1e-12)
+
+
+def test_neighbourhoods_of_some_cells_equal_all_neighbourhoods():
+    grid = build_hilly_grid()
+    max_distance = 5 * (1 / grid.rows)
+    grid.calc_neighbourhoods(max_distance)
+    expected_ids = grid.neighbourhood_ids.copy()
+    expected_distances = grid.neighbourhood_distances.copy()
+
+    cell_ids = np.array([3, 40, 41, 100, 143])
+    grid.neighbourhood_ids[cell_ids] = -1
+    grid.neighbourhood_distances[cell_ids] = np.inf
+    grid.calc_neighbourhoods(max_distance, cell_ids)
+    np.testing.assert_array_equal(grid.neighbourhood_ids, expected_ids)
+    np.testing.assert_array_equal(grid.neighbourhood_distances, expected_distances)
+
+
+def test_manipulated_representatives_sum_the_moves_towards_all_neighbours():
+    grid = build_hilly_grid()
+    grid.calc_neighbourhoods(5 * (1 / grid.rows))
+    new_representatives = mf.calc_manipulated_representatives(grid)
+
+    for cell in grid.list_of_cells:
+        if not grid.has_representative[cell.id]:
+            np.testing.assert_array_equal(new_representatives[cell.id], grid.representatives[cell.id])
+            continue
+        ids, _ = grid.get_neighbourhood(cell.id)
+        delta = np.zeros(grid.dimension)
+        for neighbour_id in ids.tolist():
+            if grid.has_representative[neighbour_id]:
+                distance = mf.calc_distance_2D(grid, cell, grid.list_of_cells[neighbour_id])
+                delta += (grid.representatives[neighbour_id] - grid.representatives[cell.id]) / (1 + distance)
+        np.testing.assert_allclose(new_representatives[cell.id], grid.representatives[cell.id] + delta / len(ids),
+                                   rtol=1e-12, atol=1e-12)
+
+
+def test_manipulated_representative_with_two_neighbours():
+    # a flat grid with radius 1: the neighbourhood of a cell is the cell itself and its four direct neighbours
+    grid = build_grid(rows=6, number_of_points=0, dimension=2)
+    grid.calc_neighbourhoods(grid.cellwidth)
+    cell_id = 2 * grid.rows + 2
+    right, left = grid.direct_neighbour_ids[cell_id, :2]
+    grid.representatives[[cell_id, right, left]] = [[0, 0], [1, 0], [0, 2]]
+    grid.has_representative[:] = False
+    grid.has_representative[[cell_id, right, left]] = True
+
+    # both neighbours move the representative, the size of the neighbourhood is 5
+    weight = 1 / (1 + grid.cellwidth)
+    expected = weight * np.array([1, 2]) / 5
+    np.testing.assert_allclose(mf.calc_manipulated_representatives(grid, [cell_id])[0], expected, rtol=1e-12)
@@ -0,0 +1,47 @@
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+import parallel
+import process
+from conftest import build_grid
+from objects.grid import Grid
+
+
+def run(grid, executor, iterations=3):
+    cells = grid.list_of_cells
+    with executor:
+        for _ in range(iterations):
+            cells, _ = process.iteration(grid, cells, executor)
+    return grid
+
+
+def test_tiled_executor_equals_serial_executor():
+    serial = build_grid()
+    tiled = build_grid()
+    max_distance = process.MAX_DISTANCE * (1 / tiled.rows)
+    run(serial, parallel.SerialExecutor(serial))
+    run(tiled, parallel.TiledExecutor(tiled, workers=2, max_distance=max_distance))
+
+    for name in Grid.ARRAYS:
+        np.testing.assert_array_equal(getattr(tiled, name), getattr(serial, name), err_msg=name)
+    np.testing.assert_array_equal(tiled.points.cell_ids, serial.points.cell_ids)
+    np.testing.assert_array_equal(tiled.points.x_axis, serial.points.x_axis)
+    np.testing.assert_array_equal(tiled.points.y_axis, serial.points.y_axis)
+
+
+def test_shared_memory_is_released_when_a_worker_raises():
+    grid = build_grid()
+    heights = grid.heights.copy()
+    executor = parallel.TiledExecutor(grid, workers=2, max_distance=process.MAX_DISTANCE * (1 / grid.rows))
+    names = [block.name for block in executor.blocks]
+    with pytest.raises(ValueError):
+        with executor:
+            executor._map('unknown phase', np.arange(len(grid.heights)))
+
+    assert executor.pool is None and not executor.blocks
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    # the grid works on his own arrays again
+    assert grid.heights.base is None
+    np.testing.assert_array_equal(grid.heights, heights)
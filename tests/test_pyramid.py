@@ -0,0 +1,53 @@
+import numpy as np
+import math_functions as mf
+import process
+import pyramid
+from conftest import build_grid
+
+
+def test_upsample_keeps_the_interpolated_representatives():
+    coarse = build_grid(rows=12, number_of_points=300)
+    cells = coarse.list_of_cells
+    for _ in range(3):
+        cells, _ = process.iteration(coarse, cells)
+    number_of_points = len(coarse.points)
+    coarse_heights = coarse.heights.copy()
+
+    fine = pyramid.upsample(coarse, 22)
+    assert (fine.rows, fine.columns) == (22, 22)
+
+    # the representatives at the centers of the new cells, cells without representative do not count
+    x = (fine.posx - coarse.posx.min()) / coarse.cellwidth + (fine.cellwidth / coarse.cellwidth - 1) / 2
+    y = (coarse.posy.max() - fine.posy) / coarse.cellwidth - (fine.cellwidth / coarse.cellwidth - 1) / 2
+    weights = coarse.has_representative.astype(float)
+    weight = mf.calc_bilinear(weights.reshape(coarse.columns, coarse.rows), y, x)
+    representatives = mf.calc_bilinear((coarse.representatives * weights[:, None]).reshape(
+        coarse.columns, coarse.rows, coarse.dimension), y, x)
+    interpolated = weight > 0
+    assert interpolated.mean() > 0.5
+    np.testing.assert_allclose(fine.representatives[interpolated],
+                               representatives[interpolated] / weight[interpolated][:, None], rtol=1e-12)
+
+    # only cells with points and without interpolated representative get the mean of their points
+    means = ~interpolated & (fine.point_counts > 0)
+    np.testing.assert_array_equal(fine.representatives[means], fine.point_means[means])
+    assert fine.has_representative[interpolated | means].all()
+
+    # the heights are fitted to the new grid
+    assert np.isfinite(fine.heights).all()
+    assert not np.allclose(fine.heights, mf.calc_bilinear(coarse_heights.reshape(12, 12), y, x))
+
+    # every point is in a cell of the new grid
+    store = fine.points
+    assert fine.point_counts.sum() == number_of_points
+    assert (store.cell_ids >= 0).all()
+    np.testing.assert_array_equal(store.org_ids, fine.bin_points(store.x_org, store.y_org))
+
+
+def test_upsample_without_height_passes_interpolates_the_heights():
+    coarse = build_grid(rows=12, number_of_points=300)
+    coarse.heights[:] = np.random.RandomState(7).uniform(0, 0.3, len(coarse.heights))
+    fine = pyramid.upsample(coarse, 22, height_passes=0)
+    x = (fine.posx - coarse.posx.min()) / coarse.cellwidth + (fine.cellwidth / coarse.cellwidth - 1) / 2
+    y = (coarse.posy.max() - fine.posy) / coarse.cellwidth - (fine.cellwidth / coarse.cellwidth - 1) / 2
+    np.testing.assert_array_equal(fine.heights, mf.calc_bilinear(coarse.heights.reshape(12, 12), y, x))